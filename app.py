@@ -1,120 +1,76 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
-from scheduler import schedule_job, remove_job, scheduler
-from visual_capture import capture_job
-import json, os, glob
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, stream_with_context
+from scheduler import remove_job, scheduler, scheduler_stats
+import os
+import storage
 from cleanup import cleanup_screenshots
+import browser_pool, baseline_cache, blobstore, thumbnails, regions, viewports, tiles, comparators, metrics, jobqueue, jobs, site_state, blocking, asset_cache, batch, diffs, atexit
+from werkzeug.utils import safe_join
 app = Flask(__name__)
+app.jinja_env.filters["thumb"] = thumbnails.thumb_url
 #scheduler.start()
-#DATA_FILE is where all the sites are stored.  Ideally this could be a database if you wanted to scale.  For my homelab, no point.
-DATA_FILE = "sites.json"
+#sites, captures and changes live in SQLite now (see storage.py), the old JSON files get imported on first start.
+DATA_FILE = storage.SITES_JSON
 CHANGE_DIR = "changes"
 
 # --------------------
 # Utility Functions 
 # --------------------
-#if DATA_FILE exists, return full JSON array
-def load_sites():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                print("[ERROR] Invalid sites.json")
-    return {}
-#dump returned data on 'sites' to sites.json
-def save_sites(sites):
-    with open(DATA_FILE, "w") as f:
-        json.dump(sites, f, indent=2)
-
-monitored_sites = load_sites()
+###site records live in site_state.py: handlers read site_state.snapshot() (never mutate it) and
+###write through site_state.put/update/delete, which persist on its writer thread
+storage.import_if_empty()
+storage.ensure_summaries()
 
 # --------------------
 # Screenshot Loading
 # --------------------
+### count is per viewport, a site captured at three breakpoints gets up to 3 * count images
 def get_recent_screenshots(site_name, count=6):
-    folder = f'screenshots/{site_name}'
-    images = sorted(
-        glob.glob(f"{folder}/*.png"),
-        key=lambda x: os.path.getmtime(x),
-        reverse=True
-    )
-    images = [img.replace("screenshots/", "/static/screenshots/") for img in images[:count]]
-
-    change_flag = False
-    meta_path = os.path.join(folder, 'metadata.json')
-
-    if os.path.exists(meta_path):
-        with open(meta_path, 'r') as f:
-            try:
-                metadata = json.load(f)
-                recent = sorted(metadata, key=lambda x: x['timestamp'], reverse=True)[:count]
-                if recent and recent[0].get("is_significant_change", False):
-                    change_flag = True
-            except json.JSONDecodeError:
-                print(f"[!] Skipping invalid metadata file: {meta_path}")
-
+    if count <= storage.SUMMARY_IMAGES:
+        summary = storage.get_summary(site_name)
+        images, seen = [], {}
+        for image in summary["images"]:
+            seen[image.get("viewport")] = seen.get(image.get("viewport"), 0) + 1
+            if seen[image.get("viewport")] <= count:
+                images.append(image)
+        return images, summary["latest_significant"]
+    recent = storage.recent_captures(site_name, count)
+    images = [{"src": r["path"].replace("screenshots/", "/static/screenshots/", 1), "timestamp": r["timestamp"],
+               "viewport": r.get("viewport")} for r in recent]
+    change_flag = bool(recent and recent[0].get("is_significant_change", False))
     return images, change_flag
 
-### Read /changes folder latest JSON for changes
-def load_changes(site_name):
-    log_path = f"screenshots/{site_name}/changes/change_log.json"
-    if not os.path.exists(log_path):
-        return []
+### alert state straight off the summary row: newest change not yet dismissed
+def has_alert(site, summary):
+    latest_ts = summary["latest_change_ts"] if summary else None
+    return bool(latest_ts and latest_ts != site.get("last_dismissed"))
 
+### changes for a site, newest first
+def load_changes(site_name, limit=storage.HISTORY_PAGE_MAX):
     try:
-        with open(log_path, "r") as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                changes = data
-            else:
-                changes = [data]
+        return storage.changes_page(site_name, limit=limit)[0]
     except Exception as e:
-        print(f"[!] Failed to load change_log.json: {e}")
+        print(f"[!] Failed to load changes for {site_name}: {e}")
         return []
 
-    # Validate image paths
-    validated = []
-    for change in changes:
-        prev_path = change.get("prev", "").replace("/static/", "")
-        curr_path = change.get("curr", "").replace("/static/", "")
-        if os.path.exists(prev_path) and os.path.exists(curr_path):
-            validated.append(change)
-
-    validated.sort(key=lambda c: c.get("timestamp", ""), reverse=True)
-    return validated
-
 # --------------------
 # Flask Routes
 # --------------------
 ### The dashboard
 @app.route("/")
 def dashboard():
+    ###one query for every site's summary, no per-site globbing or history parsing
+    summaries = storage.load_summaries()
     sites_with_images = {}
-    for job_id, site in monitored_sites.items():
-        site_name = site["site_name"]
-
-        try:
-            images, _ = get_recent_screenshots(site_name)
-        except Exception as e:
-            print(f"[!] Failed to load screenshots for {site_name}: {e}")
-            images = []
-
-        try:
-            changes = load_changes(site_name)
-        except Exception as e:
-            print(f"[!] Failed to load changes for {site_name}: {e}")
-            changes = []
-
-        last_dismissed = site.get("last_dismissed")
-        latest_ts = max((c["timestamp"] for c in changes if "timestamp" in c), default=None)
-        change_detected = latest_ts and latest_ts != last_dismissed
+    for job_id, site in site_state.snapshot().items():
+        summary = summaries.get(site["site_name"])
+        latest = summary["latest_change"] if summary else None
 
         sites_with_images[job_id] = {
             **site,
-            "images": images,
-            "changes": changes,
-            "last_dismissed": last_dismissed,
-            "change_detected": change_detected
+            "images": summary["images"] if summary else [],
+            "changes": [latest] if latest else [],
+            "last_dismissed": site.get("last_dismissed"),
+            "change_detected": has_alert(site, summary)
         }
 
     return render_template("dashboard.html", sites=sites_with_images)
@@ -123,38 +79,68 @@ def dashboard():
 @app.route("/site/<site_name>")
 def site_detail(site_name):
     job_id = f"site_{site_name}"
-    if job_id not in monitored_sites:
+    site = site_state.snapshot().get(job_id)
+    if site is None:
         return "Site not found", 404
 
-    site = monitored_sites[job_id]
-
-    #Provide a default viewport if it's missing
-    if "viewport" not in site or not isinstance(site["viewport"], list) or len(site["viewport"]) != 2:
-        site["viewport"] = [1366, 768]
+    #Provide a default viewport if it's missing (or broken), one [w, h] or a list of them
+    site_viewports = viewports.for_site(site)
 
     images, _ = get_recent_screenshots(site_name)
-    changes = load_changes(site_name)
+    ###only the newest run's changes (one per breakpoint) are rendered here, the history list
+    ###pages through /site/<name>/history as it's scrolled
+    changes = load_changes(site_name, limit=len(site_viewports))
+    changes = [c for c in changes if c["timestamp"] == changes[0]["timestamp"]] if changes else []
     last_dismissed = site.get("last_dismissed")
-    latest_ts = max((c.get("timestamp") for c in changes if "timestamp" in c), default=None)
+    latest_ts = changes[0]["timestamp"] if changes else None
     change_detected = latest_ts and latest_ts != last_dismissed
 
     return render_template("site_detail.html", site={
         **site,
+        "viewport": viewports.to_record(site_viewports),
         "images": images,
+        "image_groups": viewports.group(images, site_viewports),
+        "viewports": site_viewports,
         "changes": changes,
         "last_dismissed": last_dismissed,
         "change_detected": change_detected
     })
 
+### change history, a page at a time (the site page loads the next one as it's scrolled to)
+###   GET /site/<name>/history?limit=20&cursor=<next_cursor>&dismissed=false&min_score=50&max_score=&viewport=390x844
+### score is the change's MSE; next_cursor is null on the last page
+@app.route("/site/<site_name>/history")
+def site_history(site_name):
+    if f"site_{site_name}" not in site_state.snapshot():
+        return jsonify({"error": "Site not found"}), 404
+    args = request.args
+    dismissed = {"true": True, "1": True, "false": False, "0": False}.get(args.get("dismissed", "").lower())
+    try:
+        changes, next_cursor = storage.changes_page(
+            site_name,
+            limit=int(args.get("limit", 20)),
+            cursor=args.get("cursor") or None,
+            dismissed=dismissed,
+            min_score=float(args["min_score"]) if args.get("min_score") else None,
+            max_score=float(args["max_score"]) if args.get("max_score") else None,
+            viewport=args.get("viewport") or None,
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+    for change in changes:
+        change["thumbs"] = {k: thumbnails.thumb_url(change[k], "md") for k in ("prev", "curr", "diff") if change.get(k)}
+    return jsonify({"changes": changes, "next_cursor": next_cursor})
+
 ### passback for editing
 @app.route("/edit-site/<site_name>", methods=["POST"])
 def edit_site(site_name):
     job_id = f"site_{site_name}"
-    if job_id not in monitored_sites:
+    site = site_state.get(job_id)
+    if site is None:
         return jsonify({"error": "Site not found"}), 404
 
     data = request.json
-    site = monitored_sites[job_id]
+    before = dict(site)
 
     # Make sure "site_name" is always included
     site["site_name"] = site.get("site_name", site_name)
@@ -162,29 +148,50 @@ def edit_site(site_name):
     # Assign safe values for all editable fields
     site["url"] = data.get("url", site.get("url", ""))
     site["interval_minutes"] = data.get("interval_minutes", site.get("interval_minutes", 10))
-    site["viewport"] = data.get("viewport", site.get("viewport", [1366, 768]))
+    try:
+        site["viewport"] = viewports.to_record(viewports.normalize(data.get("viewport", site.get("viewport"))))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid viewport: {e}"}), 400
     site["cookie_accept_selector"] = data.get("cookie_accept_selector", site.get("cookie_accept_selector", None))
     site["wait_time"] = float(data.get("wait_time", site.get("wait_time", 2)))
+    try:
+        site["regions"] = regions.normalize(data.get("regions", site.get("regions")))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid regions: {e}"}), 400
+    site["capture_mode"] = data.get("capture_mode", site.get("capture_mode", "viewport"))
+    site["capture_selector"] = data.get("capture_selector", site.get("capture_selector")) or None
+    if site["capture_mode"] not in tiles.CAPTURE_MODES:
+        return jsonify({"error": f"Invalid capture mode, expected one of {', '.join(tiles.CAPTURE_MODES)}"}), 400
+    if site["capture_mode"] == "element" and not site["capture_selector"]:
+        return jsonify({"error": "Element capture needs a capture_selector"}), 400
+    site["comparator"] = data.get("comparator", site.get("comparator")) or comparators.DEFAULT_COMPARATOR
+    if site["comparator"] not in comparators.COMPARATORS:
+        return jsonify({"error": f"Invalid comparator, expected one of {', '.join(comparators.COMPARATORS)}"}), 400
+    if "align_shifts" in data:
+        site["align_shifts"] = bool(data["align_shifts"])
+    # browser asset cache (asset_cache.py) and page snapshots for replay.py
+    for flag in ("asset_cache", "snapshots"):
+        if flag in data:
+            site[flag] = bool(data[flag])
+    try:
+        # for POST /capture {"tags": [...]}
+        site["tags"] = batch.normalize_tags(data.get("tags", site.get("tags")))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid tags: {e}"}), 400
+    try:
+        site["blocking"] = blocking.normalize(data.get("blocking", site.get("blocking")))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid blocking: {e}"}), 400
 
-    # Save updated site info
-    monitored_sites[job_id] = site
-    save_sites(monitored_sites)
-
-    # Pull safe values for the scheduled job
-    url = site["url"]
-    name = site["site_name"]
-    interval = site["interval_minutes"]
-    viewport = site["viewport"]
-    selector = site.get("cookie_accept_selector")
-    wait_time = site.get("wait_time", 4000)
+    # Save only the fields this edit changed: a capture or dismiss that updated the record since
+    # the get() above (change_detected, last_dismissed...) must not be written back over
+    changed = {k: v for k, v in site.items() if k not in before or before[k] != v}
+    if changed:
+        site_state.update(job_id, **changed)
 
-    remove_job(job_id)
-    schedule_job(
-        job_id,
-        lambda url=url, name=name, viewport=viewport, selector=selector, wait_time=wait_time:
-            capture_job(url, name, viewport, selector, wait_time),
-        interval
-    )
+    ###the job reads the saved record on every run (jobs.py), only a new interval/url needs a new trigger
+    if not site.get("paused") and jobs.needs_reschedule(before, site):
+        jobs.schedule_site(job_id, site)
 
     return jsonify({"status": "Site updated"})
 
@@ -194,43 +201,27 @@ from flask import abort
 @app.route("/pause-site/<site_name>", methods=["POST"])
 def pause_site(site_name):
     job_id = f"site_{site_name}"
-    if job_id not in monitored_sites:
+    if job_id not in site_state.snapshot():
         return jsonify({"error": "Site not found"}), 404
 
     remove_job(job_id)
-    monitored_sites[job_id]["paused"] = True
-    save_sites(monitored_sites)
+    site_state.update(job_id, paused=True)
     return jsonify({"status": "paused"})
 
 
 @app.route("/resume-site/<site_name>", methods=["POST"])
 def resume_site(site_name):
     job_id = f"site_{site_name}"
-    if job_id not in monitored_sites:
+    site = site_state.get(job_id)
+    if site is None:
         return jsonify({"error": "Site not found"}), 404
-
-    site = monitored_sites[job_id]
     if not site.get("paused"):
         return jsonify({"error": "Site is not paused"}), 400
 
-    # Re-schedule the job
-    url = site["url"]
-    name = site["site_name"]
-    interval = site["interval_minutes"]
-    viewport = site.get("viewport", [1366, 768])
-    selector = site.get("cookie_accept_selector")
-    wait_time = site.get("wait_time", 2)
-
-    schedule_job(
-        job_id,
-        lambda url=url, name=name, viewport=viewport, selector=selector, wait=wait_time:
-            capture_job(url, name, viewport, selector, wait),
-        interval
-    )
-
+    # save first, the job reads the record when it runs
     site["paused"] = False
-    monitored_sites[job_id] = site
-    save_sites(monitored_sites)
+    site_state.update(job_id, paused=False)
+    jobs.schedule_site(job_id, site)
 
     return jsonify({"status": "resumed"})
 
@@ -239,11 +230,38 @@ def resume_site(site_name):
 def favicon():
     return send_from_directory('static', 'gptFavicon.png', mimetype='image/png')
 
+def _ensure_diff(filename):
+    # diffs/... images are drawn from the two stored frames the first time they're asked for (diffs.py)
+    if not filename.startswith("diffs/"):
+        return True
+    try:
+        return diffs.ensure(filename) is not None
+    except Exception as e:
+        print(f"[!] Failed to render diff {filename}: {e}")
+        return False
+
 ### let us view screenshots in browser (and lightbox, and filmstrip)
 @app.route('/static/screenshots/<path:filename>')
 def serve_screenshot(filename):
+    if not _ensure_diff(filename):
+        abort(404)
     return send_from_directory('screenshots', filename)
 
+### small previews for cards/filmstrip/history, built on the spot if the background job hasn't (or they got deleted)
+@app.route('/thumbs/<size>/<path:filename>')
+def serve_thumbnail(size, filename):
+    full = safe_join('screenshots', filename)
+    if full is None or not _ensure_diff(filename) or not os.path.exists(full):
+        abort(404)
+    try:
+        thumb = thumbnails.ensure_thumbnail(full, size)
+    except Exception as e:
+        print(f"[!] Failed to build thumbnail for {full}: {e}")
+        thumb = None
+    if not thumb:
+        return send_from_directory('screenshots', filename)
+    return send_from_directory('screenshots', os.path.relpath(thumb, 'screenshots'), max_age=86400)
+
 ### Literally all this for CSS and JS.  Again, flask is not perfect.
 @app.route('/css/<path:filename>')
 def custom_css(filename):
@@ -261,50 +279,66 @@ def add_site():
     url = data['url']
     site_name = data['site_name']
     interval = data['interval_minutes']
-    viewport = data.get('viewport', [1366, 768])  # default fallback
     cookie_selector = data.get('cookie_accept_selector', None)
     wait_time = data.get('wait_time', 2)  # default to 2 seconds
+    try:
+        # [w, h], or a list of them to capture several breakpoints from one page load
+        viewport = viewports.to_record(viewports.normalize(data.get('viewport')))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid viewport: {e}"}), 400
+    try:
+        site_regions = regions.normalize(data.get('regions'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid regions: {e}"}), 400
+    capture_mode = data.get('capture_mode') or "viewport"  # or "full_page", or "element" + capture_selector
+    capture_selector = data.get('capture_selector') or None
+    if capture_mode not in tiles.CAPTURE_MODES or (capture_mode == "element" and not capture_selector):
+        return jsonify({"error": f"Invalid capture mode, expected one of {', '.join(tiles.CAPTURE_MODES)} (element needs capture_selector)"}), 400
+    comparator = data.get('comparator') or comparators.DEFAULT_COMPARATOR  # "mse" or "ssim", see comparators.py
+    if comparator not in comparators.COMPARATORS:
+        return jsonify({"error": f"Invalid comparator, expected one of {', '.join(comparators.COMPARATORS)}"}), 400
+    try:
+        # request blocking, see blocking.py
+        site_blocking = blocking.normalize(data.get('blocking'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid blocking: {e}"}), 400
+    try:
+        tags = batch.normalize_tags(data.get('tags'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid tags: {e}"}), 400
 
-    def job():
-        if monitored_sites.get(job_id, {}).get("paused"):
-            print(f"[⏸] Skipping {job_id} — site is paused.")
-            return
-
-        changed, before, after = capture_job(url, site_name, viewport)
-
-        if changed:
-            ts = os.path.basename(after).replace(".png", "")
-            change_dir = f"screenshots/{site_name}/changes"
-            os.makedirs(change_dir, exist_ok=True)
-            metadata = {
-                "timestamp": ts,
-                "prev": before.replace("screenshots/", "/static/screenshots/"),
-                "curr": after.replace("screenshots/", "/static/screenshots/")
-            }
-            with open(f"{change_dir}/{ts}.json", "w") as f:
-                json.dump(metadata, f, indent=2)
-
-    schedule_job(job_id, job, interval)
-
-    monitored_sites[job_id] = {
+    site = {
         "url": url,
         "site_name": site_name,
         "interval_minutes": interval,
         "viewport": viewport,
         "cookie_accept_selector": cookie_selector,
-        "wait_time": wait_time
+        "wait_time": wait_time,
+        "regions": site_regions,
+        "capture_mode": capture_mode,
+        "capture_selector": capture_selector,
+        "comparator": comparator,
+        "align_shifts": data.get('align_shifts'),
+        "blocking": site_blocking,
+        "asset_cache": data.get('asset_cache', True),
+        "snapshots": data.get('snapshots', False),
+        "tags": tags
     }
 
-    save_sites(monitored_sites)
+    site_state.put(job_id, site)
+    jobs.schedule_site(job_id, site)
     return jsonify({"status": "scheduled"})
 
 ### passback for removal
 @app.route("/remove-site/<job_id>", methods=["DELETE"])
 def remove_site(job_id):
     remove_job(job_id)
-    if job_id in monitored_sites:
-        monitored_sites.pop(job_id)
-        save_sites(monitored_sites)
+    site = site_state.snapshot().get(job_id)
+    if site is not None:
+        site_state.delete(job_id)   # captures and changes go with it, see storage.delete_site
+        baseline_cache.cache.drop_site(site.get("site_name"))
+        metrics.forget_site(site.get("site_name"))
+        blocking.forget_site(site.get("site_name"))
     return jsonify({"status": "removed"})
 
 ### passback for calls to dismiss alerts.  This could use some work I think...
@@ -313,44 +347,29 @@ def dismiss_alert(site_name):
     print(f"[✓] Dismiss request received for: {site_name}")
 
     job_id = f"site_{site_name}"
-    if job_id not in monitored_sites:
+    if job_id not in site_state.snapshot():
         print(f"[✗] Job ID not found: {job_id}")
         return jsonify({"error": "Site not found"}), 404
 
-    site = monitored_sites[job_id]
-    changes = load_changes(site_name)
+    latest = storage.latest_change(site_name)
 
-    if not changes:
+    if not latest:
         print("[!] No changes to dismiss.")
         return jsonify({"error": "No changes to dismiss"}), 400
 
-    # Get latest change by timestamp
-    latest = sorted(changes, key=lambda c: c.get("timestamp", ""), reverse=True)[0]
     ts = latest["timestamp"]
-    json_path = f"screenshots/{site_name}/changes/{ts}.json"
 
     try:
-        with open(json_path, "r") as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            data["dismissed"] = True
-        elif isinstance(data, list):
-            if data:
-                data[0]["dismissed"] = True
-
-        with open(json_path, "w") as f:
-            json.dump(data, f, indent=2)
+        storage.dismiss_change(site_name, ts)
 
         # Optionally: track dismissal timestamp
-        site["last_dismissed"] = ts
-        monitored_sites[job_id] = site
-        save_sites(monitored_sites)
+        site_state.update(job_id, last_dismissed=ts)
 
-        print("[✓] Dismissal saved to file and memory.")
+        print("[✓] Dismissal saved to database and memory.")
         return jsonify({"status": "dismissed"})
 
     except Exception as e:
-        print(f"[!] Failed to update change file: {e}")
+        print(f"[!] Failed to record dismissal: {e}")
         return jsonify({"error": "Failed to dismiss"}), 500
 
 
@@ -360,7 +379,8 @@ def status_page():
     names = []
     statuses = []
 
-    for site in monitored_sites.values():
+    summaries = storage.load_summaries()
+    for site in site_state.snapshot().values():
         site_name = site.get("site_name", "unknown")
         if site.get("paused"):
             statuses.append("[0]")
@@ -369,28 +389,128 @@ def status_page():
         site_name = site["site_name"]
         names.append(site_name)
 
-        changes = load_changes(site_name)
-        last_dismissed = site.get("last_dismissed")
-        latest_ts = max((c.get("timestamp") for c in changes if "timestamp" in c), default=None)
-        has_alert = latest_ts and latest_ts != last_dismissed
-        statuses.append("[1]" if has_alert else "[0]")
+        statuses.append("[1]" if has_alert(site, summaries.get(site_name)) else "[0]")
 
     response = f"{' | '.join(names)}\n{''.join(statuses)}"
     return response, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+### Prometheus scrape target: stage/capture/lag histograms from metrics.py plus the gauges below
+@app.route("/metrics")
+def metrics_page():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def _pool_gauges():
+    stats = browser_pool.pool.stats()
+    return [({"state": state}, stats[state]) for state in ("live", "idle", "in_use")]
+
+def _scheduler_gauges():
+    stats = scheduler_stats()
+    return [({"state": "queued"}, stats["queue_depth"]), ({"state": "running"}, stats["running"]),
+            ({"state": "capacity"}, stats["max_concurrent"])]
+
+def _site_gauges():
+    sites = site_state.snapshot()
+    paused = sum(1 for s in sites.values() if s.get("paused"))
+    return [({"state": "active"}, len(sites) - paused), ({"state": "paused"}, paused)]
+
+metrics.register_gauge("browser_sessions", "Pooled browser sessions by state.", _pool_gauges)
+metrics.register_gauge("capture_workers", "Capture jobs waiting to start, running, and the executor size.", _scheduler_gauges)
+metrics.register_gauge("sites", "Monitored sites.", _site_gauges)
+
+def _queue_gauges():
+    stats = jobqueue.stats()
+    return [({"state": state}, stats[state]) for state in ("queued", "leased", "failed")]
+
+metrics.register_gauge("queue_tasks", "Worker queue tasks by state (queue dispatch, see jobqueue.py).", _queue_gauges)
+metrics.register_gauge("queue_oldest_seconds", "Age of the oldest runnable task nobody has claimed.",
+                       lambda: [({}, jobqueue.stats()["oldest_queued_seconds"])])
+
+### warm browser pool numbers, handy for tuning POOL_MAX_SESSIONS / POOL_MAX_USES in browser_pool.py
+@app.route("/pool-stats")
+def pool_stats():
+    return jsonify(browser_pool.pool.stats())
+
+### frame store numbers: distinct frames on disk vs captures pointing at them
+@app.route("/storage-stats")
+def storage_stats():
+    return jsonify(blobstore.stats())
+
+### queue depth / lag for the capture executor, if queue_depth keeps climbing we're short on workers
+@app.route("/scheduler-stats")
+def scheduler_stats_route():
+    return jsonify(scheduler_stats())
+
+### site record writer (site_state.py): pending should hover around 0, flushes << queued means coalescing works
+@app.route("/state-stats")
+def state_stats():
+    return jsonify(site_state.stats())
+
+### per-slot size and age of the browsers' persistent asset cache (asset_cache.py), and the rendered diff cache (diffs.py)
+@app.route("/cache-stats")
+def cache_stats():
+    return jsonify({**asset_cache.stats(), "diffs": diffs.stats()})
+
+### worker queue (VR_DISPATCH=queue): if oldest_queued_seconds keeps climbing, start another worker.py
+@app.route("/queue-stats")
+def queue_stats():
+    return jsonify(jobqueue.stats())
+
+### capture now, for many sites at once (see batch.py):
+###   POST /capture {"sites": ["a", "b"], "tags": ["checkout"], "all": false}
+### answers {"batch_id", "events": url}, or streams the progress itself when asked for
+### (Accept: text/event-stream, or ?stream=ndjson)
+@app.route("/capture", methods=["POST"])
+def capture_now():
+    data = request.get_json(silent=True) or {}
+    sites, tags = data.get("sites") or [], data.get("tags") or []
+    if not isinstance(sites, list) or not isinstance(tags, list):
+        return jsonify({"error": "sites and tags must be lists"}), 400
+    if not (sites or tags or data.get("all")):
+        return jsonify({"error": "Nothing to capture, give sites, tags or all"}), 400
+    job_ids, unknown = batch.select(sites, tags, bool(data.get("all")))
+    if unknown:
+        return jsonify({"error": f"Unknown site(s): {', '.join(map(str, unknown))}"}), 404
+    run = batch.submit(job_ids)
+    if request.args.get("stream") or "text/event-stream" in request.headers.get("Accept", ""):
+        return _batch_stream(run)
+    return jsonify({"batch_id": run.id, "sites": len(job_ids), "events": f"/capture/{run.id}/events"}), 202
+
+@app.route("/capture/<batch_id>")
+def capture_status(batch_id):
+    run = batch.get(batch_id)
+    if run is None:
+        return jsonify({"error": "Batch not found (finished batches are kept for an hour)"}), 404
+    return jsonify(run.status())
+
+@app.route("/capture/<batch_id>/events")
+def capture_events(batch_id):
+    run = batch.get(batch_id)
+    if run is None:
+        return jsonify({"error": "Batch not found (finished batches are kept for an hour)"}), 404
+    return _batch_stream(run)
+
+def _batch_stream(run):
+    # SSE by default, one JSON object per line with ?stream=ndjson (or ?format=ndjson)
+    ndjson = "ndjson" in (request.args.get("stream"), request.args.get("format"))
+    try:
+        start = int(request.headers.get("Last-Event-ID", -1)) + 1
+    except ValueError:
+        start = 0
+    fmt = batch.format_ndjson if ndjson else batch.format_sse
+    body = (fmt(*item) if item else fmt(None, None) for item in run.stream(start))
+    return Response(stream_with_context(body), mimetype="application/x-ndjson" if ndjson else "text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 ###20250831_Lucas
 # dismiss all
 @app.route("/dismiss-all", methods=["POST"])
 def dismiss_all_alerts():
-    for job_id, site in monitored_sites.items():
-        site_name = site["site_name"]
-        changes = load_changes(site_name)
-        latest_ts = max((c.get("timestamp") for c in changes if "timestamp" in c), default=None)
-
-        if latest_ts:
-            site["last_dismissed"] = latest_ts
-            monitored_sites[job_id] = site
+    summaries = storage.load_summaries()
+    for job_id, site in site_state.snapshot().items():
+        summary = summaries.get(site["site_name"])
 
-    save_sites(monitored_sites)
+        if summary and summary["latest_change_ts"]:
+            site_state.update(job_id, last_dismissed=summary["latest_change_ts"])
     return jsonify({"status": "all dismissed"})
 
 # --------------------
@@ -398,28 +518,10 @@ def dismiss_all_alerts():
 # --------------------
 from apscheduler.triggers.interval import IntervalTrigger
 #define our variables for various sites we've added.
-for job_id, site in monitored_sites.items():
-    url = site["url"]
-    name = site["site_name"]
-    interval = site["interval_minutes"]
-    viewport = site.get("viewport", [1366, 768])
-    cookie_selector = site.get("cookie_accept_selector")
-    wait_time = site.get("wait_time", 2)
-    is_paused = site.get("paused", False)
-
-    def make_job(url, name, viewport, selector, wait, paused, job_id):
-        def job():
-            if paused:
-                print(f"[⏸] Skipping {job_id} — site is paused.")
-                return
-            capture_job(url, name, viewport, selector, wait)
-        return job
-
-    schedule_job(
-        job_id,
-        make_job(url, name, viewport, cookie_selector, wait_time, is_paused, job_id),
-        interval
-    )
+###paused sites get scheduled again by resume_site, same as after pause_site
+for job_id, site in site_state.snapshot().items():
+    if not site.get("paused"):
+        jobs.schedule_site(job_id, site)
 
 # Schedule screenshot cleanup every hour, see cleanup.py for config there.
 scheduler.add_job(
@@ -430,6 +532,9 @@ scheduler.add_job(
     replace_existing=True
 )
 #define how flask runs and on what port.  0.0.0.0 is listening everywhere, can also specify specific IP to listen on.
+# don't leave orphaned chrome processes behind when flask exits
+atexit.register(browser_pool.pool.close)
+
 if __name__ == "__main__":
     scheduler.start()
     app.run(host='0.0.0.0', port=5006)
@@ -0,0 +1,137 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+
+### Persistent HTTP cache for the pooled browsers. Without it every new Chrome session starts with
+### an empty cache in a throwaway profile, so each capture downloads the same CSS, JS bundles and
+### images again. Each session now gets a cache directory ("slot") that outlives it: the next
+### session in that slot, or the next process after a restart, finds the assets on disk and only
+### the document and API calls go to the network.
+### Chrome's cache format isn't safe to share between two running browsers, so there is one slot
+### per live session and a slot is only handed out when free. Slots are locked with flock, so
+### several worker.py processes on one host each get their own.
+###   freshness - per response, what the origin's Cache-Control / Expires allow (Chrome decides),
+###               capped by ASSET_CACHE_TTL_HOURS: a slot older than that is emptied before it's
+###               reused, so nothing the origin marked immutable is trusted for longer than that.
+###   size      - ASSET_CACHE_MAX_MB per slot, Chrome evicts least recently used past it.
+###   per site  - "asset_cache": false on a site record captures it with the cache disabled.
+### Cache hits per capture show up as "from_cache" in the capture's network stats (blocking.py).
+ASSET_CACHE = True
+ASSET_CACHE_DIR = "cache/chrome"
+ASSET_CACHE_MAX_MB = 256
+ASSET_CACHE_TTL_HOURS = 24
+STAMP_FILE = ".created"
+
+_lock = threading.Lock()
+_in_use = {}       # slot index -> open lock file, held while a browser uses the slot
+
+
+def _slot_path(index):
+    return os.path.join(ASSET_CACHE_DIR, f"slot{index}")
+
+
+def _created(path):
+    try:
+        with open(os.path.join(path, STAMP_FILE)) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _prepare(path, ttl_hours):
+    created = _created(path)
+    if created is not None and time.time() - created > ttl_hours * 3600:
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"[🗑] Asset cache {path} older than {ttl_hours}h, emptied")
+        created = None
+    if created is None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, STAMP_FILE), "w") as f:
+            f.write(str(time.time()))
+
+
+def acquire_slot(ttl_hours=None):
+    """(index, directory) of a cache slot no running browser uses, or (None, None) with the cache off."""
+    if not ASSET_CACHE:
+        return None, None
+    try:
+        os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+        with _lock:
+            index = 0
+            while True:
+                if index not in _in_use:
+                    handle = open(_slot_path(index) + ".lock", "w")
+                    try:
+                        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        _in_use[index] = handle
+                        break
+                    except BlockingIOError:
+                        handle.close()   # another process has this one
+                index += 1
+        path = _slot_path(index)
+        _prepare(path, ASSET_CACHE_TTL_HOURS if ttl_hours is None else ttl_hours)
+    except OSError as e:
+        print(f"[!] Asset cache unusable, browser runs without it: {e}")
+        return None, None
+    return index, os.path.abspath(path)
+
+
+def release_slot(index):
+    if index is None:
+        return
+    with _lock:
+        handle = _in_use.pop(index, None)
+    if handle is not None:
+        handle.close()   # closing drops the flock
+
+
+def chrome_arguments(cache_dir):
+    if not cache_dir:
+        return []
+    return [f"--disk-cache-dir={cache_dir}", f"--disk-cache-size={ASSET_CACHE_MAX_MB * 1024 * 1024}"]
+
+
+def set_disabled(driver, disabled):
+    """Per capture switch for sites with "asset_cache": false."""
+    try:
+        driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": bool(disabled)})
+    except Exception as e:
+        print(f"[!] Could not switch the browser cache {'off' if disabled else 'on'}: {e}")
+
+
+def clear():
+    """Empty every slot that isn't in use (the next session starts cold)."""
+    with _lock:
+        busy = set(_in_use)
+    cleared = 0
+    if not os.path.isdir(ASSET_CACHE_DIR):
+        return cleared
+    for name in os.listdir(ASSET_CACHE_DIR):
+        if name.startswith("slot") and name[4:].isdigit() and int(name[4:]) not in busy:
+            with open(os.path.join(ASSET_CACHE_DIR, name) + ".lock", "w") as handle:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue   # in use by another process
+                shutil.rmtree(os.path.join(ASSET_CACHE_DIR, name), ignore_errors=True)
+                cleared += 1
+    return cleared
+
+
+def stats():
+    slots = []
+    if os.path.isdir(ASSET_CACHE_DIR):
+        for name in sorted(os.listdir(ASSET_CACHE_DIR)):
+            if name.endswith(".lock"):
+                continue
+            path = os.path.join(ASSET_CACHE_DIR, name)
+            size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+            created = _created(path)
+            slots.append({"slot": name, "mb": round(size / 1e6, 1),
+                          "age_hours": round((time.time() - created) / 3600, 1) if created else None})
+    with _lock:
+        in_use = len(_in_use)
+    return {"enabled": ASSET_CACHE, "ttl_hours": ASSET_CACHE_TTL_HOURS, "max_mb": ASSET_CACHE_MAX_MB,
+            "in_use": in_use, "slots": slots}
@@ -0,0 +1,152 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+import storage
+import tiles
+import viewports
+from compare import frame_digest, downscale
+
+### Per-site cache of the last decoded frame, so the next comparison doesn't have to list the
+### site folder and decode the previous PNG again. LRU, bounded by total bytes of cached frames.
+### After a restart (or an eviction) we fall back to the newest recorded capture on disk, once.
+### With several workers (worker.py) another process may have captured the site since we cached
+### it, so a cached entry is only used while it is still the newest capture the database has.
+BASELINE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class Baseline:
+    def __init__(self, path, frame, digest=None, small=None):
+        self.path = path
+        self.frame = frame
+        self.digest = digest or frame_digest(frame)
+        self.small = small if small is not None else downscale(frame)
+        self.nbytes = frame.nbytes + self.small.nbytes
+
+
+class BaselineCache:
+    def __init__(self, max_bytes=BASELINE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> Baseline
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old.nbytes
+            if entry.nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def drop(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old.nbytes
+
+    def drop_site(self, site_name):
+        """Drop every entry of site_name, whatever viewport or capture mode it was keyed under."""
+        with self._lock:
+            for key in [k for k in self._entries if k == site_name or k.startswith((f"{site_name}@", f"{site_name}/"))]:
+                self._bytes -= self._entries.pop(key).nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def cache_key(site_name, viewport_label=None, mode="viewport"):
+    key = f"{site_name}@{viewport_label}" if viewport_label else site_name
+    return key if mode == "viewport" else f"{key}/{mode}"
+
+
+def _fits(frame, viewport):
+    # rows from before multi-viewport capture have no label, only trust them at the right size
+    return viewport is None or frame.shape[:2] == (viewport[1], viewport[0])
+
+
+def load_from_disk(folder, exclude=None, viewport=None):
+    """Newest readable PNG in folder (timestamp names sort chronologically), as a Baseline."""
+    if not os.path.isdir(folder):
+        return None
+    names = sorted((f for f in os.listdir(folder) if f.endswith(".png")), reverse=True)
+    for name in names:
+        path = os.path.join(folder, name)
+        if exclude and os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        frame = cv2.imread(path)
+        if frame is not None and _fits(frame, viewport):
+            return Baseline(path, frame)
+    return None
+
+
+def _latest_record(site_name, viewport=None, mode="viewport"):
+    viewport_label = viewports.label(viewport) if viewport else None
+    for record in storage.recent_captures(site_name, 3, viewport=viewport_label):
+        if record.get("capture_mode", "viewport") == mode:
+            return record
+    return None
+
+
+def load_latest_capture(site_name, viewport=None, mode="viewport"):
+    """Decode the newest capture the database knows about (a blob, or a pre-blob file).
+    Full-page/element captures come back as a TiledBaseline, without decoding any tile."""
+    viewport_label = viewports.label(viewport) if viewport else None
+    for record in storage.recent_captures(site_name, 3, viewport=viewport_label):
+        if record.get("capture_mode", "viewport") != mode:
+            continue
+        if mode != "viewport":
+            return tiles.TiledBaseline.from_record(record) if record.get("tiles") else None
+        frame = cv2.imread(record["path"])
+        if frame is not None and (record.get("viewport") or _fits(frame, viewport)):
+            return Baseline(record["path"], frame, digest=record.get("blob"))
+    return None
+
+
+cache = BaselineCache()
+
+
+def get_baseline(site_name, folder, exclude=None, viewport=None, mode="viewport"):
+    """Previous frame for site_name, per viewport when one is given (see viewports.py).
+    Tiled modes (see tiles.py) have their own baseline, a site switching modes starts over."""
+    key = cache_key(site_name, viewports.label(viewport) if viewport else None, mode)
+    entry = cache.get(key)
+    if entry is not None:
+        latest = _latest_record(site_name, viewport, mode)
+        if latest and latest.get("blob") and latest["blob"] != entry.digest:
+            # someone else captured it in the meantime
+            cache.drop(key)
+            entry = None
+    if entry is None:
+        entry = load_latest_capture(site_name, viewport, mode)
+        if entry is None and mode == "viewport":
+            entry = load_from_disk(folder, exclude=exclude, viewport=viewport)
+        if entry is not None:
+            cache.put(key, entry)
+    return entry
@@ -0,0 +1,245 @@
+import json
+import threading
+import time
+import uuid
+from functools import partial
+
+import jobqueue
+import jobs
+import scheduler
+import site_state
+
+### "Capture now" for many sites at once (POST /capture in app.py), e.g. everything after a deploy.
+### A batch is a list of sites; each one is handed to the same bounded capture executor the
+### timer uses (or, with VR_DISPATCH=queue, to the worker queue) and its progress comes back as a
+### stream of events the client reads over SSE or NDJSON:
+###   {"type": "queued" | "running" | "done" | "skipped" | "error", "site": ..., ...}
+###   {"type": "batch_done", "counts": {...}}          always the last event
+### A site that already has a capture waiting or running, its regular interval run or another
+### batch's (in queue mode, an open task), is not captured twice: this batch follows that run
+### and reports its result ("deduped").
+### Batches are kept in memory for BATCH_KEEP_SECONDS after they finish, so a client that dropped
+### the stream can reconnect with Last-Event-ID and get the rest.
+BATCH_KEEP_SECONDS = 3600
+MAX_BATCHES = 50               # finished batches kept at most, oldest dropped first
+KEEPALIVE_SECONDS = 15         # SSE comment sent while nothing happens, keeps proxies from closing it
+QUEUE_POLL_SECONDS = 2         # queue mode: how often task states are read back
+
+_lock = threading.Lock()
+_batches = {}                  # batch_id -> Batch
+_poller = None
+
+
+class Batch:
+    def __init__(self, job_ids):
+        self.id = uuid.uuid4().hex[:12]
+        self.created = time.time()
+        self.finished = None
+        self.items = {job_id: {"state": "pending"} for job_id in job_ids}
+        self.events = []
+        self._cond = threading.Condition()
+
+    def emit(self, job_id, type, **fields):
+        with self._cond:
+            item = self.items.get(job_id)
+            if item is None or item["state"] in ("done", "skipped", "error"):
+                return   # final already (a deduped run can report twice)
+            if type == "queued" and item["state"] == "running":
+                return   # the run started before submit() got to say it was queued
+            item.update(fields, state=type)
+            self.events.append({"type": type, "job_id": job_id, "site": job_id[len("site_"):], **fields})
+            if all(i["state"] in ("done", "skipped", "error") for i in self.items.values()):
+                self.finished = time.time()
+                self.events.append({"type": "batch_done", "batch_id": self.id, "counts": self._counts(),
+                                    "seconds": round(self.finished - self.created, 1)})
+            self._cond.notify_all()
+
+    def _counts(self):
+        counts = {}
+        for item in self.items.values():
+            counts[item["state"]] = counts.get(item["state"], 0) + 1
+        return counts
+
+    def status(self):
+        with self._cond:
+            return {
+                "batch_id": self.id,
+                "created": self.created,
+                "finished": self.finished,
+                "counts": self._counts(),
+                "sites": {job_id[len("site_"):]: dict(item) for job_id, item in self.items.items()},
+            }
+
+    def wait(self, start, timeout):
+        """Events from index start on, waiting up to timeout for the first one. ([events], done)"""
+        with self._cond:
+            if start >= len(self.events) and self.finished is None:
+                self._cond.wait(timeout)
+            return self.events[start:], self.finished is not None
+
+    def stream(self, start=0):
+        """(index, event) as they happen, None every KEEPALIVE_SECONDS of silence, ends after batch_done."""
+        index = start
+        while True:
+            events, done = self.wait(index, KEEPALIVE_SECONDS)
+            for event in events:
+                yield index, event
+                index += 1
+            if done and index >= len(self.events):
+                return
+            if not events:
+                yield None
+
+
+def _prune():
+    cutoff = time.time() - BATCH_KEEP_SECONDS
+    finished = sorted((b.finished, b.id) for b in _batches.values() if b.finished)
+    excess = len(finished) - MAX_BATCHES
+    for i, (when, batch_id) in enumerate(finished):
+        if i < excess or when < cutoff:
+            del _batches[batch_id]
+
+
+def _submit_local(batch, job_id, site):
+    def on_start():
+        batch.emit(job_id, "running")
+
+    def on_done(outcome, error, seconds):
+        if error is not None:
+            batch.emit(job_id, "error", error=str(error), seconds=round(seconds, 1))
+        elif outcome is None:
+            batch.emit(job_id, "skipped", reason="site is gone or paused")
+        else:
+            changed, prev, curr = outcome
+            batch.emit(job_id, "done", significant=bool(changed), prev=prev, curr=curr, seconds=round(seconds, 1))
+
+    # follows the site's interval run or another batch's if one is waiting or running already
+    state, deduped = scheduler.run_now(job_id, partial(jobs.run_site, job_id), site.get("url"),
+                                       follower=(on_start, on_done))
+    batch.emit(job_id, state, deduped=deduped)
+
+
+def _submit_queue(batch, job_id, site):
+    task_id = jobqueue.enqueue(job_id, site.get("url"))
+    deduped = task_id is None
+    if deduped:
+        task_id = jobqueue.open_task(job_id)
+        if task_id is None:
+            batch.emit(job_id, "skipped", reason="its open task finished in the meantime")
+            return
+    batch.items[job_id]["task_id"] = task_id
+    batch.emit(job_id, "queued", deduped=deduped, task_id=task_id)
+    _ensure_poller()
+
+
+def _poll_queue():
+    # one thread follows every queue-mode batch, a single query per round
+    while True:
+        time.sleep(QUEUE_POLL_SECONDS)
+        with _lock:
+            open_batches = [b for b in _batches.values() if b.finished is None]
+        watched = {}
+        for batch in open_batches:
+            for job_id, item in list(batch.items.items()):
+                if item.get("task_id") and item["state"] in ("queued", "running"):
+                    watched.setdefault(item["task_id"], []).append((batch, job_id))
+        if not watched:
+            continue
+        try:
+            tasks = jobqueue.get_tasks(watched)
+        except Exception as e:
+            print(f"[!] Could not read batch task states: {e}")
+            continue
+        for task_id, followers in watched.items():
+            task = tasks.get(task_id)
+            for batch, job_id in followers:
+                if task is None:
+                    batch.emit(job_id, "error", error="task disappeared from the queue")
+                elif task["state"] == "leased":
+                    if batch.items[job_id]["state"] != "running":
+                        batch.emit(job_id, "running", attempt=task["attempts"], worker=task["lease_owner"])
+                elif task["state"] == "done":
+                    result = json.loads(task["result"]) if task["result"] else {}
+                    if result.get("skipped"):
+                        batch.emit(job_id, "skipped", reason="site is gone or paused")
+                    else:
+                        batch.emit(job_id, "done", significant=result.get("significant"), prev=result.get("prev"),
+                                   curr=result.get("curr"), seconds=round(task["finished_at"] - task["started_at"], 1))
+                elif task["state"] == "failed":
+                    batch.emit(job_id, "error", error=task["error"])
+
+
+def _ensure_poller():
+    global _poller
+    with _lock:
+        if _poller is None or not _poller.is_alive():
+            _poller = threading.Thread(target=_poll_queue, name="batch-poller", daemon=True)
+            _poller.start()
+
+
+def normalize_tags(value):
+    """Site "tags": a list or a comma separated string. Raises ValueError on anything else."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list) or not all(isinstance(t, str) for t in value):
+        raise ValueError("tags must be a list of strings")
+    return sorted({t.strip() for t in value if t.strip()})
+
+
+def select(sites=None, tags=None, all_sites=False):
+    """job_ids for site names and/or tags (any match), plus the names that don't exist."""
+    snapshot = site_state.snapshot()
+    wanted, unknown = [], []
+    for name in sites or []:
+        job_id = f"site_{name}"
+        if job_id in snapshot:
+            wanted.append(job_id)
+        else:
+            unknown.append(name)
+    tags = set(tags or [])
+    for job_id, site in snapshot.items():
+        if all_sites or (tags and tags & set(site.get("tags") or [])):
+            wanted.append(job_id)
+    return list(dict.fromkeys(wanted)), unknown
+
+
+def submit(job_ids):
+    """Start a batch for job_ids (already checked to exist). Returns the Batch."""
+    batch = Batch(job_ids)
+    with _lock:
+        _prune()
+        _batches[batch.id] = batch
+    snapshot = site_state.snapshot()
+    for job_id in job_ids:
+        site = snapshot.get(job_id)
+        if site is None:
+            batch.emit(job_id, "skipped", reason="site no longer exists")
+        elif site.get("paused"):
+            batch.emit(job_id, "skipped", reason="site is paused")
+        elif scheduler.DISPATCH == "queue":
+            _submit_queue(batch, job_id, site)
+        else:
+            _submit_local(batch, job_id, site)
+    if not job_ids:
+        with batch._cond:
+            batch.finished = time.time()
+            batch.events.append({"type": "batch_done", "batch_id": batch.id, "counts": {}, "seconds": 0.0})
+    print(f"[✓] Batch {batch.id}: {len(job_ids)} site(s) submitted")
+    return batch
+
+
+def get(batch_id):
+    with _lock:
+        return _batches.get(batch_id)
+
+
+def format_sse(index, event):
+    if event is None:
+        return ": keepalive\n\n"
+    return f"id: {index}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def format_ndjson(index, event):
+    return json.dumps({"type": "keepalive"} if event is None else event) + "\n"
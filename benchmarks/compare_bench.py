@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import comparators  # noqa: E402
+from compare import compare_frames  # noqa: E402
+from benchmarks.corpus import pairs  # noqa: E402
+
+### Speed and false-positive rate of every comparator, with and without shift alignment, on the
+### synthetic corpus in corpus.py:
+###   python benchmarks/compare_bench.py [--repeat 5] [--json results.json]
+### "fp" counts benign pairs that alerted, "miss" counts real changes that didn't.
+RESOLUTIONS = [(1366, 768), (390, 844), (1920, 1080)]
+
+
+def run(repeat=5, resolutions=RESOLUTIONS):
+    results = []
+    for width, height in resolutions:
+        corpus = pairs(width, height)
+        for name in comparators.COMPARATORS:
+            for align in (False, True):
+                timings, score_timings, fp, miss, cases = [], [], [], [], {}
+                comp = comparators.get(name)
+                for case, prev, curr, should_alert in corpus:
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        result = compare_frames(prev, curr, comparator=name, align=align)
+                        timings.append(time.perf_counter() - start)
+                        start = time.perf_counter()
+                        comp.score(prev, curr)
+                        score_timings.append(time.perf_counter() - start)
+                    cases[case] = {"alert": result["significant"], "tier": result["tier"],
+                                   "mse": round(float(result["mse"]), 3), "score": result.get("score"),
+                                   "shift": result.get("shift")}
+                    if result["significant"] and not should_alert:
+                        fp.append(case)
+                    if should_alert and not result["significant"]:
+                        miss.append(case)
+                benign = sum(1 for c in corpus if not c[3])
+                results.append({
+                    "resolution": f"{width}x{height}",
+                    "comparator": name,
+                    "align": align,
+                    "pipeline_ms_median": round(statistics.median(timings) * 1000, 3),
+                    "score_ms_median": round(statistics.median(score_timings) * 1000, 3),
+                    "false_positives": fp,
+                    "false_positive_rate": round(len(fp) / benign, 3),
+                    "misses": miss,
+                    "miss_rate": round(len(miss) / (len(corpus) - benign), 3),
+                    "cases": cases,
+                })
+    return results
+
+
+def print_table(results):
+    print(f"{'resolution':>11} {'comparator':>10} {'align':>5} {'pipeline ms':>11} {'score ms':>9} {'fp':>6} {'miss':>6}")
+    for r in results:
+        print(f"{r['resolution']:>11} {r['comparator']:>10} {str(r['align']):>5} {r['pipeline_ms_median']:>11.2f} "
+              f"{r['score_ms_median']:>9.2f} {r['false_positive_rate']:>6.2f} {r['miss_rate']:>6.2f}"
+              + (f"   fp: {', '.join(r['false_positives'])}" if r["false_positives"] else "")
+              + (f"   miss: {', '.join(r['misses'])}" if r["misses"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the frame comparators")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="also write the full results here")
+    args = parser.parse_args()
+    results = run(args.repeat)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[✓] Wrote {args.json}")
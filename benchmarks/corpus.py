@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+### Synthetic fixture corpus for the comparators: a rendered "page" (header, nav, headline, text,
+### buttons, image blocks) and pairs of it that a reviewer would call benign or a real change.
+### Everything is drawn from a fixed seed, so a run on any machine sees the same pixels.
+WHITE = (255, 255, 255)
+INK = (40, 40, 40)
+BRAND = (180, 90, 20)
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut "
+          "labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco").split()
+
+
+def _text_lines(rng, count, width):
+    lines = []
+    for _ in range(count):
+        words, length = [], 0
+        while length < width:
+            word = _WORDS[rng.integers(len(_WORDS))]
+            words.append(word)
+            length += (len(word) + 1) * 9
+        lines.append(" ".join(words))
+    return lines
+
+
+def render_page(width=1366, height=768, seed=0, headline="Visual regression monitoring",
+                button=BRAND, hero=True, extra_section=0):
+    """A page-like BGR frame. The keyword arguments are the knobs the 'real change' cases turn."""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), WHITE, np.uint8)
+    y = 0
+    cv2.rectangle(img, (0, 0), (width, 64), BRAND, -1)
+    cv2.putText(img, "ACME", (24, 44), FONT, 1.1, WHITE, 2, cv2.LINE_AA)
+    for i, item in enumerate(("Products", "Pricing", "Docs", "Blog", "Contact")):
+        cv2.putText(img, item, (width - 560 + i * 110, 40), FONT, 0.6, WHITE, 1, cv2.LINE_AA)
+    y = 110
+    if extra_section:
+        cv2.rectangle(img, (24, y), (width - 24, y + extra_section - 20), (235, 225, 210), -1)
+        cv2.putText(img, "New: announcing our spring release", (48, y + 50), FONT, 0.9, INK, 2, cv2.LINE_AA)
+        y += extra_section
+    cv2.putText(img, headline, (24, y), FONT, 1.4, INK, 2, cv2.LINE_AA)
+    y += 40
+    for line in _text_lines(rng, 4, min(width - 48, 900)):
+        y += 28
+        cv2.putText(img, line[: (width - 48) // 9], (24, y), FONT, 0.55, INK, 1, cv2.LINE_AA)
+    y += 40
+    cv2.rectangle(img, (24, y), (224, y + 48), button, -1)
+    cv2.putText(img, "Get started", (52, y + 32), FONT, 0.7, WHITE, 2, cv2.LINE_AA)
+    y += 80
+    if hero and y < height:
+        block_w = min(420, width - 48)
+        gradient = np.linspace(60, 220, block_w, dtype=np.uint8)
+        bottom = min(height, y + 220)
+        img[y:bottom, 24:24 + block_w] = gradient[None, :, None]
+        if width > block_w + 96:
+            for line_no, line in enumerate(_text_lines(rng, 6, width - block_w - 96)):
+                ty = y + 24 + line_no * 28
+                if ty < height:
+                    cv2.putText(img, line[: (width - block_w - 96) // 9], (block_w + 72, ty), FONT, 0.55, INK, 1, cv2.LINE_AA)
+        y = bottom + 20
+    while y < height - 20:
+        y += 28
+        cv2.putText(img, _text_lines(rng, 1, width - 48)[0][: (width - 48) // 9], (24, y), FONT, 0.55, INK, 1, cv2.LINE_AA)
+    return img
+
+
+def _insert_band(img, row, height, color):
+    band = np.full((height, img.shape[1], 3), color, np.uint8)
+    return np.concatenate([img[:row], band, img[row:]])[: img.shape[0]]
+
+
+def _remove_band(img, row, height):
+    return np.concatenate([img[:row], img[row + height:], np.full((height, img.shape[1], 3), WHITE, np.uint8)])
+
+
+def _edge_jitter(img, seed, amount=12):
+    # anti-aliasing differences: small random changes on glyph/shape edges only
+    rng = np.random.default_rng(seed)
+    edges = cv2.dilate(cv2.Canny(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), 50, 150), np.ones((2, 2), np.uint8)) > 0
+    noise = rng.integers(-amount, amount + 1, size=img.shape, dtype=np.int16)
+    out = img.astype(np.int16)
+    out[edges] += noise[edges]
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def pairs(width=1366, height=768, seed=0):
+    """[(name, prev, curr, should_alert)] for one resolution."""
+    base = render_page(width, height, seed)
+    caret = base.copy()
+    cv2.line(caret, (300, 180), (300, 196), INK, 1)
+    one_px = base.copy()
+    one_px[150:260, 1:] = base[150:260, :-1]
+    return [
+        # benign: a reviewer would not want an alert for any of these
+        ("identical", base, base.copy(), False),
+        ("antialias_jitter", base, _edge_jitter(base, seed + 1), False),
+        ("caret_blink", base, caret, False),
+        ("text_1px_shift", base, one_px, False),
+        ("banner_grows_12px", base, _insert_band(base, 64, 12, BRAND), False),
+        ("banner_shrinks_12px", base, _remove_band(base, 52, 12), False),
+        # real: each of these should alert
+        ("notice_pushes_40px", base, _insert_band(base, 64, 40, (235, 235, 235)), True),
+        ("headline_changed", base, render_page(width, height, seed, headline="Catch visual regressions early"), True),
+        ("button_recolored", base, render_page(width, height, seed, button=(40, 160, 40)), True),
+        ("hero_removed", base, render_page(width, height, seed, hero=False), True),
+        ("new_section_300px", base, render_page(width, height, seed, extra_section=300), True),
+    ]
@@ -0,0 +1,2 @@
+// stands in for a site's JS bundle: something to download, and a class the stylesheet reacts to
+document.documentElement.classList.add("ready");
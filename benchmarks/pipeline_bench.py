@@ -0,0 +1,351 @@
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+import browser_pool  # noqa: E402
+import compare  # noqa: E402
+import image_writer  # noqa: E402
+import stages  # noqa: E402
+import storage  # noqa: E402
+import visual_capture  # noqa: E402
+from benchmarks.corpus import pairs  # noqa: E402
+
+### End-to-end benchmark for capture_job, no network needed:
+###   python benchmarks/pipeline_bench.py [--runs 6] [--concurrency 1,2,4] [--no-browser]
+###                                       [--out results.json] [--against previous.json]
+### 1. capture - the HTML pages in benchmarks/fixtures are served from a local HTTP server and
+###    captured with the real pool and Chrome. Every stage in stages.STAGES is timed. Runs alternate
+###    ?variant=0 / ?variant=1 so that every run after the first goes through the full diff.
+### 2. throughput - captures/min with 1, 2, 4... pooled browsers working at once.
+### 3. compare - the decode, crop and diff path alone on the synthetic pairs from corpus.py at
+###    several resolutions, plus compares/min at the same concurrency levels.
+### 4. asset cache - assets.html is captured repeatedly, with the browser recycled half way, and the
+###    stand-in server counts how often its CSS/JS/images were really fetched. With asset_cache.py
+###    working only the first capture fetches them; anything less is reported.
+### Everything is written to a scratch directory (db, blobs), the real data is never touched.
+### Results go to benchmarks/results/pipeline-<time>.json; --against prints the change per stage
+### against an earlier results file.
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+CASES = [
+    # name, fixture, capture_job keyword arguments
+    ("simple", "simple.html", {}),
+    ("late_content", "dynamic.html", {"wait_time": 3}),
+    ("cookie_banner", "cookie.html", {"cookie_selector": "#accept"}),
+    ("multi_viewport", "simple.html", {"viewport": [[1366, 768], [768, 1024], [390, 844]]}),
+    ("full_page", "long.html", {"capture_mode": "full_page"}),
+]
+RESOLUTIONS = [(390, 844), (1366, 768), (1920, 1080), (2560, 1440)]
+CONCURRENCY = [1, 2, 4]
+ASSET_MAX_AGE = 3600    # what the stand-in server allows for fixtures/assets/
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    latency = 0.0
+    asset_hits = None    # path -> times fetched from "origin", shared by every handler of one server
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.path.startswith("/assets/"):
+            with _hits_lock:
+                self.asset_hits[self.path] = self.asset_hits.get(self.path, 0) + 1
+        super().do_GET()
+
+    def end_headers(self):
+        if self.path.startswith("/assets/"):
+            self.send_header("Cache-Control", f"max-age={ASSET_MAX_AGE}")
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+_hits_lock = threading.Lock()
+
+
+def serve_fixtures(latency_ms=0):
+    """Start the stand-in server on a free localhost port. Returns (server, base_url).
+    server.asset_hits counts the requests that reached it for fixtures/assets/."""
+    hits = {}
+    handler = functools.partial(type("Handler", (_QuietHandler,), {"latency": latency_ms / 1000, "asset_hits": hits}),
+                                directory=FIXTURES)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.asset_hits = hits
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _summary(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "total_ms": round(sum(ordered) * 1000, 3),
+    }
+
+
+def _merge(into, timings):
+    for name, values in timings.items():
+        into.setdefault(name, []).extend(values)
+
+
+def _timed_capture(url, site_name, kwargs):
+    with stages.collect() as timings:
+        start = time.perf_counter()
+        visual_capture.capture_job(url, site_name, **kwargs)
+        timings["total"] = [time.perf_counter() - start]
+    return timings
+
+
+def _fresh_pool(max_sessions):
+    old = browser_pool.pool
+    browser_pool.pool = browser_pool.BrowserPool(max_sessions=max_sessions)
+    if old is not None:
+        old.close()
+
+
+def bench_capture(base_url, runs):
+    results = {}
+    for name, fixture, kwargs in CASES:
+        timings = {}
+        for run in range(runs):
+            url = f"{base_url}/{fixture}?variant={run % 2}"
+            _merge(timings, _timed_capture(url, f"bench_{name}", kwargs))
+        results[name] = {
+            "fixture": fixture,
+            "options": kwargs,
+            "runs": runs,
+            "stages": {s: _summary(timings.get(s, [])) for s in stages.STAGES + ("total",) if timings.get(s)},
+        }
+        total = results[name]["stages"]["total"]
+        print(f"[✓] {name}: median {total['median_ms']:.0f} ms per capture over {runs} runs")
+    return results
+
+
+def bench_throughput(base_url, levels, per_worker):
+    results = []
+    fixture = "simple.html"
+    for level in levels:
+        _fresh_pool(level)
+        # one untimed capture per worker so browser startup isn't counted as throughput
+        with ThreadPoolExecutor(level) as pool:
+            list(pool.map(lambda i: visual_capture.capture_job(f"{base_url}/{fixture}", f"bench_tp_{i}"), range(level)))
+        jobs = [(f"{base_url}/{fixture}?variant={n % 2}", f"bench_tp_{n % level}") for n in range(level * per_worker)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(level) as pool:
+            per_capture = list(pool.map(lambda job: _timed_capture(job[0], job[1], {}), jobs))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "concurrency": level,
+            "captures": len(jobs),
+            "seconds": round(elapsed, 3),
+            "captures_per_min": round(len(jobs) / elapsed * 60, 1),
+            "median_capture_ms": _summary([t["total"][0] for t in per_capture])["median_ms"],
+            "median_checkout_ms": _summary([v for t in per_capture for v in t.get("checkout", [])])["median_ms"],
+        })
+        print(f"[✓] concurrency {level}: {results[-1]['captures_per_min']} captures/min")
+    return results
+
+
+def bench_asset_cache(server, base_url, runs):
+    assets = sorted(os.listdir(os.path.join(FIXTURES, "assets")))
+    server.asset_hits.clear()
+    _fresh_pool(1)
+    from_cache = []
+    for run in range(runs):
+        if run == runs // 2:
+            _fresh_pool(1)   # a new browser session has to find the same cache
+        with stages.collect():
+            visual_capture.capture_job(f"{base_url}/assets.html?variant={run % 2}", "bench_assets")
+        capture = storage.recent_captures("bench_assets", 1)[0]
+        from_cache.append((capture.get("network") or {}).get("from_cache"))
+    requested = len(assets) * runs
+    fetched = sum(server.asset_hits.values())
+    hit_rate = 1 - fetched / requested
+    expected = (runs - 1) / runs   # only the very first capture should go to the server
+    result = {
+        "runs": runs,
+        "assets": len(assets),
+        "requested": requested,
+        "fetched_from_origin": fetched,
+        "hit_rate": round(hit_rate, 3),
+        "expected_hit_rate": round(expected, 3),
+        "from_cache_per_capture": from_cache,
+        "per_asset": dict(sorted(server.asset_hits.items())),
+    }
+    if hit_rate + 1e-9 < expected:
+        print(f"[!] asset cache: hit rate {hit_rate:.0%}, expected {expected:.0%}, fetched {result['per_asset']}")
+    else:
+        print(f"[✓] asset cache: hit rate {hit_rate:.0%} ({fetched} of {requested} asset requests reached the server)")
+    return result
+
+
+def _compare_once(prev_png, curr_png, width, height):
+    timings = {}
+    start = time.perf_counter()
+    prev = cv2.imdecode(np.frombuffer(prev_png, np.uint8), cv2.IMREAD_COLOR)
+    curr = cv2.imdecode(np.frombuffer(curr_png, np.uint8), cv2.IMREAD_COLOR)
+    timings["decode"] = time.perf_counter() - start
+    start = time.perf_counter()
+    prev, curr = prev[:height, :width], curr[:height, :width]
+    timings["crop"] = time.perf_counter() - start
+    start = time.perf_counter()
+    result = compare.compare_frames(prev, curr)
+    timings["diff"] = time.perf_counter() - start
+    return timings, result
+
+
+def bench_compare(resolutions, levels, repeat):
+    results = []
+    for width, height in resolutions:
+        encoded = [(case, cv2.imencode(".png", prev)[1].tobytes(), cv2.imencode(".png", curr)[1].tobytes())
+                   for case, prev, curr, _ in pairs(width, height)]
+        timings, tiers = {}, {}
+        for case, prev_png, curr_png in encoded:
+            for _ in range(repeat):
+                t, result = _compare_once(prev_png, curr_png, width, height)
+                for name, value in t.items():
+                    timings.setdefault(name, []).append(value)
+                timings.setdefault("total", []).append(sum(t.values()))
+            tiers[case] = result["tier"]
+        throughput = []
+        for level in levels:
+            work = encoded * repeat
+            start = time.perf_counter()
+            with ThreadPoolExecutor(level) as pool:
+                list(pool.map(lambda item: _compare_once(item[1], item[2], width, height), work))
+            elapsed = time.perf_counter() - start
+            throughput.append({"concurrency": level, "compares_per_min": round(len(work) / elapsed * 60, 1)})
+        results.append({
+            "resolution": f"{width}x{height}",
+            "pairs": len(encoded),
+            "stages": {name: _summary(values) for name, values in timings.items()},
+            "tiers": tiers,
+            "throughput": throughput,
+        })
+        print(f"[✓] compare {width}x{height}: median {results[-1]['stages']['total']['median_ms']:.1f} ms, "
+              + ", ".join(f"{t['compares_per_min']:.0f}/min @{t['concurrency']}" for t in throughput))
+    return results
+
+
+def _meta(args):
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                             text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        rev = None
+    return {
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "git_rev": rev,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def _medians(results):
+    """{"capture/simple/diff": ms, ...} for every median in a results file."""
+    flat = {}
+    for case, data in (results.get("capture") or {}).items():
+        for name, summary in (data.get("stages") or {}).items():
+            flat[f"capture/{case}/{name}"] = summary["median_ms"]
+    for row in results.get("throughput") or []:
+        flat[f"throughput/{row['concurrency']}/captures_per_min"] = row["captures_per_min"]
+    for row in results.get("compare") or []:
+        for name, summary in row["stages"].items():
+            flat[f"compare/{row['resolution']}/{name}"] = summary["median_ms"]
+    if results.get("asset_cache"):
+        flat["asset_cache/hit_rate"] = results["asset_cache"]["hit_rate"]
+    return flat
+
+
+def print_against(results, previous_path):
+    with open(previous_path) as f:
+        before = _medians(json.load(f))
+    after = _medians(results)
+    print(f"\n{'metric':<48} {'before':>10} {'after':>10} {'change':>8}")
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+        print(f"{key:<48} {old:>10.2f} {new:>10.2f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the capture-compare pipeline offline")
+    parser.add_argument("--runs", type=int, default=6, help="captures per fixture case")
+    parser.add_argument("--repeat", type=int, default=5, help="repeats per synthetic compare pair")
+    parser.add_argument("--concurrency", default=",".join(map(str, CONCURRENCY)))
+    parser.add_argument("--per-worker", type=int, default=5, help="captures per worker in the throughput run")
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay the fixture server adds per request")
+    parser.add_argument("--no-browser", action="store_true", help="only run the compare-only section")
+    parser.add_argument("--out", help="results file (default benchmarks/results/pipeline-<time>.json)")
+    parser.add_argument("--against", help="earlier results file to compare medians with")
+    args = parser.parse_args()
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+
+    results = {"meta": _meta(args)}
+    scratch = tempfile.mkdtemp(prefix="vr-bench-")
+    cwd = os.getcwd()
+    out = os.path.abspath(args.out or os.path.join(RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d_%H%M%S')}.json"))
+    against = os.path.abspath(args.against) if args.against else None
+    # db, screenshots/ and blobs are all relative to the working directory
+    os.chdir(scratch)
+    server = None
+    try:
+        if args.no_browser:
+            results["capture"] = results["throughput"] = results["asset_cache"] = None
+        else:
+            server, base_url = serve_fixtures(args.latency_ms)
+            try:
+                _fresh_pool(1)
+                results["capture"] = bench_capture(base_url, args.runs)
+                results["throughput"] = bench_throughput(base_url, levels, args.per_worker)
+                results["asset_cache"] = bench_asset_cache(server, base_url, args.runs)
+            except Exception as e:
+                # no Chrome/chromedriver here: still worth having the compare numbers
+                print(f"[!] Capture benchmark failed, only the compare section will be reported: {e}")
+                results["capture"] = results["throughput"] = results["asset_cache"] = None
+                results["capture_error"] = str(e)
+            finally:
+                image_writer.flush()
+                browser_pool.pool.close()
+        results["compare"] = bench_compare(RESOLUTIONS, levels, args.repeat)
+    finally:
+        if server is not None:
+            server.shutdown()
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[✓] Wrote {out}")
+    if against:
+        print_against(results, against)
+
+
+if __name__ == "__main__":
+    main()
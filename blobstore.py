@@ -0,0 +1,64 @@
+import os
+
+import image_writer
+import storage
+import thumbnails
+from compare import frame_digest
+
+### Content-addressed frame storage. Every frame is stored once, named by the digest of its
+### decoded pixels (compare.frame_digest), and captures/changes reference it by hash:
+###   screenshots/blobs/3f/3f9a...c1.png
+### A stable site that produces the same frame all day costs one PNG, not one per capture, and a
+### change record points at the prev/curr blobs instead of copying them into changes/.
+### Blobs are reference counted in the database; collect_garbage() deletes the ones nothing uses.
+BLOB_DIR = os.path.join(storage.SCREENSHOT_BASE, "blobs")
+
+
+def blob_path(digest):
+    return os.path.join(BLOB_DIR, digest[:2], f"{digest}.png")
+
+
+def blob_url(path):
+    return path.replace("screenshots/", "/static/screenshots/", 1)
+
+
+def _write_blob(path, frame, digest):
+    size = image_writer.write_now(path, frame, image_writer.PNG_COMPRESSION)
+    storage.set_blob_size(digest, size)
+    return size
+
+
+def put(frame, digest=None):
+    """Store frame if we haven't seen these pixels before. Returns (digest, path)."""
+    digest = digest or frame_digest(frame)
+    path = blob_path(digest)
+    is_new = storage.register_blob(digest, path)
+    if is_new or not os.path.exists(path):
+        # may still be queued on the writer thread when a repeat shows up, writing twice is harmless
+        image_writer.submit(_write_blob, path, frame, digest, label=path)
+        thumbnails.queue_thumbnails(path, frame)
+    return digest, path
+
+
+def collect_garbage(min_age_seconds=600):
+    """Delete blobs no capture or change references any more. Returns bytes reclaimed."""
+    reclaimed = 0
+    # files go while the write lock is held, a concurrent put() of one of these frames blocks in
+    # register_blob until they're gone and then stores it as new
+    with storage.transaction():
+        for blob in storage.take_unreferenced_blobs(min_age_seconds):
+            try:
+                reclaimed += os.path.getsize(blob["path"])
+                os.remove(blob["path"])
+            except FileNotFoundError:
+                pass
+            thumbnails.remove_thumbnails(blob["path"])
+    if reclaimed:
+        print(f"[🗑] Reclaimed {reclaimed / 1e6:.1f} MB of unreferenced frames")
+    return reclaimed
+
+
+def stats():
+    s = storage.blob_stats()
+    s["captures_per_blob"] = round(s["captures"] / s["blobs"], 2) if s["blobs"] else 0.0
+    return s
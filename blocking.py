@@ -0,0 +1,285 @@
+import json
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import storage
+
+### Request blocking for captures. Analytics, ad tags, chat widgets and video cost most of a page
+### load and are the usual source of pixels that differ run to run, so they never get fetched.
+### Patterns go to CDP Network.setBlockedURLs (URL patterns, * wildcards), which Chrome applies
+### without asking us per request. Per site, on the site record:
+###   "blocking": {
+###     "patterns": ["*://*.vimeocdn.com/*", "*/chat-widget.js*"],   # on top of GLOBAL_PATTERNS
+###     "types": ["media", "font"],        # resource types, see TYPE_PATTERNS
+###     "third_party": true,               # block every host that isn't the site's own
+###     "allow_hosts": ["cdn.example.net"],# ...except these and their subdomains (CDNs the page needs)
+###     "stub_trackers": true,             # no-op ga()/gtag()/fbq()... so pages don't break
+###     "global": true                     # false skips GLOBAL_PATTERNS for this site
+###   }
+### Third-party blocking can't be expressed as a pattern ("anything but example.com"), so it's
+### decided per request: a WebDriver BiDi request handler (network.beforeRequestSent with an
+### intercept, Chrome's Fetch.requestPaused) sees every request before it's sent and fails the ones
+### whose host isn't the site's registrable domain, a subdomain of it or allowed. Selenium runs the
+### handler on its BiDi connection's thread, so there's still no event loop on our side. The hosts
+### it blocks are also kept in the database (storage.learned_hosts) and go into the pattern list,
+### which covers a browser or driver without BiDi: there a host is blocked from the capture after
+### the one that first saw it.
+### Request counts (and how many asset_cache.py served), bytes and an estimate of the bytes
+### blocking saved come from Chrome's performance log (browser_pool.make_driver turns it on) and
+### are stored with the capture.
+GLOBAL_BLOCKING = True
+GLOBAL_PATTERNS = [
+    # analytics
+    "*://*.google-analytics.com/*", "*://*.googletagmanager.com/*", "*://*.hotjar.com/*",
+    "*://*.clarity.ms/*", "*://*.segment.io/*", "*://cdn.segment.com/*", "*://*.mixpanel.com/*",
+    "*://*.amplitude.com/*", "*://*.nr-data.net/*", "*://js-agent.newrelic.com/*", "*://*.fullstory.com/*",
+    # ads and pixels
+    "*://*.doubleclick.net/*", "*://*.googlesyndication.com/*", "*://*.googleadservices.com/*",
+    "*://connect.facebook.net/*", "*://*.facebook.com/tr*", "*://bat.bing.com/*", "*://snap.licdn.com/*",
+    "*://*.ads-twitter.com/*", "*://analytics.tiktok.com/*", "*://*.criteo.com/*", "*://*.taboola.com/*",
+    "*://*.outbrain.com/*",
+    # chat widgets
+    "*://*.intercom.io/*", "*://*.intercomcdn.com/*", "*://js.driftt.com/*", "*://*.zdassets.com/*",
+    "*://embed.tawk.to/*", "*://client.crisp.chat/*",
+]
+TYPE_PATTERNS = {
+    "media": ["*.mp4", "*.mp4?*", "*.webm", "*.webm?*", "*.m3u8*", "*.mov", "*.mov?*", "*.mp3", "*.mp3?*"],
+    "font": ["*.woff2", "*.woff2?*", "*.woff", "*.woff?*", "*.ttf", "*.ttf?*", "*.otf", "*.otf?*"],
+    "image": ["*.png", "*.png?*", "*.jpg", "*.jpg?*", "*.jpeg", "*.jpeg?*", "*.gif", "*.gif?*", "*.webp", "*.webp?*"],
+}
+# what a blocked request probably would have cost, when we've never seen it load (CDP type -> bytes)
+TYPE_AVG_BYTES = {"Script": 40000, "Image": 30000, "Media": 500000, "Font": 40000, "XHR": 4000,
+                  "Fetch": 4000, "Stylesheet": 20000, "Document": 30000}
+DEFAULT_AVG_BYTES = 10000
+MAX_LEARNED_SIZES = 5000
+
+TRACKER_STUBS_JS = """
+(function () {
+  const noop = function () {};
+  const queue = function () { (queue.q = queue.q || []).push(arguments); };
+  window.dataLayer = window.dataLayer || [];
+  window.ga = window.ga || queue;
+  window.gtag = window.gtag || function () { window.dataLayer.push(arguments); };
+  window._gaq = window._gaq || [];
+  window._paq = window._paq || [];
+  window.fbq = window.fbq || queue;
+  window.hj = window.hj || queue;
+  window.clarity = window.clarity || queue;
+  window.twq = window.twq || queue;
+  window.lintrk = window.lintrk || queue;
+  window.Intercom = window.Intercom || queue;
+  const methods = ["track", "identify", "page", "init", "register", "people", "reset", "set", "load", "ready", "on", "push"];
+  ["analytics", "mixpanel", "amplitude", "ttq"].forEach(function (name) {
+    if (window[name]) return;
+    const stub = {};
+    methods.forEach(function (m) { stub[m] = noop; });
+    window[name] = stub;
+  });
+})();
+"""
+
+_lock = threading.Lock()
+_learned_sizes = OrderedDict()      # url without query -> encoded bytes last time it loaded
+
+
+def normalize(value):
+    """Validate a site's "blocking" dict. Raises ValueError on bad input."""
+    if not value:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError("blocking must be an object")
+    result = {}
+    patterns = value.get("patterns") or []
+    if not isinstance(patterns, list) or not all(isinstance(p, str) and p.strip() for p in patterns):
+        raise ValueError("blocking.patterns must be a list of URL patterns")
+    if patterns:
+        result["patterns"] = [p.strip() for p in patterns]
+    types = value.get("types") or []
+    unknown = [t for t in types if t not in TYPE_PATTERNS]
+    if unknown:
+        raise ValueError(f"unknown resource type(s) {', '.join(map(str, unknown))}, expected {', '.join(TYPE_PATTERNS)}")
+    if types:
+        result["types"] = list(types)
+    hosts = value.get("allow_hosts") or []
+    if not isinstance(hosts, list) or not all(isinstance(h, str) for h in hosts):
+        raise ValueError("blocking.allow_hosts must be a list of host names")
+    if hosts:
+        result["allow_hosts"] = [h.strip().lower() for h in hosts if h.strip()]
+    for flag in ("third_party", "stub_trackers"):
+        if value.get(flag):
+            result[flag] = True
+    if value.get("global") is False:
+        result["global"] = False
+    return result
+
+
+def _site_domain(host):
+    # registrable-domain guess: last two labels, three for example.co.uk style names
+    parts = (host or "").lower().split(".")
+    if len(parts) >= 3 and len(parts[-1]) == 2 and len(parts[-2]) <= 3:
+        return ".".join(parts[-3:])
+    return ".".join(parts[-2:])
+
+
+def _matches(host, name):
+    return host == name or host.endswith("." + name)
+
+
+def _first_party(host, domain, allow):
+    host = (host or "").lower()
+    return not host or _matches(host, domain) or any(_matches(host, a) for a in allow)
+
+
+def _size_key(url):
+    return url.split("?", 1)[0]
+
+
+class Blocker:
+    """Blocking for one capture: apply() before driver.get(), finish() once the screenshots are taken."""
+
+    def __init__(self, site_name, url, config=None):
+        self.site_name = site_name
+        self.config = config or {}
+        self.domain = _site_domain(urlparse(url).hostname)
+        self.allow = set(self.config.get("allow_hosts") or [])
+        self.patterns = []
+        self.script_id = None
+        self.handler_id = None
+        self.refused = set()     # urls the request handler failed
+
+    def _build_patterns(self):
+        patterns = list(GLOBAL_PATTERNS) if GLOBAL_BLOCKING and self.config.get("global", True) else []
+        patterns += self.config.get("patterns") or []
+        for kind in self.config.get("types") or []:
+            patterns += TYPE_PATTERNS[kind]
+        if self.config.get("third_party"):
+            try:
+                hosts = sorted(storage.learned_hosts(self.site_name))
+            except Exception as e:
+                print(f"[!] Could not read learned third-party hosts for {self.site_name}: {e}")
+                hosts = []
+            patterns += [f"*://{host}/*" for host in hosts]
+        return patterns
+
+    def _on_request(self, request):
+        # runs on Selenium's BiDi thread for every request of the page, keep it cheap
+        if request.url.startswith(("data:", "blob:")):
+            return
+        if not _first_party(urlparse(request.url).hostname, self.domain, self.allow):
+            with _lock:
+                self.refused.add(request.url)
+            request.fail()
+
+    def apply(self, driver):
+        try:
+            driver.get_log("performance")   # drop whatever the last site left in the buffer
+        except Exception:
+            pass
+        self.patterns = self._build_patterns()
+        if self.config.get("third_party"):
+            try:
+                self.handler_id = driver.network.add_request_handler(self._on_request)
+            except Exception as e:
+                print(f"[!] Per-request third-party blocking unavailable for {self.site_name}, "
+                      f"only hosts seen before are blocked: {e}")
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.patterns})
+            if self.config.get("stub_trackers"):
+                added = driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": TRACKER_STUBS_JS})
+                self.script_id = (added or {}).get("identifier")
+        except Exception as e:
+            print(f"[!] Request blocking not applied for {self.site_name}: {e}")
+        return self
+
+    def finish(self, driver):
+        """Undo the session-wide settings and return the request stats for the capture (None if unavailable)."""
+        try:
+            if self.handler_id is not None:
+                driver.network.remove_request_handler(self.handler_id)
+        except Exception:
+            pass
+        try:
+            if self.script_id:
+                driver.execute_cdp_cmd("Page.removeScriptToEvaluateOnNewDocument", {"identifier": self.script_id})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+        except Exception:
+            pass
+        try:
+            entries = driver.get_log("performance")
+        except Exception:
+            return None
+        return self._stats(entries)
+
+    def _stats(self, entries):
+        requests = {}
+        for entry in entries:
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, TypeError, ValueError):
+                continue
+            method, params = message.get("method"), message.get("params") or {}
+            if method == "Network.requestWillBeSent":
+                url = params.get("request", {}).get("url", "")
+                if url.startswith(("data:", "blob:")):
+                    continue
+                requests[params.get("requestId")] = {"url": url, "type": params.get("type"), "state": "sent", "bytes": 0,
+                                                     "cached": False}
+            elif method == "Network.requestServedFromCache" and params.get("requestId") in requests:
+                requests[params["requestId"]]["cached"] = True
+            elif method == "Network.responseReceived" and params.get("requestId") in requests:
+                if (params.get("response") or {}).get("fromDiskCache"):
+                    requests[params["requestId"]]["cached"] = True   # asset_cache.py hit
+            elif method == "Network.loadingFinished" and params.get("requestId") in requests:
+                req = requests[params["requestId"]]
+                req["state"], req["bytes"] = "loaded", int(params.get("encodedDataLength") or 0)
+            elif method == "Network.loadingFailed" and params.get("requestId") in requests:
+                req = requests[params["requestId"]]
+                blocked = (params.get("blockedReason") or "ERR_BLOCKED_BY_CLIENT" in (params.get("errorText") or "")
+                           or req["url"] in self.refused)
+                req["state"] = "blocked" if blocked else "failed"
+
+        loaded = [r for r in requests.values() if r["state"] == "loaded"]
+        blocked = [r for r in requests.values() if r["state"] == "blocked"]
+        third_party = set()
+        with _lock:
+            for r in loaded:
+                if r["cached"]:
+                    continue   # a cache hit's byte count isn't what a fetch costs
+                _learned_sizes[_size_key(r["url"])] = r["bytes"]
+                _learned_sizes.move_to_end(_size_key(r["url"]))
+            while len(_learned_sizes) > MAX_LEARNED_SIZES:
+                _learned_sizes.popitem(last=False)
+            saved = sum(_learned_sizes.get(_size_key(r["url"]),
+                                           TYPE_AVG_BYTES.get(r["type"], DEFAULT_AVG_BYTES)) for r in blocked)
+            if self.config.get("third_party"):
+                # loaded ones (no request handler) and the ones the handler refused
+                for r in requests.values():
+                    if r["state"] == "blocked" and r["url"] not in self.refused:
+                        continue
+                    host = urlparse(r["url"]).hostname
+                    if not _first_party(host, self.domain, self.allow):
+                        third_party.add(host)
+        if third_party:
+            try:
+                new = storage.add_learned_hosts(self.site_name, third_party)
+            except Exception as e:
+                print(f"[!] Could not store learned third-party hosts for {self.site_name}: {e}")
+                new = []
+            if new:
+                print(f"[✓] {self.site_name}: {len(new)} new third-party host(s) added to the blocked patterns")
+        return {
+            "requests": len(requests),
+            "loaded": len(loaded),
+            "blocked": len(blocked),
+            "failed": sum(1 for r in requests.values() if r["state"] == "failed"),
+            "bytes": sum(r["bytes"] for r in loaded),
+            "from_cache": sum(1 for r in loaded if r["cached"]),
+            "est_bytes_saved": int(saved),
+            "patterns": len(self.patterns),
+        }
+
+
+def forget_site(site_name):
+    storage.forget_learned_hosts(site_name)
@@ -0,0 +1,251 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import asset_cache
+import stages
+
+### Warm pool of Chrome sessions so capture_job doesn't pay browser startup on every run.
+### Sessions are keyed by viewport (window size is baked in at launch) and recycled after
+### POOL_MAX_USES checkouts, or immediately if a capture blows up with them checked out.
+POOL_MAX_SESSIONS = 4          # total live browsers across all viewports
+POOL_MAX_USES = 50             # recycle a session after this many captures
+POOL_CHECKOUT_TIMEOUT = 300    # seconds a capture will wait for a free session
+CHROME_HEADER_PADDING = 120    # extra window height for the chrome border
+
+
+def make_driver(viewport, cache_dir=None):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    ###20250907 - comment out the below line if you have frequent issues with font rendering being slightly different.
+    ###headless can apparently do this sometimes. Technically more resource intensive, but
+    ###not by much. If you are extremely performance constrained, set a higher threshold for
+    ###MSE error rate in visual_capture.py
+    #options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--window-size={},{}".format(viewport[0], viewport[1] + CHROME_HEADER_PADDING))  # pad for header
+    # cache directory that outlives the session, see asset_cache.py
+    for argument in asset_cache.chrome_arguments(cache_dir):
+        options.add_argument(argument)
+    # network events for blocking.py's per-capture request counts
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+    # WebDriver BiDi, for blocking.py's per-request third-party handler
+    options.enable_bidi = True
+
+    driver = webdriver.Chrome(options=options)
+    driver.set_window_rect(0, 0, viewport[0], viewport[1] + CHROME_HEADER_PADDING)  # extra for chrome border
+    return driver
+
+
+def emulate_viewport(driver, viewport):
+    """Switch an already loaded page to another breakpoint. Device metrics give the exact layout
+    viewport (and go below the minimum window width desktop Chrome allows); window resize is the fallback."""
+    try:
+        driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
+            "width": viewport[0], "height": viewport[1], "deviceScaleFactor": 0, "mobile": False,
+        })
+    except Exception:
+        driver.set_window_rect(0, 0, viewport[0], viewport[1] + CHROME_HEADER_PADDING)
+
+
+class BrowserSession:
+    def __init__(self, viewport):
+        self.viewport = tuple(viewport)
+        self.cache_slot, cache_dir = asset_cache.acquire_slot()
+        try:
+            self.driver = make_driver(self.viewport, cache_dir)
+        except Exception:
+            asset_cache.release_slot(self.cache_slot)
+            raise
+        self.uses = 0
+        self.created = time.time()
+
+    def is_alive(self):
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def reset(self):
+        """Wipe cookies, storage and anything we injected so the next site starts clean."""
+        driver = self.driver
+        try:
+            driver.execute_script("try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}")
+        except Exception:
+            pass
+        try:
+            origin = driver.execute_script("return window.location.origin;")
+            if origin and origin != "null":
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        except Exception:
+            pass
+        driver.delete_all_cookies()
+        try:
+            driver.execute_cdp_cmd("Emulation.clearDeviceMetricsOverride", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+        except Exception:
+            pass
+        # leaving the page drops the injected font style along with everything else
+        driver.get("about:blank")
+        driver.set_window_rect(0, 0, self.viewport[0], self.viewport[1] + CHROME_HEADER_PADDING)
+
+    def quit(self):
+        try:
+            self.driver.quit()
+            print("[✓] WebDriver quit successfully.")
+        except Exception as quit_err:
+            print(f"[!] Error quitting WebDriver: {quit_err}")
+        # Chrome has let go of the cache directory, the next session can have it
+        asset_cache.release_slot(self.cache_slot)
+
+
+class BrowserPool:
+    def __init__(self, max_sessions=POOL_MAX_SESSIONS, max_uses=POOL_MAX_USES):
+        self.max_sessions = max_sessions
+        self.max_uses = max_uses
+        self._idle = {}        # viewport -> [BrowserSession]
+        self._live = 0         # idle + checked out
+        self._cond = threading.Condition()
+        self._closed = False
+        # counters for stats()
+        self._checkouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _idle_count(self):
+        return sum(len(v) for v in self._idle.values())
+
+    def _evict_idle_other_viewport(self, viewport):
+        # at the cap with nothing idle for this viewport: sacrifice an idle session of another size
+        for key, sessions in self._idle.items():
+            if key != viewport and sessions:
+                victim = sessions.pop(0)
+                self._live -= 1
+                self._recycled += 1
+                return victim
+        return None
+
+    def acquire(self, viewport, timeout=POOL_CHECKOUT_TIMEOUT):
+        viewport = tuple(viewport)
+        start = time.monotonic()
+        victim = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed")
+                idle = self._idle.get(viewport)
+                if idle:
+                    session = idle.pop()
+                    break
+                if self._live < self.max_sessions:
+                    session = None
+                    self._live += 1
+                    break
+                victim = self._evict_idle_other_viewport(viewport)
+                if victim:
+                    session = None
+                    self._live += 1
+                    break
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise TimeoutError(f"No browser session free for viewport {viewport} after {timeout}s")
+                self._cond.wait(remaining)
+
+        stages.record("checkout", time.monotonic() - start)
+        if victim:
+            victim.quit()
+
+        # health check outside the lock, a dead idle session gets replaced
+        if session is not None and not session.is_alive():
+            print(f"[!] Pooled browser for {viewport} died while idle, replacing it.")
+            session.quit()
+            session = None
+            with self._cond:
+                self._recycled += 1
+
+        if session is None:
+            try:
+                with stages.stage("driver_start"):
+                    session = BrowserSession(viewport)
+            except Exception:
+                with self._cond:
+                    self._live -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        session.uses += 1
+        return session
+
+    def release(self, session, broken=False):
+        if not broken and session.uses < self.max_uses:
+            try:
+                session.reset()
+            except Exception as e:
+                print(f"[!] Failed to reset pooled browser, recycling it: {e}")
+                broken = True
+
+        retire = broken or session.uses >= self.max_uses
+        with self._cond:
+            if retire or self._closed:
+                self._live -= 1
+                self._recycled += 1
+            else:
+                self._idle.setdefault(session.viewport, []).append(session)
+            self._cond.notify()
+        if retire or self._closed:
+            session.quit()
+
+    @contextmanager
+    def checkout(self, viewport, timeout=POOL_CHECKOUT_TIMEOUT):
+        session = self.acquire(viewport, timeout)
+        broken = False
+        try:
+            yield session.driver
+        except Exception:
+            # we can't tell a page error from a crashed browser, so don't hand this one out again
+            broken = True
+            raise
+        finally:
+            self.release(session, broken=broken)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_sessions": self.max_sessions,
+                "max_uses": self.max_uses,
+                "live": self._live,
+                "idle": self._idle_count(),
+                "in_use": self._live - self._idle_count(),
+                "idle_by_viewport": {f"{k[0]}x{k[1]}": len(v) for k, v in self._idle.items() if v},
+                "checkouts": self._checkouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "avg_wait_seconds": round(self._wait_total / self._checkouts, 4) if self._checkouts else 0.0,
+                "max_wait_seconds": round(self._wait_max, 4),
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            sessions = [s for v in self._idle.values() for s in v]
+            self._idle = {}
+            self._live -= len(sessions)
+            self._cond.notify_all()
+        for session in sessions:
+            session.quit()
+
+
+pool = BrowserPool()
@@ -0,0 +1,126 @@
+import cv2
+import numpy as np
+
+import compare
+
+### Pluggable scoring for the full-resolution tier of compare.compare_frames(). A comparator takes
+### two same-shape BGR uint8 frames (and an optional ignore mask) and says how different they are
+### and whether that's significant. Pick one per site with "comparator": "mse" | "ssim".
+###   mse  - mean squared error, the original behaviour. Cheap, but every pixel counts the same,
+###          so a lot of tiny anti-aliasing noise and one real change can score alike.
+###   ssim - structural similarity, computed per SSIM_BLOCK x SSIM_BLOCK block from block means (no
+###          sliding window), then averaged over SSIM_CELL x SSIM_CELL blocks so one changed
+###          button can't hide in a page-wide mean. Significant if the page mean or the worst
+###          cell drops below its floor.
+### benchmarks/compare_bench.py measures speed and false positives for each one.
+SSIM_BLOCK = 8           # px, SSIM statistics window
+SSIM_CELL = 4            # blocks per side of a scoring cell (32px with 8px blocks)
+SSIM_MIN = 0.97          # page-wide mean SSIM under this is significant
+SSIM_CELL_MIN = 0.75     # any cell under this is significant
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+
+class Comparator:
+    name = None
+
+    def score(self, prev, curr, mask=None, known_mse=None):
+        """Returns {"score": float, "significant": bool, ...comparator specific extras}.
+        known_mse is the frames' full-resolution MSE (under mask) when the caller already has it."""
+        raise NotImplementedError
+
+
+class MseComparator(Comparator):
+    name = "mse"
+
+    def __init__(self, threshold=None):
+        self.threshold = compare.MSE_THRESHOLD if threshold is None else threshold
+
+    def score(self, prev, curr, mask=None, known_mse=None):
+        error = compare.mse(prev, curr, mask) if known_mse is None else known_mse
+        return {"score": error, "significant": error > self.threshold}
+
+
+def _pad_to(grid, multiple, value=0):
+    h, w = grid.shape[:2]
+    ph, pw = -h % multiple, -w % multiple
+    if ph or pw:
+        grid = cv2.copyMakeBorder(grid, 0, ph, 0, pw, cv2.BORDER_CONSTANT, value=value)
+    return grid
+
+
+def _block_means(img, block):
+    # INTER_AREA with an exact integer factor is a block mean, and far faster than reshape().mean()
+    h, w = img.shape[:2]
+    return cv2.resize(img, (w // block, h // block), interpolation=cv2.INTER_AREA)
+
+
+def _luminance(mu_a, mu_b):
+    return (2 * mu_a * mu_b + _C1) / (mu_a * mu_a + mu_b * mu_b + _C1)
+
+
+def block_ssim(prev, curr, block=SSIM_BLOCK):
+    """SSIM per non-overlapping block, as a (rows, cols) float32 grid.
+
+    Structure and contrast come from the grey frames; the luminance term is taken per colour
+    channel (the worst one), otherwise a recoloured button with the same grey level scores ~1.
+    """
+    a = _pad_to(prev, block).astype(np.float32)
+    b = _pad_to(curr, block).astype(np.float32)
+    mu_a3, mu_b3 = _block_means(a, block), _block_means(b, block)
+    lum = _luminance(mu_a3, mu_b3)
+    lum = lum.min(axis=2) if lum.ndim == 3 else lum
+    ga = cv2.cvtColor(a, cv2.COLOR_BGR2GRAY) if a.ndim == 3 else a
+    gb = cv2.cvtColor(b, cv2.COLOR_BGR2GRAY) if b.ndim == 3 else b
+    mu_a, mu_b = _block_means(ga, block), _block_means(gb, block)
+    var_a = _block_means(ga * ga, block) - mu_a * mu_a
+    var_b = _block_means(gb * gb, block) - mu_b * mu_b
+    cov = _block_means(ga * gb, block) - mu_a * mu_b
+    return lum * (2 * cov + _C2) / (var_a + var_b + _C2)
+
+
+class SsimComparator(Comparator):
+    name = "ssim"
+
+    def __init__(self, threshold=None, cell_threshold=SSIM_CELL_MIN, block=SSIM_BLOCK, cell=SSIM_CELL):
+        # threshold here is the page-wide SSIM floor, not an MSE
+        self.threshold = SSIM_MIN if threshold is None else threshold
+        self.cell_threshold = cell_threshold
+        self.block = block
+        self.cell = cell
+
+    def score(self, prev, curr, mask=None, known_mse=None):
+        grid = block_ssim(prev, curr, self.block)
+        keep = None
+        if mask is not None:
+            # a block counts if at most half of it is ignored
+            m = _block_means(_pad_to(mask, self.block).astype(np.float32) / 255, self.block)
+            keep = m >= 0.5
+            grid = np.where(keep, grid, 1.0).astype(np.float32)
+        mean = float(grid[keep].mean()) if keep is not None and keep.any() else float(grid.mean())
+        cells = _block_means(_pad_to(grid, self.cell, 1.0), self.cell)
+        worst = float(cells.min())
+        return {
+            "score": round(1.0 - mean, 5),   # dissimilarity, higher = more different
+            "ssim": round(mean, 5),
+            "ssim_worst_cell": round(worst, 5),
+            "significant": mean < self.threshold or worst < self.cell_threshold,
+        }
+
+
+COMPARATORS = {
+    "mse": MseComparator,
+    "ssim": SsimComparator,
+}
+DEFAULT_COMPARATOR = "mse"
+
+
+def get(name=None, mse_threshold=None):
+    """Comparator instance by name ("mse" if None). Raises ValueError for unknown names.
+    mse_threshold only applies to the mse comparator, the others keep their own floors."""
+    if isinstance(name, Comparator):
+        return name
+    cls = COMPARATORS.get(name or DEFAULT_COMPARATOR)
+    if cls is None:
+        raise ValueError(f"unknown comparator {name!r}, expected one of {', '.join(COMPARATORS)}")
+    return cls(mse_threshold) if cls is MseComparator else cls()
@@ -0,0 +1,285 @@
+import hashlib
+import time
+
+import cv2
+import numpy as np
+
+import comparators
+
+### Tiered frame comparison, cheapest test first:
+###   1. exact  - identical decoded pixels (digest match), nothing else runs
+###   2. lowres - "no change" when the MSE is under PRECHECK_SKIP_MSE. The integer MSE of the
+###               PRECHECK_WIDTH-wide thumbnails (cached with the baseline) is tried first, but it
+###               can only confirm a change: area-downscaling averages blocks, so it's a lower
+###               bound of the full MSE, and a fine pattern that flips phase averages out to the
+###               same thumbnail. A thumbnail score at or over the bound goes straight to tier 3;
+###               a low one is checked at full resolution (one masked cv2.norm pass) before
+###               stopping here, and that MSE is handed on so tier 3 doesn't compute it again.
+###               Either way a changed frame costs one full-resolution MSE, not two.
+###   3. full   - full resolution score from the site's comparator (comparators.py, MSE by
+###               default), only for frames that got this far. No diff image is drawn here,
+###               diffs.py renders one from the stored frames when someone looks at it
+### None of the tiers build float64 copies of the frames any more.
+### When the full tier says "significant" and alignment is on (off by default, per site with
+### align_shifts), we check whether the difference is really content that moved up or down (a
+### banner growing by 10px pushes everything under it). If one vertical shift explains it, the
+### frames are lined up again and scored a second time, see find_vertical_shift. The rows that were
+### inserted or removed still count: they are scored against what used to be there, so a new
+### banner is a change in proportion to its size rather than being lined up out of the score.
+### Frames of different sizes are compared on their common area instead of being resized.
+### Ignore regions come in as a uint8 mask (255 = compare, 0 = ignore) and are applied inside the
+### norm/MSE calls themselves. Watch regions get their own score and threshold, and are scored at
+### full resolution even when the low-res tier would have stopped, since they're usually small.
+MSE_THRESHOLD = 50         # same "significant change" bar capture_job always used
+PRECHECK_WIDTH = 256
+PRECHECK_SKIP_MSE = 5      # full-res MSE under this never reaches the comparator
+DIFF_PIXEL_THRESHOLD = 30  # per-pixel grey level that counts as "changed" in diff images
+ALIGN_SHIFTS = False       # line up vertically shifted content before deciding
+ALIGN_MAX_SHIFT = 200      # px content may move and still be lined up
+ALIGN_MIN_GAIN = 4         # the shift has to explain the difference this many times better than none
+_PROFILE_BINS = 16         # row profile width used to find shifts
+
+
+def frame_digest(img):
+    """Stable digest of the decoded pixels (shape included), used for exact-match checks."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(img.shape).encode())
+    h.update(np.ascontiguousarray(img).data)
+    return h.hexdigest()
+
+
+def downscale(img, width=PRECHECK_WIDTH):
+    h, w = img.shape[:2]
+    if w <= width:
+        return img
+    height = max(1, round(h * width / w))
+    return cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def build_mask(shape, ignore_rects):
+    """uint8 mask for a frame of this shape with ignore_rects ([x, y, w, h]) zeroed, or None."""
+    if not ignore_rects:
+        return None
+    mask = np.full(shape[:2], 255, np.uint8)
+    for x, y, w, h in ignore_rects:
+        mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = 0
+    return mask
+
+
+def _channels(img):
+    return img.shape[2] if img.ndim == 3 else 1
+
+
+def mse(imageA, imageB, mask=None):
+    # L2SQR norm is summed in C without a float copy of either frame
+    if mask is None:
+        return cv2.norm(imageA, imageB, cv2.NORM_L2SQR) / imageA.size
+    count = cv2.countNonZero(mask)
+    if count == 0:
+        return 0.0
+    return cv2.norm(imageA, imageB, cv2.NORM_L2SQR, mask) / (count * _channels(imageA))
+
+
+def lowres_mse(smallA, smallB, small_mask=None):
+    # int64 so the dot product can't overflow, still tiny at thumbnail size
+    d = smallA.astype(np.int64) - smallB.astype(np.int64)
+    if small_mask is not None:
+        d = d[small_mask]
+    d = d.ravel()
+    if d.size == 0:
+        return 0.0
+    return float(np.dot(d, d)) / d.size
+
+
+def region_scores(prev, curr, watch, mask=None):
+    """MSE inside each watch region (respecting the ignore mask), against the region's own threshold."""
+    height, width = prev.shape[:2]
+    scores = {}
+    for region in watch or []:
+        total, count = 0.0, 0
+        for x, y, w, h in region["rects"]:
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            a, b = prev[y0:y1, x0:x1], curr[y0:y1, x0:x1]
+            m = mask[y0:y1, x0:x1] if mask is not None else None
+            n = cv2.countNonZero(m) if m is not None else (y1 - y0) * (x1 - x0)
+            if n == 0:
+                continue
+            total += cv2.norm(a, b, cv2.NORM_L2SQR, m) if m is not None else cv2.norm(a, b, cv2.NORM_L2SQR)
+            count += n * _channels(a)
+        score = total / count if count else 0.0
+        scores[region["name"]] = {
+            "mse": round(score, 3),
+            "threshold": region["threshold"],
+            "changed": score > region["threshold"],
+        }
+    return scores
+
+
+def _row_profile(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    return cv2.resize(gray, (_PROFILE_BINS, gray.shape[0]), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def find_vertical_shift(prev, curr, max_shift=ALIGN_MAX_SHIFT):
+    """(row, shift) if everything from row down moved by shift px in curr (positive = down),
+    or None when no single shift explains the difference much better than no shift."""
+    pa, pb = _row_profile(prev), _row_profile(curr)
+    height = pa.shape[0]
+    differing = np.flatnonzero(np.abs(pa - pb).max(axis=1) > 1.0)
+    if differing.size == 0:
+        return None
+    row = int(differing[0])
+    base = float(np.abs(pa[row:] - pb[row:]).mean())
+    best, best_shift = base, 0
+    for shift in range(-max_shift, max_shift + 1):
+        s = abs(shift)
+        overlap = height - row - s
+        if shift == 0 or overlap < max(s, 16):
+            continue  # too little left to line up
+        if shift > 0:
+            residual = float(np.abs(pa[row:height - s] - pb[row + s:]).mean())
+        else:
+            residual = float(np.abs(pa[row + s:] - pb[row:height - s]).mean())
+        if residual < best:
+            best, best_shift = residual, shift
+    if best_shift == 0 or best * ALIGN_MIN_GAIN > base:
+        return None
+    # the first differing row is only where the band ends up being noticed: a band inserted into
+    # blank space could start anywhere in that blank run. Put it where it differs least from what
+    # the other frame had there, since that's what align_vertical() will score it against.
+    s = abs(best_shift)
+    plain, banded = (pa, pb) if best_shift > 0 else (pb, pa)
+    lo, hi = max(0, row - s), min(height, row + 2 * s)
+    costs = [float(np.abs(np.concatenate([plain[:start + s], plain[start:height - s]])[lo:hi] - banded[lo:hi]).sum())
+             for start in range(lo, row + 1)]
+    return lo + int(np.argmin(costs)), best_shift
+
+
+def align_vertical(prev, curr, row, shift):
+    """Undo a shift from find_vertical_shift(). Returns same-shape (prev, curr) with the moved
+    content lined up again, in the coordinates of the frame that has the band. The inserted (or
+    removed) band is kept in the comparison, opposite the rows the other frame had there, so it
+    scores as changed; only what scrolled off the bottom of the other frame is dropped."""
+    height, s = prev.shape[0], abs(shift)
+    if shift > 0:
+        prev = np.concatenate([prev[:row + s], prev[row:height - s]])
+    else:
+        curr = np.concatenate([curr[:row + s], curr[row:height - s]])
+    return prev, curr
+
+
+def highlight_diff(prev, curr, pixel_threshold=DIFF_PIXEL_THRESHOLD, mask=None):
+    diff_image = cv2.absdiff(prev, curr)
+    gray_diff = cv2.cvtColor(diff_image, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray_diff, pixel_threshold, 255, cv2.THRESH_BINARY)
+    if mask is not None:
+        thresh = cv2.bitwise_and(thresh, mask)
+    highlighted = curr.copy()
+    highlighted[thresh > 0] = [0, 0, 255]  # Highlight changed pixels in red
+    working = diff_image.nbytes + gray_diff.nbytes + thresh.nbytes + highlighted.nbytes
+    return highlighted, working
+
+
+def compare_frames(prev, curr, threshold=MSE_THRESHOLD, prev_digest=None, curr_digest=None,
+                   prev_small=None, curr_small=None, mask=None, watch=None,
+                   comparator=None, align=ALIGN_SHIFTS):
+    """Compare two BGR uint8 frames (different sizes are compared on their common area).
+
+    Digests and downscaled copies can be passed in when the caller already has them.
+    mask is an optional ignore mask from build_mask(); watch is a list of
+    {name, rects, threshold} regions, any of which going over its threshold is significant.
+    comparator is a name from comparators.COMPARATORS (threshold is the MSE one, other
+    comparators have their own); align enables vertical-shift alignment.
+    Returns a dict with the tier that decided, the scores, timing and working_bytes, an
+    estimate of the scratch memory the tiers allocated (array sizes added up, not measured).
+    """
+    start = time.perf_counter()
+    result = {
+        "tier": "exact",
+        "mse": 0.0,
+        "lowres_mse": None,
+        "significant": False,
+        "seconds": 0.0,
+        "working_bytes": 0,
+        "regions": {},
+    }
+
+    if prev.shape != curr.shape:
+        # resizing would smear every pixel, compare what both frames cover instead
+        result["shapes"] = [list(prev.shape[:2]), list(curr.shape[:2])]
+        height, width = min(prev.shape[0], curr.shape[0]), min(prev.shape[1], curr.shape[1])
+        prev, curr = prev[:height, :width], curr[:height, :width]
+        mask = mask[:height, :width] if mask is not None else None
+        prev_digest = curr_digest = prev_small = curr_small = None
+
+    prev_digest = prev_digest or frame_digest(prev)
+    curr_digest = curr_digest or frame_digest(curr)
+    if prev_digest == curr_digest:
+        result["regions"] = {r["name"]: {"mse": 0.0, "threshold": r["threshold"], "changed": False} for r in watch or []}
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    result["regions"] = region_scores(prev, curr, watch, mask)
+    region_changed = any(r["changed"] for r in result["regions"].values())
+
+    result["tier"] = "lowres"
+    small_a = prev_small if prev_small is not None else downscale(prev)
+    small_b = curr_small if curr_small is not None else downscale(curr)
+    small_mask = None
+    if mask is not None:
+        # a thumbnail pixel only counts if none of the pixels it covers were ignored
+        small_mask = cv2.resize(mask, (small_a.shape[1], small_a.shape[0]), interpolation=cv2.INTER_AREA) == 255
+    low = lowres_mse(small_a, small_b, small_mask)
+    result["lowres_mse"] = low
+    result["mse"] = low
+    # estimate: the two thumbnails and lowres_mse's int64 copies of them
+    result["working_bytes"] = small_a.nbytes + small_b.nbytes + small_a.size * 8 * 2
+    full = None
+    if low < PRECHECK_SKIP_MSE and not region_changed:
+        # the thumbnails agreeing proves nothing (see the top of the file), the full frames have to
+        full = mse(prev, curr, mask)
+        if full < PRECHECK_SKIP_MSE:
+            result["mse"] = full
+            result["seconds"] = time.perf_counter() - start
+            return result
+
+    result["tier"] = "full"
+    comp = comparators.get(comparator, mse_threshold=threshold)
+    result["comparator"] = comp.name
+    scored = comp.score(prev, curr, mask, known_mse=full)
+    if scored["significant"] and align:
+        shift = find_vertical_shift(prev, curr)
+        if shift:
+            a_prev, a_curr = align_vertical(prev, curr, *shift)
+            aligned = comp.score(a_prev, a_curr, mask)
+            if aligned["score"] < scored["score"]:
+                prev, curr, scored, full = a_prev, a_curr, aligned, None
+                result["shift"] = {"row": shift[0], "by": shift[1]}
+    if comp.name == "mse":
+        result["mse"] = scored["score"]
+    else:
+        result["mse"] = full if full is not None else mse(prev, curr, mask)
+    result["score"] = scored["score"]
+    result.update({k: v for k, v in scored.items() if k not in ("score", "significant")})
+    if scored["significant"] or region_changed:
+        result["significant"] = True
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def summarize(result):
+    """The JSON-safe bits of a compare_frames() result, for metadata records."""
+    return {
+        "tier": result["tier"],
+        "mse": round(float(result["mse"]), 3),
+        "lowres_mse": None if result["lowres_mse"] is None else round(float(result["lowres_mse"]), 3),
+        "seconds": round(result["seconds"], 4),
+        "working_bytes": int(result["working_bytes"]),   # an estimate, see compare_frames
+        "regions": result.get("regions", {}),
+        "comparator": result.get("comparator"),
+        "score": None if result.get("score") is None else round(float(result["score"]), 5),
+        **{k: result[k] for k in ("shift", "shapes", "ssim", "ssim_worst_cell") if k in result},
+    }
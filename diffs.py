@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import cv2
+import numpy as np
+
+import blobstore
+import storage
+from compare import DIFF_PIXEL_THRESHOLD, align_vertical, build_mask, highlight_diff
+
+### Diff images, rendered the first time someone asks for one instead of by the capture.
+### Most changes are dismissed without their diff ever being opened, so capture_job only decides
+### "significant" and records which two frames differ; the picture is drawn from those frames
+### when /static/screenshots/diffs/... is requested (app.serve_screenshot) and kept in a cache:
+###   screenshots/diffs/3f/<prev digest>-<curr digest>[-<spec>].<mode>.png
+### <spec> names what compare_frames did to the frames before scoring them (ignore regions, a
+### vertical shift it lined up), stored once in the diff_specs table, so the diff shows exactly
+### what was scored. Visualizations, picked by the <mode> part of the name:
+###   highlight    - the current frame with changed pixels in red (what capture_job used to write)
+###   heatmap      - how much each pixel changed, colour mapped over a grey copy of the frame
+###   side_by_side - before | after, changed areas boxed on both
+###   boxes        - the current frame with a box around each changed area (connected components)
+### The cache is bounded by DIFF_CACHE_MAX_MB, least recently served files are deleted first. A
+### deleted diff is simply rendered again, as long as its two frames are still stored.
+DIFF_CACHE_DIR = os.path.join(storage.SCREENSHOT_BASE, "diffs")
+DIFF_CACHE_MAX_MB = 512
+DIFF_MODES = ("highlight", "heatmap", "side_by_side", "boxes")
+DEFAULT_MODE = "highlight"
+HEATMAP_GAIN = 4           # grey-level differences are small, stretch them before colour mapping
+BOX_MERGE_PX = 9           # changed pixels closer than this end up in one box
+BOX_MIN_AREA = 25          # components smaller than this (px) are anti-aliasing noise, not boxed
+SIDE_BY_SIDE_GAP = 8
+
+_NAME = re.compile(r"^diffs/[0-9a-f]{2}/([0-9a-f]+)-([0-9a-f]+)(?:-([0-9a-f]+))?\.([a-z_]+)\.png$")
+_lock = threading.Lock()
+_cache_bytes = None        # running total, read from disk on the first write
+
+
+def _spec_key(spec):
+    return hashlib.blake2b(json.dumps(spec, sort_keys=True).encode(), digest_size=6).hexdigest()
+
+
+def diff_name(prev_digest, curr_digest, spec_key=None, mode=DEFAULT_MODE):
+    stem = f"{prev_digest}-{curr_digest}" + (f"-{spec_key}" if spec_key else "")
+    return f"diffs/{prev_digest[:2]}/{stem}.{mode}.png"
+
+
+def diff_url(prev_digest, curr_digest, ignore=None, shift=None, mode=DEFAULT_MODE):
+    """URL the diff of two stored frames will be served at. Nothing is rendered until it's requested.
+    ignore is the list of [x, y, w, h] rects the comparison masked out, shift its {"row", "by"}."""
+    if not prev_digest or not curr_digest:
+        return None
+    spec = {}
+    if ignore:
+        spec["ignore"] = [[int(v) for v in rect] for rect in ignore]
+    if shift:
+        spec["shift"] = [int(shift["row"]), int(shift["by"])]
+    key = None
+    if spec:
+        key = _spec_key(spec)
+        storage.put_diff_spec(key, spec)
+    return blobstore.blob_url(os.path.join(storage.SCREENSHOT_BASE, diff_name(prev_digest, curr_digest, key, mode)))
+
+
+def parse(filename):
+    """(prev digest, curr digest, spec key, mode) for a diffs/... name under screenshots/, or None."""
+    m = _NAME.match(filename)
+    if not m or m.group(4) not in DIFF_MODES:
+        return None
+    return m.group(1), m.group(2), m.group(3), m.group(4)
+
+
+def changed_mask(prev, curr, mask=None, pixel_threshold=DIFF_PIXEL_THRESHOLD):
+    gray = cv2.cvtColor(cv2.absdiff(prev, curr), cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, pixel_threshold, 255, cv2.THRESH_BINARY)
+    if mask is not None:
+        thresh = cv2.bitwise_and(thresh, mask)
+    return thresh
+
+
+def changed_boxes(thresh):
+    """[x, y, w, h] of each changed area. Nearby pixels are merged first so a changed line of
+    text is one box, not one per glyph."""
+    merged = cv2.dilate(thresh, np.ones((BOX_MERGE_PX, BOX_MERGE_PX), np.uint8))
+    _, _, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+    boxes = []
+    for x, y, w, h, area in stats[1:]:   # 0 is the background
+        if area >= BOX_MIN_AREA:
+            boxes.append([int(x), int(y), int(w), int(h)])
+    return boxes
+
+
+def _draw_boxes(frame, boxes):
+    out = frame.copy()
+    for x, y, w, h in boxes:
+        cv2.rectangle(out, (x, y), (x + w - 1, y + h - 1), (0, 0, 255), 2)
+    return out
+
+
+def render(prev, curr, mode=DEFAULT_MODE, ignore=None, shift=None):
+    """Draw the diff of two BGR frames the way compare_frames saw them: common area only,
+    shift lined up, ignore rects left out."""
+    if mode not in DIFF_MODES:
+        raise ValueError(f"unknown diff mode {mode!r}, expected {', '.join(DIFF_MODES)}")
+    height, width = min(prev.shape[0], curr.shape[0]), min(prev.shape[1], curr.shape[1])
+    prev, curr = prev[:height, :width], curr[:height, :width]
+    mask = build_mask(prev.shape, ignore)
+    if shift:
+        prev, curr = align_vertical(prev, curr, *shift)
+
+    if mode == "highlight":
+        return highlight_diff(prev, curr, mask=mask)[0]
+    if mode == "heatmap":
+        gray = cv2.cvtColor(cv2.absdiff(prev, curr), cv2.COLOR_BGR2GRAY)
+        if mask is not None:
+            gray = cv2.bitwise_and(gray, mask)
+        heat = cv2.applyColorMap(cv2.convertScaleAbs(gray, alpha=HEATMAP_GAIN), cv2.COLORMAP_JET)
+        base = cv2.cvtColor(cv2.cvtColor(curr, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+        return cv2.addWeighted(base, 0.35, heat, 0.65, 0)
+    boxes = changed_boxes(changed_mask(prev, curr, mask))
+    if mode == "boxes":
+        return _draw_boxes(curr, boxes)
+    gap = np.full((height, SIDE_BY_SIDE_GAP, 3), 255, np.uint8)
+    return np.hstack([_draw_boxes(prev, boxes), gap, _draw_boxes(curr, boxes)])
+
+
+def _scan():
+    files = []
+    for root, _, names in os.walk(DIFF_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+    return files
+
+
+def prune(max_mb=None):
+    """Delete least recently served diffs (and their thumbnails) until the cache fits. Returns bytes freed."""
+    global _cache_bytes
+    limit = (DIFF_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    with _lock:
+        files = _scan()
+        total = sum(size for _, size, _ in files)
+        freed = 0
+        # down to 90% so the next few renders don't each trigger a sweep
+        for _, size, path in sorted(files) if total > limit else ():
+            if total - freed <= limit * 0.9:
+                break
+            try:
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+        _cache_bytes = total - freed
+    if freed:
+        print(f"[🗑] Diff cache over {limit / 1e6:.0f} MB, removed {freed / 1e6:.1f} MB of least recently viewed diffs")
+    return freed
+
+
+def _added(size):
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(s for _, s, _ in _scan())
+        else:
+            _cache_bytes += size
+        over = _cache_bytes > DIFF_CACHE_MAX_MB * 1024 * 1024
+    if over:
+        prune()
+
+
+def ensure(filename):
+    """Path of the diff image filename (relative to screenshots/) names, rendered now if it isn't
+    cached. None if the name isn't a diff or one of its frames is gone."""
+    parsed = parse(filename)
+    if parsed is None:
+        return None
+    prev_digest, curr_digest, spec_key, mode = parsed
+    path = os.path.join(storage.SCREENSHOT_BASE, filename)
+    if os.path.exists(path):
+        try:
+            os.utime(path)   # mtime is the LRU clock for prune()
+        except OSError:
+            pass
+        return path
+
+    spec = {}
+    if spec_key:
+        spec = storage.get_diff_spec(spec_key)
+        if spec is None:
+            return None
+    prev = cv2.imread(blobstore.blob_path(prev_digest), cv2.IMREAD_COLOR)
+    curr = cv2.imread(blobstore.blob_path(curr_digest), cv2.IMREAD_COLOR)
+    if prev is None or curr is None:
+        return None
+    frame = render(prev, curr, mode, ignore=spec.get("ignore"), shift=spec.get("shift"))
+    ok, buf = cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+    if not ok:
+        raise IOError(f"Diff encode failed for {path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(tmp, path)   # two requests rendering the same diff both write the same bytes
+    _added(len(buf))
+    return path
+
+
+def stats():
+    files = _scan()
+    return {"files": len(files), "mb": round(sum(s for _, s, _ in files) / 1e6, 1), "max_mb": DIFF_CACHE_MAX_MB}
@@ -0,0 +1,77 @@
+import atexit
+import os
+import queue
+import threading
+
+import cv2
+
+### Background PNG writer. Captures hand over the decoded frame and carry on; the encode and the
+### disk write happen on this thread. Files are written to a temp name and renamed into place so
+### the dashboard never serves a half-written PNG. Other off-capture image work (thumbnails)
+### goes through submit() and runs on the same thread.
+PNG_COMPRESSION = 3     # 0-9, cv2 IMWRITE_PNG_COMPRESSION. Lower is faster/bigger.
+
+_queue = queue.Queue()
+_thread = None
+_thread_lock = threading.Lock()
+_stats = {"written": 0, "failed": 0, "bytes": 0}
+
+
+def write_now(path, frame, level):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    ok, buf = cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, level])
+    if not ok:
+        raise IOError(f"PNG encode failed for {path}")
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(tmp, path)
+    return len(buf)
+
+
+def _worker():
+    while True:
+        func, args, label, done = _queue.get()
+        try:
+            size = func(*args)
+            _stats["written"] += 1
+            _stats["bytes"] += size or 0
+        except Exception as e:
+            _stats["failed"] += 1
+            print(f"[!] Failed to write {label}: {e}")
+        finally:
+            if done:
+                done.set()
+            _queue.task_done()
+
+
+def _ensure_thread():
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_worker, name="image-writer", daemon=True)
+            _thread.start()
+
+
+def submit(func, *args, label=None, wait=False):
+    """Run func(*args) on the writer thread, in order with the PNG writes. func may return bytes written."""
+    _ensure_thread()
+    done = threading.Event() if wait else None
+    _queue.put((func, args, label or getattr(func, "__name__", "job"), done))
+    if done:
+        done.wait()
+
+
+def flush():
+    """Block until everything queued so far has been written."""
+    if _thread is not None:
+        _queue.join()
+
+
+def stats():
+    return {**_stats, "queued": _queue.qsize()}
+
+
+atexit.register(flush)
@@ -15,7 +15,7 @@ source venv/bin/activate
 
 # Install Python packages
 pip install --upgrade pip
-pip install flask apscheduler selenium pillow opencv-python-headless numpy
+pip install -r requirements.txt
 
 echo "✓ Setup complete."
 echo "Activate the environment with: source venv/bin/activate"
@@ -0,0 +1,170 @@
+import json
+import time
+from urllib.parse import urlparse
+
+import storage
+
+### Durable capture queue for worker.py, a table in the same SQLite database as everything else.
+### With scheduler.DISPATCH = "queue" the Flask process only enqueues; any number of workers on the
+### same host claim and run the tasks. Only the same host: WAL mode needs the database's shared
+### memory index, which network filesystems don't provide, so workers elsewhere would corrupt it.
+###   queued -> leased (a worker holds it until lease_expires) -> done | failed
+### A worker renews its lease while a capture runs. If it dies the lease runs out and the next
+### claim() hands the task to someone else, up to MAX_ATTEMPTS claims in total. Every attempt
+### captures under the same timestamp (task_timestamp), so when a worker that lost its lease still
+### gets its rows in, the retry replaces them rather than adding a second capture. Failures go back
+### to queued with an exponential backoff. A site has at most one open (queued/leased) task, so a
+### site that's still waiting or running isn't queued twice (same as coalesce in scheduler.py).
+LEASE_SECONDS = 120           # a worker that doesn't heartbeat for this long has lost the task
+HEARTBEAT_SECONDS = 30
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 60    # doubled for every failed attempt
+MAX_PER_HOST = 1              # tasks for one host leased at once, across all workers
+KEEP_FINISHED_HOURS = 24      # done/failed rows are pruned after this
+
+
+def _host(url):
+    return (urlparse(url).hostname or "") if url else ""
+
+
+def enqueue(job_id, url=None, planned_at=None):
+    """Queue a capture of job_id. Returns the task id, or None if the site already has an open task."""
+    now = time.time()
+    with storage.transaction() as conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO tasks(job_id, host, planned_at, available_at) VALUES (?, ?, ?, ?)",
+            (job_id, _host(url), planned_at or now, now),
+        )
+        return cur.lastrowid if cur.rowcount else None
+
+
+def open_task(job_id):
+    """Id of the site's queued or leased task, None if it has none."""
+    row = storage.connect().execute(
+        "SELECT id FROM tasks WHERE job_id = ? AND state IN ('queued', 'leased')", (job_id,)).fetchone()
+    return row["id"] if row else None
+
+
+def get_tasks(task_ids):
+    """{id: task} for the ids that still exist (pruned ones are missing)."""
+    if not task_ids:
+        return {}
+    ids = list(task_ids)
+    rows = storage.connect().execute(
+        f"SELECT * FROM tasks WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+    return {row["id"]: _task(row) for row in rows}
+
+
+def _task(row):
+    return dict(row) if row else None
+
+
+def task_timestamp(task):
+    """Capture timestamp for every attempt at task: when it was due, in capture timestamp format."""
+    return time.strftime("%Y%m%d_%H%M%S", time.localtime(task["planned_at"]))
+
+
+def _reclaim_expired(conn, now):
+    # leases nobody renewed: the worker is gone. Out of attempts -> failed, otherwise up for grabs
+    conn.execute(
+        "UPDATE tasks SET state = 'failed', finished_at = ?, error = 'lease expired (worker lost)' "
+        "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+        (now, now, MAX_ATTEMPTS),
+    )
+    conn.execute(
+        "UPDATE tasks SET state = 'queued', lease_owner = NULL, lease_expires = NULL, "
+        "error = 'lease expired (worker lost)' WHERE state = 'leased' AND lease_expires < ?",
+        (now,),
+    )
+
+
+def claim(worker_id):
+    """Lease the next runnable task to worker_id, or None. Hosts already at MAX_PER_HOST are skipped."""
+    now = time.time()
+    with storage.transaction() as conn:
+        _reclaim_expired(conn, now)
+        row = conn.execute(
+            "SELECT id FROM tasks t WHERE state = 'queued' AND available_at <= ? "
+            "AND (host = '' OR (SELECT COUNT(*) FROM tasks b WHERE b.state = 'leased' AND b.host = t.host) < ?) "
+            "ORDER BY available_at, id LIMIT 1",
+            (now, MAX_PER_HOST),
+        ).fetchone()
+        if row is None:
+            return None
+        return _task(conn.execute(
+            "UPDATE tasks SET state = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, "
+            "started_at = ? WHERE id = ? RETURNING *",
+            (worker_id, now + LEASE_SECONDS, now, row["id"]),
+        ).fetchone())
+
+
+def heartbeat(task_id, worker_id):
+    """Extend the lease. False means it was lost (expired and reclaimed), the result won't be accepted."""
+    with storage.transaction() as conn:
+        cur = conn.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time() + LEASE_SECONDS, task_id, worker_id),
+        )
+        return cur.rowcount == 1
+
+
+def complete(task_id, worker_id, result=None):
+    """Mark the task done, only if worker_id still holds the lease. Returns whether it did."""
+    with storage.transaction() as conn:
+        cur = conn.execute(
+            "UPDATE tasks SET state = 'done', finished_at = ?, result = ?, error = NULL, lease_expires = NULL "
+            "WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time(), json.dumps(result) if result is not None else None, task_id, worker_id),
+        )
+        return cur.rowcount == 1
+
+
+def fail(task_id, worker_id, error):
+    """Give the task back for a retry after a backoff, or fail it for good after MAX_ATTEMPTS."""
+    now = time.time()
+    with storage.transaction() as conn:
+        row = conn.execute("SELECT attempts FROM tasks WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                           (task_id, worker_id)).fetchone()
+        if row is None:
+            return None
+        if row["attempts"] >= MAX_ATTEMPTS:
+            conn.execute("UPDATE tasks SET state = 'failed', finished_at = ?, error = ?, lease_expires = NULL "
+                         "WHERE id = ?", (now, str(error), task_id))
+            return "failed"
+        conn.execute(
+            "UPDATE tasks SET state = 'queued', available_at = ?, error = ?, lease_owner = NULL, lease_expires = NULL "
+            "WHERE id = ?",
+            (now + RETRY_BACKOFF_SECONDS * 2 ** (row["attempts"] - 1), str(error), task_id),
+        )
+        return "retry"
+
+
+def cancel(job_id):
+    """Drop queued (not yet leased) tasks for a removed or paused site."""
+    with storage.transaction() as conn:
+        return conn.execute("DELETE FROM tasks WHERE job_id = ? AND state = 'queued'", (job_id,)).rowcount
+
+
+def prune(hours=KEEP_FINISHED_HOURS):
+    with storage.transaction() as conn:
+        return conn.execute("DELETE FROM tasks WHERE state IN ('done', 'failed') AND finished_at < ?",
+                            (time.time() - hours * 3600,)).rowcount
+
+
+def stats():
+    now = time.time()
+    conn = storage.connect()
+    counts = {row["state"]: row["n"] for row in
+              conn.execute("SELECT state, COUNT(*) AS n FROM tasks GROUP BY state")}
+    oldest = conn.execute("SELECT MIN(available_at) AS t FROM tasks WHERE state = 'queued' AND available_at <= ?",
+                          (now,)).fetchone()["t"]
+    workers = conn.execute("SELECT COUNT(DISTINCT lease_owner) AS n FROM tasks WHERE state = 'leased' "
+                           "AND lease_expires >= ?", (now,)).fetchone()["n"]
+    return {
+        "queued": counts.get("queued", 0),
+        "leased": counts.get("leased", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_queued_seconds": round(now - oldest, 1) if oldest else 0.0,
+        "busy_workers": workers,
+    }
@@ -0,0 +1,54 @@
+from functools import partial
+
+import replay
+import site_state
+from scheduler import schedule_job
+from visual_capture import capture_job
+
+### The one way a site gets captured. add, edit, resume, the startup bootstrap and worker.py all
+### go through here, so every path passes the same options to capture_job. The scheduled job only
+### holds the job_id; the site record is read when the job runs (site_state.get, fresh), so an edit
+### takes effect on the next run without rescheduling (only a new interval or URL reschedules,
+### see needs_reschedule). capture_job does all the persisting, nothing else writes per capture.
+
+
+def capture_site(site, timestamp=None):
+    """Run capture_job with everything the site record configures. timestamp names the capture
+    (now if None); capturing again with the same one replaces that capture's rows."""
+    return capture_job(
+        site["url"],
+        site["site_name"],
+        site.get("viewport", [1366, 768]),
+        site.get("cookie_accept_selector"),
+        site.get("wait_time", 2),
+        site.get("regions"),
+        site.get("capture_mode", "viewport"),
+        site.get("capture_selector"),
+        site.get("comparator"),
+        site.get("align_shifts"),
+        site.get("blocking"),
+        site.get("asset_cache", True),
+        replay.enabled(site),
+        timestamp=timestamp,
+    )
+
+
+def run_site(job_id, timestamp=None):
+    """Capture job_id as it is configured right now. None if it's gone or paused."""
+    site = site_state.get(job_id, fresh=True)
+    if site is None:
+        print(f"[!] Skipping {job_id} — site no longer exists.")
+        return None
+    if site.get("paused"):
+        print(f"[⏸] Skipping {job_id} — site is paused.")
+        return None
+    return capture_site(site, timestamp)
+
+
+def schedule_site(job_id, site):
+    schedule_job(job_id, partial(run_site, job_id), site["interval_minutes"], url=site["url"])
+
+
+def needs_reschedule(old, new):
+    # the trigger holds the interval and the per-host slot holds the URL's host, the rest is read per run
+    return old.get("interval_minutes") != new.get("interval_minutes") or old.get("url") != new.get("url")
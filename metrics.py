@@ -0,0 +1,152 @@
+import threading
+import time
+from functools import wraps
+
+### In-process metrics, served in Prometheus text format from /metrics (app.py). Hand rolled so
+### there's no prometheus_client to install; histograms have fixed buckets and are cheap to
+### observe from any capture thread.
+###   vr_capture_stage_seconds{stage}     every stage in stages.STAGES, fed by stages.record()
+###   vr_capture_seconds{site}            whole capture_job runs, per site (alert on slow sites)
+###   vr_captures_total{site,result}      changed / unchanged / error
+###   vr_scheduler_lag_seconds            planned run time -> actual start (saturated workers)
+###   vr_capture_requests_total{site,outcome}  page requests loaded / blocked / failed (blocking.py)
+###   vr_capture_bytes_total{site,kind}   bytes loaded, and the estimate blocking saved
+### Gauges (pool, queue depth) are read from callbacks at scrape time, see register_gauge().
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CAPTURE_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800)
+PREFIX = "vr_"
+
+_lock = threading.Lock()
+_gauges = []    # (name, help, callback -> [(labels dict, value)])
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}    # sorted label pairs -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def forget(self, **labels):
+        """Drop every series carrying these labels (a removed site)."""
+        wanted = set(labels.items())
+        with _lock:
+            for key in [k for k in self._series if wanted <= set(k)]:
+                del self._series[key]
+
+    def render(self):
+        with _lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-2] + [values[-1]]):
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', _number(float(bound))),))} {count}")
+            lines.append(f"{self.name}_sum{_labels(key)} {_number(values[-2])}")
+            lines.append(f"{self.name}_count{_labels(key)} {values[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = PREFIX + name
+        self.help = help
+        self._series = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def forget(self, **labels):
+        wanted = set(labels.items())
+        with _lock:
+            for key in [k for k in self._series if wanted <= set(k)]:
+                del self._series[key]
+
+    def render(self):
+        with _lock:
+            series = dict(self._series)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(key)} {_number(value)}" for key, value in sorted(series.items())]
+        return lines
+
+
+STAGE_SECONDS = Histogram("capture_stage_seconds", "Time spent in each capture stage.", STAGE_BUCKETS)
+CAPTURE_SECONDS = Histogram("capture_seconds", "Wall time of a whole capture run, per site.", CAPTURE_BUCKETS)
+CAPTURES = Counter("captures_total", "Capture runs by site and result (changed, unchanged, error).")
+SCHEDULER_LAG = Histogram("scheduler_lag_seconds", "Delay between a capture's planned and actual start.", LAG_BUCKETS)
+REQUESTS = Counter("capture_requests_total", "Requests made by captured pages, by outcome (loaded, blocked, failed).")
+BYTES = Counter("capture_bytes_total", "Bytes captured pages loaded, and the estimated bytes blocking saved.")
+_METRICS = [STAGE_SECONDS, CAPTURE_SECONDS, CAPTURES, SCHEDULER_LAG, REQUESTS, BYTES]
+
+
+def register_gauge(name, help, callback):
+    """callback() -> [(labels dict, value)], called on every scrape. Errors just drop the gauge."""
+    _gauges.append((PREFIX + name, help, callback))
+
+
+def forget_site(site_name):
+    CAPTURE_SECONDS.forget(site=site_name)
+    CAPTURES.forget(site=site_name)
+    REQUESTS.forget(site=site_name)
+    BYTES.forget(site=site_name)
+
+
+def track_capture(func):
+    """Decorator for capture_job(url, site_name, ...): per-site duration and result counters."""
+    @wraps(func)
+    def wrapper(url, site_name, *args, **kwargs):
+        start = time.perf_counter()
+        result = "error"
+        try:
+            outcome = func(url, site_name, *args, **kwargs)
+            result = "changed" if outcome and outcome[0] else "unchanged"
+            return outcome
+        finally:
+            CAPTURE_SECONDS.observe(time.perf_counter() - start, site=site_name)
+            CAPTURES.inc(site=site_name, result=result)
+    return wrapper
+
+
+def render():
+    lines = []
+    for metric in _METRICS:
+        lines += metric.render()
+    for name, help, callback in _gauges:
+        try:
+            samples = callback()
+        except Exception as e:
+            print(f"[!] Metrics gauge {name} failed: {e}")
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
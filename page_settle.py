@@ -0,0 +1,81 @@
+import time
+
+import stages
+
+### Readiness-based settle step, replaces the fixed time.sleep() waits in capture_job.
+### The page counts as settled once all of these hold at the same time:
+###   - document.readyState is 'complete'
+###   - no new network resources have finished for NETWORK_QUIET_MS
+###   - document.fonts reports 'loaded'
+###   - the layout signature hasn't moved over STABLE_FRAMES animation frames
+### wait_time from the site config is the upper bound, not a fixed delay any more.
+NETWORK_QUIET_MS = 500
+STABLE_FRAMES = 2
+
+_SETTLE_JS = """
+const maxMs = arguments[0], quietMs = arguments[1], stableFrames = arguments[2];
+const done = arguments[arguments.length - 1];
+const start = performance.now();
+let lastCount = -1, lastNetChange = start, lastSig = null, sameFrames = 0;
+// default buffer caps at 250 entries, after which the count would look idle forever
+if (performance.setResourceTimingBufferSize) performance.setResourceTimingBufferSize(5000);
+
+function resourceCount() {
+  return performance.getEntriesByType('resource').length;
+}
+function layoutSig() {
+  const d = document.documentElement, b = document.body;
+  if (!b) return null;
+  return [d.scrollWidth, d.scrollHeight, b.childElementCount, document.images.length].join(',');
+}
+// rAF stalls in background tabs, the timeout keeps us ticking regardless
+function next() {
+  let fired = false;
+  const go = () => { if (!fired) { fired = true; tick(); } };
+  requestAnimationFrame(go);
+  setTimeout(go, 50);
+}
+function tick() {
+  const now = performance.now();
+  const count = resourceCount();
+  if (count !== lastCount) { lastCount = count; lastNetChange = now; }
+
+  const sig = layoutSig();
+  if (sig !== null && sig === lastSig) { sameFrames++; } else { sameFrames = 0; lastSig = sig; }
+
+  const ready = document.readyState === 'complete';
+  const netIdle = (now - lastNetChange) >= quietMs;
+  const fontsOk = !document.fonts || document.fonts.status === 'loaded';
+  const stable = sameFrames >= stableFrames;
+
+  if ((ready && netIdle && fontsOk && stable) || (now - start) >= maxMs) {
+    done({settled: ready && netIdle && fontsOk && stable, ready: ready, net_idle: netIdle,
+          fonts: fontsOk, stable: stable, ms: Math.round(now - start)});
+    return;
+  }
+  next();
+}
+next();
+"""
+
+
+def wait_for_settle(driver, max_wait, quiet_ms=NETWORK_QUIET_MS, stable_frames=STABLE_FRAMES):
+    """Block until the page looks settled or max_wait seconds pass. Returns seconds spent."""
+    start = time.monotonic()
+    max_ms = max(0, int(float(max_wait) * 1000))
+    if max_ms == 0:
+        return 0.0
+    try:
+        driver.set_script_timeout(max_wait + 5)
+        result = driver.execute_async_script(_SETTLE_JS, max_ms, quiet_ms, stable_frames)
+        if result and not result.get("settled"):
+            print(f"[!] Page not fully settled after {max_wait}s: {result}")
+    except Exception as e:
+        # fall back to the old behaviour rather than capturing mid-load
+        print(f"[!] Settle script failed ({e}), sleeping the full {max_wait}s")
+        remaining = max_wait - (time.monotonic() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+    elapsed = time.monotonic() - start
+    stages.record("settle", elapsed)
+    return elapsed
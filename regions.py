@@ -0,0 +1,86 @@
+### Per-site diff regions, stored on the site record as:
+###   "regions": {
+###     "ignore": [[x, y, w, h], "#carousel", ".footer time"],
+###     "watch":  [{"name": "header", "selector": "header", "threshold": 5},
+###                {"name": "cta", "rect": [100, 40, 200, 60], "threshold": 10}]
+###   }
+### Rectangles are viewport pixels. Selectors are resolved to bounding boxes at capture time,
+### after the page settled and was scrolled to the top, so they match the screenshot.
+DEFAULT_WATCH_THRESHOLD = 10
+
+_RECTS_JS = """
+const selectors = arguments[0];
+const dpr = window.devicePixelRatio || 1;
+return selectors.map(sel => {
+  let els;
+  try { els = Array.from(document.querySelectorAll(sel)); } catch (e) { return []; }
+  return els.map(el => el.getBoundingClientRect())
+            .filter(r => r.width > 0 && r.height > 0)
+            .map(r => [Math.round(r.left * dpr), Math.round(r.top * dpr),
+                       Math.round(r.width * dpr), Math.round(r.height * dpr)]);
+});
+"""
+
+
+def normalize(regions):
+    """Validate a regions dict from the UI/site record. Raises ValueError on bad input."""
+    if not regions:
+        return {"ignore": [], "watch": []}
+    if not isinstance(regions, dict):
+        raise ValueError("regions must be an object with 'ignore' and/or 'watch'")
+
+    def check_rect(rect):
+        if not (isinstance(rect, (list, tuple)) and len(rect) == 4 and all(isinstance(v, (int, float)) for v in rect)):
+            raise ValueError(f"bad rect {rect!r}, expected [x, y, w, h]")
+        return [int(v) for v in rect]
+
+    ignore = []
+    for item in regions.get("ignore", []) or []:
+        if isinstance(item, str):
+            ignore.append(item)
+        else:
+            ignore.append(check_rect(item))
+
+    watch = []
+    for i, item in enumerate(regions.get("watch", []) or []):
+        if not isinstance(item, dict) or not (item.get("selector") or item.get("rect")):
+            raise ValueError(f"watch region {i} needs a 'selector' or 'rect'")
+        entry = {
+            "name": str(item.get("name") or item.get("selector") or f"region_{i}"),
+            "threshold": float(item.get("threshold", DEFAULT_WATCH_THRESHOLD)),
+        }
+        if item.get("rect"):
+            entry["rect"] = check_rect(item["rect"])
+        else:
+            entry["selector"] = str(item["selector"])
+        watch.append(entry)
+    return {"ignore": ignore, "watch": watch}
+
+
+def resolve(driver, regions):
+    """Turn selectors into pixel rects. Returns {'ignore': [rect...], 'watch': [{name, rect(s), threshold}]}."""
+    regions = normalize(regions)
+    selectors = [i for i in regions["ignore"] if isinstance(i, str)]
+    selectors += [w["selector"] for w in regions["watch"] if "selector" in w]
+    found = {}
+    if selectors:
+        try:
+            boxes = driver.execute_script(_RECTS_JS, selectors)
+            found = dict(zip(selectors, boxes))
+        except Exception as e:
+            print(f"[!] Failed to resolve region selectors: {e}")
+
+    ignore = []
+    for item in regions["ignore"]:
+        if isinstance(item, str):
+            ignore.extend(found.get(item, []))
+        else:
+            ignore.append(item)
+
+    watch = []
+    for w in regions["watch"]:
+        rects = [w["rect"]] if "rect" in w else found.get(w["selector"], [])
+        if not rects:
+            print(f"[!] Watch region '{w['name']}' not found on page")
+        watch.append({"name": w["name"], "rects": rects, "threshold": w["threshold"]})
+    return {"ignore": ignore, "watch": watch}
@@ -0,0 +1,158 @@
+import argparse
+import glob
+import gzip
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import blobstore
+import browser_pool
+import diffs
+import storage
+import viewports
+from compare import compare_frames
+from page_settle import wait_for_settle
+
+### Page snapshots and offline replay, for working out why a diff happened after the fact.
+### Sites with "snapshots": true (or every site with SNAPSHOTS = True) keep an MHTML archive of the
+### page next to each capture: the DOM as it was screenshotted (fonts forced, cookie banner
+### dismissed), with the CSS, images and fonts it used inlined. Chrome renders it again without
+### touching the network:
+###     python replay.py <site> [timestamp] [--viewport 1366x768] [--out replay.png]
+###     python replay.py <site> --list
+### The replayed frame is compared against the capture stored for that timestamp; if they differ
+### the page changed in a way the snapshot doesn't hold (scripts, personalisation, timing), if
+### they match the diff is reproducible offline and can be poked at with devtools on the .mhtml.
+SNAPSHOTS = False
+SNAPSHOT_DIR = "snapshots"
+KEEP_SNAPSHOTS_FOR_DAYS = 7
+REPLAY_SETTLE_SECONDS = 2
+
+
+def enabled(site):
+    return bool((site or {}).get("snapshots", SNAPSHOTS))
+
+
+def snapshot_path(site_name, timestamp):
+    return os.path.join(SNAPSHOT_DIR, site_name, f"{timestamp}.mhtml.gz")
+
+
+def save(driver, site_name, timestamp):
+    """Archive the loaded page. Returns the path, None if Chrome couldn't produce one."""
+    try:
+        data = driver.execute_cdp_cmd("Page.captureSnapshot", {"format": "mhtml"})["data"]
+    except Exception as e:
+        print(f"[!] Could not snapshot {site_name}: {e}")
+        return None
+    path = snapshot_path(site_name, timestamp)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(data)
+    return path
+
+
+def list_snapshots(site_name):
+    """Timestamps with a snapshot, oldest first."""
+    paths = glob.glob(os.path.join(SNAPSHOT_DIR, site_name, "*.mhtml.gz"))
+    return sorted(os.path.basename(p)[:-len(".mhtml.gz")] for p in paths)
+
+
+def prune(days=KEEP_SNAPSHOTS_FOR_DAYS):
+    """Delete snapshots older than days. Returns how many went."""
+    cutoff = time.time() - days * 86400
+    removed = 0
+    for path in glob.glob(os.path.join(SNAPSHOT_DIR, "*", "*.mhtml.gz")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def render(site_name, timestamp, viewport):
+    """Render a stored snapshot offline. Returns the BGR frame."""
+    path = snapshot_path(site_name, timestamp)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        data = f.read()
+    with tempfile.NamedTemporaryFile("w", suffix=".mhtml", delete=False, encoding="utf-8") as tmp:
+        tmp.write(data)
+    try:
+        with browser_pool.pool.checkout(viewport) as driver:
+            # nothing the archive doesn't hold may be fetched, or it isn't a replay
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.emulateNetworkConditions", {
+                "offline": True, "latency": 0, "downloadThroughput": -1, "uploadThroughput": -1})
+            try:
+                driver.get("file://" + os.path.abspath(tmp.name))
+                wait_for_settle(driver, REPLAY_SETTLE_SECONDS)
+                driver.execute_script("window.scrollTo(0, 0);")
+                png = driver.get_screenshot_as_png()
+            finally:
+                driver.execute_cdp_cmd("Network.emulateNetworkConditions", {
+                    "offline": False, "latency": 0, "downloadThroughput": -1, "uploadThroughput": -1})
+    finally:
+        os.remove(tmp.name)
+    frame = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+    return frame[:viewport[1], :viewport[0]]
+
+
+def replay(site_name, timestamp=None, viewport=None, out=None):
+    available = list_snapshots(site_name)
+    if not available:
+        print(f"[!] No snapshots for {site_name} (turn them on with \"snapshots\": true on the site)")
+        return None
+    timestamp = timestamp or available[-1]
+    if timestamp not in available:
+        print(f"[!] No snapshot for {site_name} at {timestamp}, have: {', '.join(available[-10:])}")
+        return None
+    if viewport is None:
+        site = storage.get_site(f"site_{site_name}")
+        viewport = viewports.for_site(site)[0] if site else (1366, 768)
+
+    frame = render(site_name, timestamp, viewport)
+    out = out or f"replay_{site_name}_{timestamp}_{viewports.label(viewport)}.png"
+    cv2.imwrite(out, frame)
+    print(f"[✓] Replayed {site_name} at {timestamp} @ {viewports.label(viewport)} -> {out}")
+
+    capture = storage.get_capture(site_name, timestamp, viewports.label(viewport))
+    stored = None
+    if capture:
+        stored_path = blobstore.blob_path(capture["blob"]) if capture.get("blob") else capture["path"]
+        stored = cv2.imread(stored_path, cv2.IMREAD_COLOR)
+    if stored is None:
+        print("[!] The capture for this snapshot is gone, nothing to compare against")
+        return {"path": out, "compared": False}
+    result = compare_frames(stored, frame)
+    print(f"[DEBUG] replay vs stored capture: MSE {result['mse']} ({result['tier']} tier)")
+    if result["significant"]:
+        diff_out = out.replace(".png", "_diff.png")
+        cv2.imwrite(diff_out, diffs.render(stored, frame, shift=(result["shift"]["row"], result["shift"]["by"])
+                                           if result.get("shift") else None))
+        print(f"[VISUAL CHANGE] Replay differs from what was captured, highlight in {diff_out}")
+    else:
+        print("[✓] Replay matches the capture, the diff is reproducible from the snapshot")
+    return {"path": out, "compared": True, "mse": result["mse"], "significant": result["significant"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a stored page snapshot offline")
+    parser.add_argument("site_name")
+    parser.add_argument("timestamp", nargs="?", help="YYYYmmdd_HHMMSS, newest snapshot if left out")
+    parser.add_argument("--viewport", help="WxH, the site's first breakpoint by default")
+    parser.add_argument("--out", help="where to write the replayed frame")
+    parser.add_argument("--list", action="store_true", help="list the snapshots kept for the site")
+    args = parser.parse_args()
+    if args.list:
+        for ts in list_snapshots(args.site_name):
+            print(ts)
+    else:
+        vp = tuple(int(v) for v in args.viewport.lower().split("x")) if args.viewport else None
+        try:
+            replay(args.site_name, args.timestamp, vp, args.out)
+        finally:
+            browser_pool.pool.close()
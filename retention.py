@@ -0,0 +1,128 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import blobstore
+import storage
+import thumbnails
+
+### One retention engine for everything: the hourly sweep (cleanup.py) and the per-capture trim
+### in capture_job both end up here. It works off the timestamp indexes in the database, deletes
+### oldest-first in batches, and keeps rows and files in step so nothing points at a deleted image.
+###
+### Defaults below; any site can override them with a "retention" object on its record, e.g.
+###   "retention": {"keep_last": 20, "keep_hours": 48, "keep_changes_days": 30, "always_keep_changes": true}
+### With content-addressed frames a stable site costs one PNG however many captures point at it,
+### so these windows are far cheaper than the ~400MB/site the old per-file copies needed.
+KEEP_LAST = 6                   # newest captures always kept (the dashboard filmstrip)
+KEEP_SCREENSHOTS_FOR_HOURS = 4
+KEEP_CHANGES_FOR_DAYS = 7       # change records, and the significant captures behind them
+ALWAYS_KEEP_CHANGES = False
+BATCH_SIZE = 500
+
+TS_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def policy_for(site):
+    custom = (site or {}).get("retention") or {}
+    return {
+        "keep_last": int(custom.get("keep_last", KEEP_LAST)),
+        "keep_hours": float(custom.get("keep_hours", KEEP_SCREENSHOTS_FOR_HOURS)),
+        "keep_changes_days": float(custom.get("keep_changes_days", KEEP_CHANGES_FOR_DAYS)),
+        "always_keep_changes": bool(custom.get("always_keep_changes", ALWAYS_KEEP_CHANGES)),
+    }
+
+
+def _cutoffs(policy, now):
+    capture_cutoff = (now - timedelta(hours=policy["keep_hours"])).strftime(TS_FORMAT)
+    if policy["always_keep_changes"]:
+        change_cutoff = ""   # nothing sorts before "", so nothing expires
+    else:
+        change_cutoff = (now - timedelta(days=policy["keep_changes_days"])).strftime(TS_FORMAT)
+    return capture_cutoff, change_cutoff
+
+
+def _remove_file(path):
+    """Remove a pre-blob file (and its thumbnails). Returns bytes freed."""
+    if not path:
+        return 0
+    path = path.replace("/static/screenshots/", "screenshots/", 1)
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    thumbnails.remove_thumbnails(path)
+    return size
+
+
+def _new_report():
+    return {"sites": 0, "captures_deleted": 0, "changes_deleted": 0, "files_deleted": 0, "bytes_reclaimed": 0}
+
+
+def apply_site(site_name, site=None, now=None, report=None, collect=True):
+    """Apply site_name's policy. Only touches rows past their cutoff, via the (site, timestamp) index."""
+    now = now or datetime.now()
+    report = report if report is not None else _new_report()
+    policy = policy_for(site)
+    capture_cutoff, change_cutoff = _cutoffs(policy, now)
+    report["sites"] += 1
+
+    while True:
+        batch = storage.expired_captures(site_name, capture_cutoff, change_cutoff,
+                                         keep_last=policy["keep_last"], limit=BATCH_SIZE)
+        if not batch:
+            break
+        for item in batch:
+            if not item.get("blob"):
+                freed = _remove_file(item.get("path"))
+                if freed:
+                    report["files_deleted"] += 1
+                    report["bytes_reclaimed"] += freed
+        # blob-backed captures are released through the refcount, collected below
+        storage.delete_captures(item["id"] for item in batch)
+        report["captures_deleted"] += len(batch)
+        if len(batch) < BATCH_SIZE:
+            break
+
+    if change_cutoff:
+        while True:
+            batch = storage.expired_changes(site_name, change_cutoff, limit=BATCH_SIZE)
+            if not batch:
+                break
+            for change in batch:
+                # a diff rendered on demand (diffs.py) has no blob either, its cached image goes with the change
+                for key in ("prev", "curr", "diff"):
+                    if not change.get(f"{key}_blob"):
+                        freed = _remove_file(change.get(key))
+                        if freed:
+                            report["files_deleted"] += 1
+                            report["bytes_reclaimed"] += freed
+            storage.delete_changes(change["id"] for change in batch)
+            report["changes_deleted"] += len(batch)
+            if len(batch) < BATCH_SIZE:
+                break
+
+    if collect:
+        report["bytes_reclaimed"] += blobstore.collect_garbage()
+    return report
+
+
+def run(now=None):
+    """Sweep every site that has anything old enough to possibly expire."""
+    started = time.monotonic()
+    now = now or datetime.now()
+    sites = {s.get("site_name"): s for s in storage.load_sites().values()}
+
+    # the shortest window any policy uses bounds which sites can have expired rows at all
+    policies = [policy_for(s) for s in sites.values()] + [policy_for(None)]
+    earliest_cutoff = max(c for p in policies for c in _cutoffs(p, now))
+
+    report = _new_report()
+    for site_name in storage.sites_with_captures_before(earliest_cutoff):
+        apply_site(site_name, sites.get(site_name), now=now, report=report, collect=False)
+    report["bytes_reclaimed"] += blobstore.collect_garbage()
+    report["seconds"] = round(time.monotonic() - started, 3)
+    print(f"[🗑] Retention: {report['captures_deleted']} captures, {report['changes_deleted']} changes, "
+          f"{report['bytes_reclaimed'] / 1e6:.1f} MB reclaimed across {report['sites']} sites")
+    return report
@@ -1,10 +1,216 @@
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor as CapturePool
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+
+import browser_pool
+import jobqueue
+import metrics
+
+### Capture concurrency knobs. Captures run on their own pool so the hourly cleanup
+### (default executor) never waits behind a pile of browsers.
+### A due run is only handed to that pool once its host has a free slot (MAX_PER_DOMAIN); until
+### then it waits in a per-host line and holds no thread, so a burst of sites on one host can't
+### fill the pool while every other host's captures starve behind them.
+MAX_CONCURRENT_CAPTURES = browser_pool.POOL_MAX_SESSIONS   # no point running more than we have browsers for
+MAX_PER_DOMAIN = 1             # captures allowed against the same host at once
+JITTER_SECONDS = 30            # random slop added to every run
+MISFIRE_GRACE_SECONDS = 300    # late runs inside this window still run (once, see coalesce)
+### "local": captures run on the executor below, in this process.
+### "queue": the timer only enqueues (jobqueue.py) and separate `python worker.py` processes capture.
+DISPATCH = os.environ.get("VR_DISPATCH", "local")
+
+scheduler = BackgroundScheduler(
+    executors={
+        "default": ThreadPoolExecutor(2),
+        "dispatch": ThreadPoolExecutor(1),     # timer side only, hands runs to _captures without blocking
+    },
+    job_defaults={
+        # a site that fell behind runs once, not once per missed interval
+        "coalesce": True,
+        "max_instances": 1,
+        "misfire_grace_time": MISFIRE_GRACE_SECONDS,
+    },
+)
+
+_captures = CapturePool(MAX_CONCURRENT_CAPTURES, thread_name_prefix="capture")
+_lock = threading.Lock()
+_host_running = {}       # host -> captures running against it
+_host_waiting = {}       # host -> deque of runs waiting for one of those to finish
+_pending = {}            # job_id -> when the run was due (dispatched, not started yet)
+_running = set()
+_active = {}             # site job_id -> "queued" | "running", a run dispatched and not finished yet
+_followers = {}          # site job_id -> [(on_start, on_done)] told about that run (batch.py)
+_stats = {
+    "runs": 0,
+    "missed": 0,
+    "skipped_still_running": 0,
+    "lag_total": 0.0,
+    "lag_max": 0.0,
+    "lag_last": {},      # job_id -> seconds between planned and actual start
+}
+
+
+def _domain_of(url):
+    if not url:
+        return None
+    return urlparse(url).hostname
+
+
+
+
+def _start_offset(job_id, interval_minutes):
+    # stable per-site offset inside the interval so sites sharing an interval don't fire together
+    span = max(1, int(interval_minutes * 60))
+    return timedelta(seconds=zlib.crc32(job_id.encode()) % span)
+
+
+def _start(job_id, func, host):
+    # caller holds _lock and has checked the host has room
+    if host:
+        _host_running[host] = _host_running.get(host, 0) + 1
+    _captures.submit(_run, job_id, func, host)
+
 
-scheduler = BackgroundScheduler()
+def _site_of(job_id):
+    # "site_x:now" (run_now) and "site_x" (the interval) are the same site, one capture at a time
+    return job_id.split(":", 1)[0]
 
-def schedule_job(job_id, func, interval_minutes):
-    scheduler.add_job(func, trigger=IntervalTrigger(minutes=interval_minutes), id=job_id, replace_existing=True)
+
+def _run(job_id, func, host):
+    site = _site_of(job_id)
+    with _lock:
+        planned = _pending.pop(job_id, None)
+        _running.add(job_id)
+        _active[site] = "running"
+        followers = list(_followers.get(site, ()))
+        lag = max(0.0, time.time() - planned) if planned else 0.0
+        _stats["runs"] += 1
+        _stats["lag_total"] += lag
+        _stats["lag_max"] = max(_stats["lag_max"], lag)
+        _stats["lag_last"][job_id] = round(lag, 3)
+    metrics.SCHEDULER_LAG.observe(lag)
+    if lag > 60:
+        print(f"[!] {job_id} started {lag:.0f}s late{f' (waited for a free slot on {host})' if host else ''}")
+    for on_start, _ in followers:
+        on_start()
+    started, outcome, error = time.time(), None, None
+    try:
+        outcome = func()
+        return outcome
+    except Exception as e:
+        error = e
+        print(f"[!] {job_id} failed: {e}")
+    finally:
+        with _lock:
+            _running.discard(job_id)
+            _active.pop(site, None)
+            followers = _followers.pop(site, [])
+            if host:
+                _host_running[host] -= 1
+                waiting = _host_waiting.get(host)
+                if waiting:
+                    _start(*waiting.popleft())
+                if not waiting:
+                    _host_waiting.pop(host, None)
+        for _, on_done in followers:
+            on_done(outcome, error, time.time() - started)
+
+
+def _dispatch(job_id, func, url, follower=None):
+    """Start func on the capture pool now if its host has a free slot, otherwise line it up behind
+    that host's running capture. While the site has a run waiting or running (interval or
+    run_now) no second one is started. follower is an (on_start(), on_done(outcome, error,
+    seconds)) pair told about whichever run the site gets. Returns (state, deduped).
+    The run counts as due now: lag is the time it then spends waiting for a host slot or a pool
+    thread. A timer that fires late past MISFIRE_GRACE_SECONDS is counted in "missed" instead."""
+    host = _domain_of(url)
+    site = _site_of(job_id)
+    with _lock:
+        if follower:
+            _followers.setdefault(site, []).append(follower)
+        if site in _active:
+            if follower is None:
+                _stats["skipped_still_running"] += 1
+            return _active[site], True
+        _active[site] = "queued"
+        _pending[job_id] = time.time()
+        if host and _host_running.get(host, 0) >= MAX_PER_DOMAIN:
+            _host_waiting.setdefault(host, deque()).append((job_id, func, host))
+        else:
+            _start(job_id, func, host)
+        return "queued", False
+
+
+def _on_event(event):
+    with _lock:
+        if event.code == EVENT_JOB_MISSED:
+            _stats["missed"] += 1
+        elif event.code == EVENT_JOB_MAX_INSTANCES:
+            _stats["skipped_still_running"] += 1
+
+
+scheduler.add_listener(_on_event, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+
+
+def _enqueue(job_id, url):
+    # queue mode: the run is only handed over, lag is measured by the worker that picks it up
+    if jobqueue.enqueue(job_id, url) is None:
+        with _lock:
+            _stats["skipped_still_running"] += 1
+
+
+def schedule_job(job_id, func, interval_minutes, url=None):
+    trigger = IntervalTrigger(
+        minutes=interval_minutes,
+        start_date=datetime.now() + _start_offset(job_id, interval_minutes),
+        jitter=JITTER_SECONDS,
+    )
+    if DISPATCH == "queue":
+        scheduler.add_job(_enqueue, args=(job_id, url), trigger=trigger, id=job_id,
+                          replace_existing=True)
+        return
+    scheduler.add_job(_dispatch, args=(job_id, func, url), trigger=trigger, id=job_id,
+                      executor="dispatch", replace_existing=True)
+
+def run_now(job_id, func, url=None, follower=None):
+    """Run func once on the capture pool as soon as there's room, outside the site's interval
+    (batch.py). Same pool and per-host slots as scheduled runs, so it can't overload anything.
+    If the site already has a run waiting or running, that one is followed instead (see _dispatch)."""
+    return _dispatch(f"{job_id}:now", func, url, follower)
 
 def remove_job(job_id):
-    scheduler.remove_job(job_id)
+    try:
+        scheduler.remove_job(job_id)
+    except JobLookupError:
+        pass  # paused sites aren't scheduled
+    if DISPATCH == "queue":
+        jobqueue.cancel(job_id)
+
+def scheduler_stats():
+    with _lock:
+        runs = _stats["runs"]
+        return {
+            "dispatch": DISPATCH,
+            "max_concurrent": MAX_CONCURRENT_CAPTURES,
+            "max_per_domain": MAX_PER_DOMAIN,
+            "queue_depth": len(_pending),
+            "waiting_for_host": sum(len(w) for w in _host_waiting.values()),
+            "running": len(_running),
+            "runs": runs,
+            "missed": _stats["missed"],
+            "skipped_still_running": _stats["skipped_still_running"],
+            "avg_lag_seconds": round(_stats["lag_total"] / runs, 3) if runs else 0.0,
+            "max_lag_seconds": round(_stats["lag_max"], 3),
+            "lag_by_job": dict(_stats["lag_last"]),
+        }
@@ -0,0 +1,240 @@
+import atexit
+import copy
+import queue
+import threading
+import time
+
+import storage
+
+### Site records in memory, with one writer thread persisting them. Replaces the monitored_sites
+### dict app.py used to mutate in place from request threads (and capture threads, via the db).
+###   reads   - snapshot() is the current {job_id: site} dict. It is never changed after it's
+###             published, every write builds a new one (read-copy-update), so a request can loop
+###             over it without a lock and without seeing half an edit. Don't mutate it; get()
+###             hands out a deep copy to edit and put() back.
+###   writes  - put() / update() / delete() publish the new snapshot right away and queue the
+###             change. The writer thread waits FLUSH_DEBOUNCE_SECONDS for more, merges
+###             everything queued per site (ten updates to one site are one write) and commits the
+###             lot in a single transaction, so a flush is all or nothing.
+###   other processes (worker.py) write the database directly; the snapshot is re-read from it
+###             every RELOAD_SECONDS, busy or not. Fields updated here and not written yet are
+###             laid over what it reads (a site put or deleted here keeps the local version).
+### update() merges fields into whatever the database has at write time, so a capture setting
+### change_detected can't undo an edit made from the UI in between.
+FLUSH_DEBOUNCE_SECONDS = 0.25
+RELOAD_SECONDS = 15
+WRITE_RETRIES = 3
+
+
+class SiteState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._dirty = {}           # job_id -> queued ops not written yet
+        self._unwritten = {}       # job_id -> fields updated and not written yet, None after a put/delete
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stats = {"queued": 0, "flushes": 0, "writes": 0, "failed": 0, "reloads": 0, "last_flush_ms": 0.0}
+
+    # ---- reads ----
+    def _ensure_loaded(self):
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = storage.load_sites()
+            self._ensure_thread()
+
+    def snapshot(self):
+        self._ensure_loaded()
+        return self._snapshot
+
+    def get(self, job_id, fresh=False):
+        """Deep copy of one site, None if unknown. fresh=True reads the database unless this
+        process has a newer version still waiting to be written (for jobs run by other processes)."""
+        self._ensure_loaded()
+        if fresh and job_id not in self._dirty:
+            return storage.get_site(job_id)
+        site = self._snapshot.get(job_id)
+        return copy.deepcopy(site) if site is not None else None
+
+    def find(self, site_name):
+        """(job_id, site) for a site name, site not copied, or (None, None)."""
+        for job_id, site in self.snapshot().items():
+            if site.get("site_name") == site_name:
+                return job_id, site
+        return None, None
+
+    # ---- writes ----
+    def _publish(self, job_id, op, value):
+        with self._lock:
+            sites = dict(self._snapshot)
+            if op == "delete":
+                sites.pop(job_id, None)
+            elif op == "put":
+                sites[job_id] = value
+            elif job_id in sites:
+                sites[job_id] = {**sites[job_id], **copy.deepcopy(value)}
+            self._snapshot = sites
+            self._dirty[job_id] = self._dirty.get(job_id, 0) + 1
+            if op != "update":
+                self._unwritten[job_id] = None
+            elif self._unwritten.get(job_id, {}) is not None:
+                self._unwritten[job_id] = {**self._unwritten.get(job_id, {}), **copy.deepcopy(value)}
+            self._stats["queued"] += 1
+        self._queue.put((job_id, op, value))
+
+    def put(self, job_id, site):
+        self._ensure_loaded()
+        self._publish(job_id, "put", copy.deepcopy(site))
+
+    def update(self, job_id, **fields):
+        self._ensure_loaded()
+        self._publish(job_id, "update", fields)
+
+    def delete(self, job_id):
+        self._ensure_loaded()
+        self._publish(job_id, "delete", None)
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far is in the database."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    # ---- writer thread ----
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="site-state-writer", daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _merge(ops, job_id, op, value):
+        previous = ops.get(job_id)
+        if op in ("put", "delete") or previous is None:
+            ops[job_id] = (op, value)
+        elif previous[0] == "put":
+            ops[job_id] = ("put", {**previous[1], **value})
+        elif previous[0] == "update":
+            ops[job_id] = ("update", {**previous[1], **value})
+        # update after delete: the site is gone, nothing to update
+
+    def _write(self, ops):
+        with storage.transaction():
+            for job_id, (op, value) in ops.items():
+                if op == "put":
+                    storage.save_site(job_id, value)
+                elif op == "delete":
+                    storage.delete_site(job_id)
+                else:
+                    storage.update_site_fields(job_id, **value)
+
+    def _reload(self):
+        sites = storage.load_sites()
+        with self._lock:
+            for job_id in self._dirty:
+                # not written yet, the database doesn't have these changes
+                fields = self._unwritten.get(job_id)
+                if fields is not None:
+                    if job_id in sites:
+                        sites[job_id] = {**sites[job_id], **fields}
+                elif job_id in self._snapshot:
+                    sites[job_id] = self._snapshot[job_id]
+                else:
+                    sites.pop(job_id, None)
+            self._snapshot = sites
+            self._stats["reloads"] += 1
+
+    def _run(self):
+        next_reload = time.monotonic() + RELOAD_SECONDS
+        while True:
+            if time.monotonic() >= next_reload:
+                # on a timer, not only when idle: steady UI/capture traffic would otherwise keep
+                # worker.py's writes out of the snapshot for good
+                try:
+                    self._reload()
+                except Exception as e:
+                    print(f"[!] Failed to reload sites: {e}")
+                next_reload = time.monotonic() + RELOAD_SECONDS
+            try:
+                item = self._queue.get(timeout=max(0.0, next_reload - time.monotonic()))
+            except queue.Empty:
+                continue
+            batch, waiters = [], []
+            deadline = time.monotonic() + FLUSH_DEBOUNCE_SECONDS
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if waiters:
+                    break  # somebody is waiting, write now
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            # anything that showed up meanwhile goes into this flush too
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+            self._flush(batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        ops = {}
+        for job_id, op, value in batch:
+            self._merge(ops, job_id, op, value)
+        start = time.perf_counter()
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                self._write(ops)
+                break
+            except Exception as e:
+                print(f"[!] Failed to write {len(ops)} site(s) (attempt {attempt}/{WRITE_RETRIES}): {e}")
+                if attempt == WRITE_RETRIES:
+                    self._stats["failed"] += len(ops)
+                else:
+                    time.sleep(attempt)
+        with self._lock:
+            for job_id, _, _ in batch:
+                left = self._dirty.get(job_id, 0) - 1
+                if left > 0:
+                    self._dirty[job_id] = left
+                else:
+                    self._dirty.pop(job_id, None)
+                    self._unwritten.pop(job_id, None)
+            self._stats["flushes"] += 1
+            self._stats["writes"] += len(ops)
+            self._stats["last_flush_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "sites": len(self._snapshot or {}), "pending": sum(self._dirty.values())}
+
+
+state = SiteState()
+snapshot = state.snapshot
+get = state.get
+find = state.find
+put = state.put
+update = state.update
+delete = state.delete
+flush = state.flush
+stats = state.stats
+
+# whatever is still queued when the process exits gets written
+atexit.register(flush)
@@ -0,0 +1,45 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+### Wall-clock time per pipeline stage of a capture. capture_job and friends wrap their steps in
+### `with stages.stage("diff"):`, which costs two perf_counter() calls and a histogram bump.
+### Whoever wants the numbers (benchmarks/pipeline_bench.py) opens a collector on the same thread:
+###     with stages.collect() as timings:
+###         capture_job(...)
+###     timings -> {"navigate": [0.41], "diff": [0.012, 0.009], ...}
+### A stage that runs more than once per capture (one screenshot per breakpoint) gets one entry each.
+### Every timing also goes into the vr_capture_stage_seconds histogram (metrics.py), collector or not.
+STAGES = ("checkout", "driver_start", "navigate", "settle", "cookies", "snapshot", "screenshot", "crop",
+          "decode", "baseline", "diff", "store", "metadata_write", "cleanup")
+
+_local = threading.local()
+
+
+@contextmanager
+def collect():
+    """Collect stage timings for everything run on this thread inside the block."""
+    previous = getattr(_local, "timings", None)
+    timings = _local.timings = {}
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def record(name, seconds):
+    metrics.STAGE_SECONDS.observe(seconds, stage=name)
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.setdefault(name, []).append(seconds)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
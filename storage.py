@@ -0,0 +1,684 @@
+import json
+import os
+import sqlite3
+import threading
+
+import stages
+
+### SQLite store for sites, captures and changes. Replaces sites.json, metadata.json and
+### change_log.json, which were rewritten in full on every capture and raced between
+### scheduler threads. WAL mode lets the Flask request threads read while a capture writes.
+DB_FILE = "visual_regression.db"
+SITES_JSON = "sites.json"
+SCREENSHOT_BASE = "screenshots"
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    job_id      TEXT PRIMARY KEY,
+    site_name   TEXT NOT NULL,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sites_name ON sites(site_name);
+
+CREATE TABLE IF NOT EXISTS captures (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    site_name       TEXT NOT NULL,
+    timestamp       TEXT NOT NULL,
+    path            TEXT NOT NULL,
+    is_significant  INTEGER NOT NULL DEFAULT 0,
+    data            TEXT NOT NULL DEFAULT '{}',
+    blob            TEXT,
+    viewport        TEXT NOT NULL DEFAULT ''
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_captures_site_vp_ts ON captures(site_name, viewport, timestamp);
+CREATE INDEX IF NOT EXISTS idx_captures_site_time ON captures(site_name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_captures_ts ON captures(timestamp);
+
+CREATE TABLE IF NOT EXISTS changes (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    site_name   TEXT NOT NULL,
+    timestamp   TEXT NOT NULL,
+    prev        TEXT,
+    curr        TEXT,
+    diff        TEXT,
+    dismissed   INTEGER NOT NULL DEFAULT 0,
+    data        TEXT NOT NULL DEFAULT '{}',
+    prev_blob   TEXT,
+    curr_blob   TEXT,
+    diff_blob   TEXT,
+    viewport    TEXT NOT NULL DEFAULT '',
+    score       REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_changes_site_vp_ts ON changes(site_name, viewport, timestamp);
+CREATE INDEX IF NOT EXISTS idx_changes_site_time ON changes(site_name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_changes_site_dismissed_time ON changes(site_name, dismissed, timestamp);
+CREATE INDEX IF NOT EXISTS idx_changes_ts ON changes(timestamp);
+
+CREATE TABLE IF NOT EXISTS site_summary (
+    site_name           TEXT PRIMARY KEY,
+    images              TEXT NOT NULL DEFAULT '[]',
+    latest_change_ts    TEXT,
+    latest_change       TEXT,
+    latest_significant  INTEGER NOT NULL DEFAULT 0,
+    updated_at          TEXT
+);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    hash        TEXT PRIMARY KEY,
+    path        TEXT NOT NULL,
+    size        INTEGER NOT NULL DEFAULT 0,
+    refs        INTEGER NOT NULL DEFAULT 0,
+    created     REAL NOT NULL,
+    last_used   REAL
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_refs ON blobs(refs);
+
+CREATE TABLE IF NOT EXISTS diff_specs (
+    key         TEXT PRIMARY KEY,
+    spec        TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS learned_hosts (
+    site_name   TEXT NOT NULL,
+    host        TEXT NOT NULL,
+    first_seen  REAL NOT NULL,
+    PRIMARY KEY (site_name, host)
+);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id          TEXT NOT NULL,
+    host            TEXT NOT NULL DEFAULT '',
+    state           TEXT NOT NULL DEFAULT 'queued',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    planned_at      REAL NOT NULL,
+    available_at    REAL NOT NULL,
+    lease_owner     TEXT,
+    lease_expires   REAL,
+    started_at      REAL,
+    finished_at     REAL,
+    error           TEXT,
+    result          TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks(state, available_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_open_job ON tasks(job_id) WHERE state IN ('queued', 'leased');
+"""
+SUMMARY_IMAGES = 6   # how many recent screenshots the dashboard/filmstrip shows
+
+
+def connect(db_file=None):
+    """Per-thread connection, created (and the schema applied) on first use."""
+    db_file = db_file or DB_FILE
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_file)
+    if conn is None:
+        conn = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        with _init_lock:
+            if db_file not in _initialized:
+                conn.executescript(SCHEMA)
+                _initialized.add(db_file)
+        conns[db_file] = conn
+    return conn
+
+
+class transaction:
+    """with transaction() as conn: ... commits on success, rolls back on error.
+    Nests (as a savepoint) when a transaction is already open on this thread."""
+    def __init__(self, db_file=None):
+        self.conn = connect(db_file)
+        self.nested = False
+
+    def __enter__(self):
+        if self.conn.in_transaction:
+            self.nested = True
+            self.conn.execute("SAVEPOINT nested")
+        else:
+            self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.nested:
+            if exc_type:
+                self.conn.execute("ROLLBACK TO nested")
+            self.conn.execute("RELEASE nested")
+        else:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def _row_to_record(row, columns):
+    record = json.loads(row["data"]) if row["data"] else {}
+    for col in columns:
+        record[col] = row[col]
+    return record
+
+
+# --------------------
+# Sites
+# --------------------
+def load_sites():
+    rows = connect().execute("SELECT job_id, data FROM sites ORDER BY rowid").fetchall()
+    return {row["job_id"]: json.loads(row["data"]) for row in rows}
+
+
+def get_site(job_id):
+    row = connect().execute("SELECT data FROM sites WHERE job_id = ?", (job_id,)).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+def save_site(job_id, site):
+    connect().execute(
+        "INSERT INTO sites(job_id, site_name, data) VALUES (?, ?, ?) "
+        "ON CONFLICT(job_id) DO UPDATE SET site_name=excluded.site_name, data=excluded.data",
+        (job_id, site.get("site_name", ""), json.dumps(site)),
+    )
+
+
+def save_sites(sites):
+    with transaction() as conn:
+        conn.execute("DELETE FROM sites WHERE job_id NOT IN (%s)" % ",".join("?" * len(sites)), list(sites))
+        for job_id, site in sites.items():
+            save_site(job_id, site)
+
+
+def delete_site(job_id):
+    """Remove a site with its captures and changes. Their blobs are released, the frames go with
+    the next blobstore.collect_garbage()."""
+    with transaction() as conn:
+        row = conn.execute("SELECT site_name FROM sites WHERE job_id = ?", (job_id,)).fetchone()
+        conn.execute("DELETE FROM sites WHERE job_id = ?", (job_id,))
+        if row:
+            site_name = row["site_name"]
+            delete_captures(r[0] for r in conn.execute("SELECT id FROM captures WHERE site_name = ?", (site_name,)).fetchall())
+            delete_changes(r[0] for r in conn.execute("SELECT id FROM changes WHERE site_name = ?", (site_name,)).fetchall())
+            conn.execute("DELETE FROM site_summary WHERE site_name = ?", (site_name,))
+
+
+def update_site_fields(job_id, **fields):
+    with transaction() as conn:
+        row = conn.execute("SELECT data FROM sites WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        site = json.loads(row["data"])
+        site.update(fields)
+        save_site(job_id, site)
+        return site
+
+
+# --------------------
+# Captures
+# --------------------
+_CAPTURE_COLS = ("site_name", "timestamp", "path", "blob", "viewport")
+
+
+def _capture_blobs(row):
+    return [row["blob"]] + _tile_blobs(json.loads(row["data"]))
+
+
+def add_capture(record):
+    site_name = record["site"] if "site" in record else record["site_name"]
+    viewport = record.get("viewport") or ""
+    data = {k: v for k, v in record.items() if k not in _CAPTURE_COLS and k != "is_significant_change"}
+    with stages.stage("metadata_write"), transaction() as conn:
+        # writing the same (site, viewport, timestamp) again replaces the row, so what it pointed at is released
+        old = conn.execute("SELECT blob, data FROM captures WHERE site_name = ? AND viewport = ? AND timestamp = ?",
+                           (site_name, viewport, record["timestamp"])).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO captures(site_name, timestamp, path, is_significant, data, blob, viewport) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (site_name, record["timestamp"], record["path"],
+             int(bool(record.get("is_significant_change"))), json.dumps(data), record.get("blob"), viewport),
+        )
+        _adjust_refs([record.get("blob")] + _tile_blobs(record), 1)
+        if old:
+            _adjust_refs(_capture_blobs(old), -1)
+        refresh_summary(site_name)
+
+
+def _capture_record(row):
+    record = _row_to_record(row, ("id", "timestamp", "path", "blob", "viewport"))
+    record["site"] = row["site_name"]
+    record["is_significant_change"] = bool(row["is_significant"])
+    return record
+
+
+def recent_captures(site_name, count=6, viewport=None):
+    """Newest first. With a viewport label, only that breakpoint (plus pre-viewport rows)."""
+    if viewport is None:
+        rows = connect().execute(
+            "SELECT * FROM captures WHERE site_name = ? ORDER BY timestamp DESC, id LIMIT ?",
+            (site_name, count),
+        ).fetchall()
+    else:
+        rows = connect().execute(
+            "SELECT * FROM captures WHERE site_name = ? AND viewport IN (?, '') ORDER BY timestamp DESC LIMIT ?",
+            (site_name, viewport, count),
+        ).fetchall()
+    return [_capture_record(r) for r in rows]
+
+
+def get_capture(site_name, timestamp, viewport=None):
+    """One capture by its timestamp (and breakpoint), None if it's gone."""
+    row = connect().execute(
+        "SELECT * FROM captures WHERE site_name = ? AND timestamp = ? AND (? IS NULL OR viewport IN (?, '')) "
+        "ORDER BY id LIMIT 1",
+        (site_name, timestamp, viewport, viewport),
+    ).fetchone()
+    return _capture_record(row) if row else None
+
+
+def expired_captures(site_name, cutoff_ts, significant_cutoff_ts="", keep_last=0, limit=500):
+    """Oldest-first batch of captures past their cutoff (YYYYmmdd_HHMMSS strings), never touching
+    the newest keep_last of each viewport. Significant captures use significant_cutoff_ts ("" keeps them all)."""
+    rows = connect().execute(
+        "SELECT * FROM captures WHERE site_name = ? "
+        "AND ((is_significant = 0 AND timestamp < ?) OR (is_significant = 1 AND timestamp < ?)) "
+        "AND id NOT IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+        "(PARTITION BY viewport ORDER BY timestamp DESC) AS n FROM captures WHERE site_name = ?) WHERE n <= ?) "
+        "ORDER BY timestamp LIMIT ?",
+        (site_name, cutoff_ts, significant_cutoff_ts, site_name, keep_last, limit),
+    ).fetchall()
+    return [_capture_record(r) for r in rows]
+
+
+def sites_with_captures_before(cutoff_ts):
+    """Sites that have anything older than cutoff_ts, straight off the timestamp index."""
+    rows = connect().execute(
+        "SELECT DISTINCT site_name FROM captures WHERE timestamp < ? "
+        "UNION SELECT DISTINCT site_name FROM changes WHERE timestamp < ?",
+        (cutoff_ts, cutoff_ts),
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def delete_captures(ids):
+    ids = list(ids)
+    if not ids:
+        return
+    with transaction() as conn:
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(f"SELECT site_name, blob, data FROM captures WHERE id IN ({placeholders})", ids).fetchall()
+        sites = {r["site_name"] for r in rows}
+        conn.executemany("DELETE FROM captures WHERE id = ?", [(i,) for i in ids])
+        _adjust_refs([h for r in rows for h in _capture_blobs(r)], -1)
+        for site_name in sites:
+            refresh_summary(site_name)
+
+
+# --------------------
+# Changes
+# --------------------
+_CHANGE_BLOBS = ("prev_blob", "curr_blob", "diff_blob")
+_CHANGE_COLS = ("site_name", "timestamp", "prev", "curr", "diff", "dismissed", "viewport") + _CHANGE_BLOBS
+HISTORY_PAGE_MAX = 100
+HISTORY_SCAN_MAX = 1000   # rows one filtered page may look at, see changes_page
+
+
+def _change_blobs(row):
+    return [row[k] for k in _CHANGE_BLOBS] + _tile_blobs(json.loads(row["data"]))
+
+
+def add_change(site_name, record):
+    viewport = record.get("viewport") or ""
+    data = {k: v for k, v in record.items() if k not in _CHANGE_COLS}
+    with stages.stage("metadata_write"), transaction() as conn:
+        old = conn.execute("SELECT * FROM changes WHERE site_name = ? AND viewport = ? AND timestamp = ?",
+                           (site_name, viewport, record["timestamp"])).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO changes(site_name, timestamp, prev, curr, diff, dismissed, data, prev_blob, curr_blob, diff_blob, viewport, score) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (site_name, record["timestamp"], record.get("prev"), record.get("curr"), record.get("diff"),
+             int(bool(record.get("dismissed"))), json.dumps(data),
+             record.get("prev_blob"), record.get("curr_blob"), record.get("diff_blob"),
+             viewport, (record.get("compare") or {}).get("mse")),
+        )
+        _adjust_refs([record.get(k) for k in _CHANGE_BLOBS] + _tile_blobs(record), 1)
+        if old:
+            _adjust_refs(_change_blobs(old), -1)
+        refresh_summary(site_name)
+
+
+def _change_record(row):
+    record = _row_to_record(row, ("id", "timestamp", "prev", "curr", "diff", "viewport") + _CHANGE_BLOBS)
+    record["dismissed"] = bool(row["dismissed"])
+    if not record.get("diff"):
+        record.pop("diff", None)
+    return record
+
+
+def changes_page(site_name, limit=20, cursor=None, dismissed=None, min_score=None, max_score=None, viewport=None):
+    """One page of a site's changes, newest first, and the cursor for the next page (None at the end).
+    The cursor is "<timestamp>:<id>" of the last row looked at; the query seeks to it on the
+    (site_name, timestamp) index, so a page costs about the same however deep into the history it is.
+    score is the change's MSE. Score and viewport have no index to seek on, so a filtered page
+    looks at no more than HISTORY_SCAN_MAX rows: if those hold fewer than limit matches, the page
+    comes back short (maybe empty) with a cursor to carry on from."""
+    limit = max(1, min(int(limit), HISTORY_PAGE_MAX))
+    where, args = ["site_name = ?"], [site_name]
+    if cursor:
+        ts, _, row_id = cursor.rpartition(":")
+        if not ts or not row_id.isdigit():
+            raise ValueError(f"bad cursor {cursor!r}")
+        where.append("timestamp <= ? AND (timestamp < ? OR id > ?)")   # the <= lets the index seek
+        args += [ts, ts, int(row_id)]
+    if dismissed is not None:
+        where.append("dismissed = ?")
+        args.append(int(bool(dismissed)))
+    min_score = None if min_score is None else float(min_score)
+    max_score = None if max_score is None else float(max_score)
+    filtered = min_score is not None or max_score is not None or bool(viewport)
+    scan_limit = HISTORY_SCAN_MAX if filtered else limit + 1
+    conn = connect()
+    scanned = conn.execute(
+        f"SELECT id, timestamp, score, viewport FROM changes WHERE {' AND '.join(where)} "
+        "ORDER BY timestamp DESC, id LIMIT ?",
+        args + [scan_limit],
+    ).fetchall()
+    matched = [r for r in scanned
+               if (min_score is None or (r["score"] is not None and r["score"] >= min_score))
+               and (max_score is None or (r["score"] is not None and r["score"] <= max_score))
+               and (not viewport or r["viewport"] in (viewport, ""))]
+    if len(matched) > limit:
+        last, matched = matched[limit - 1], matched[:limit]
+    elif len(scanned) == scan_limit and filtered:
+        last = scanned[-1]   # scan cap reached before the page filled up
+    else:
+        last = None
+    ids = [r["id"] for r in matched]
+    rows = conn.execute(
+        f"SELECT * FROM changes WHERE id IN ({','.join('?' * len(ids))}) ORDER BY timestamp DESC, id", ids
+    ).fetchall() if ids else []
+    next_cursor = f"{last['timestamp']}:{last['id']}" if last else None
+    return [_change_record(r) for r in rows], next_cursor
+
+
+def latest_change(site_name):
+    row = connect().execute(
+        "SELECT * FROM changes WHERE site_name = ? ORDER BY timestamp DESC, id LIMIT 1", (site_name,)
+    ).fetchone()
+    return _change_record(row) if row else None
+
+
+def dismiss_change(site_name, timestamp):
+    with transaction() as conn:
+        cur = conn.execute(
+            "UPDATE changes SET dismissed = 1 WHERE site_name = ? AND timestamp = ?", (site_name, timestamp)
+        )
+        refresh_summary(site_name)
+    return cur.rowcount > 0
+
+
+def expired_changes(site_name, cutoff_ts, limit=500):
+    rows = connect().execute(
+        "SELECT * FROM changes WHERE site_name = ? AND timestamp < ? ORDER BY timestamp LIMIT ?",
+        (site_name, cutoff_ts, limit),
+    ).fetchall()
+    return [_change_record(r) for r in rows]
+
+
+def delete_changes(ids):
+    ids = list(ids)
+    if not ids:
+        return
+    with transaction() as conn:
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(f"SELECT * FROM changes WHERE id IN ({placeholders})", ids).fetchall()
+        conn.executemany("DELETE FROM changes WHERE id = ?", [(i,) for i in ids])
+        _adjust_refs([h for r in rows for h in _change_blobs(r)], -1)
+        for site_name in {r["site_name"] for r in rows}:
+            refresh_summary(site_name)
+
+
+# --------------------
+# Blobs (content-addressed frames, see blobstore.py)
+# --------------------
+def register_blob(digest, path):
+    """Record a blob. Returns True if it's new (caller should write the file).
+    A blob we already have is marked as just used, so the collector leaves it alone until the
+    capture that is about to reference it has inserted its row."""
+    conn = connect()
+    if conn.execute("UPDATE blobs SET last_used = strftime('%s','now') WHERE hash = ?", (digest,)).rowcount:
+        return False
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO blobs(hash, path, refs, created, last_used) "
+        "VALUES (?, ?, 0, strftime('%s','now'), strftime('%s','now'))",
+        (digest, path),
+    )
+    return cur.rowcount > 0
+
+
+def set_blob_size(digest, size):
+    connect().execute("UPDATE blobs SET size = ? WHERE hash = ?", (size, digest))
+
+
+def _tile_blobs(record):
+    # full-page/element captures and their changes reference one blob per tile (see tiles.py)
+    return [t.get(k) for t in record.get("tiles") or [] for k in ("blob",) + _CHANGE_BLOBS]
+
+
+def _adjust_refs(hashes, delta):
+    counts = {}
+    for h in hashes:
+        if h:
+            counts[h] = counts.get(h, 0) + delta
+    if counts:
+        connect().executemany("UPDATE blobs SET refs = refs + ?, last_used = strftime('%s','now') WHERE hash = ?",
+                              [(d, h) for h, d in counts.items()])
+
+
+def take_unreferenced_blobs(min_age_seconds=600):
+    """Remove and return blob rows nothing points at any more. The age guard is on last_used
+    (stored again, or referenced/released), not on created: it covers a blob a capture has just
+    put() but hasn't inserted its row for yet, however old the blob itself is.
+    Call inside a transaction that also deletes the files (blobstore.collect_garbage), so a put()
+    of the same pixels waits for the delete and then writes the blob again."""
+    with transaction() as conn:
+        rows = conn.execute(
+            "SELECT * FROM blobs WHERE refs <= 0 AND COALESCE(last_used, created) < strftime('%s','now') - ?",
+            (min_age_seconds,),
+        ).fetchall()
+        conn.executemany("DELETE FROM blobs WHERE hash = ?", [(r["hash"],) for r in rows])
+    return [dict(r) for r in rows]
+
+
+def put_diff_spec(key, spec):
+    """How to redraw a diff (ignore rects, shift), see diffs.py. Written once per distinct spec."""
+    connect().execute("INSERT OR IGNORE INTO diff_specs(key, spec) VALUES (?, ?)", (key, json.dumps(spec)))
+
+
+def get_diff_spec(key):
+    row = connect().execute("SELECT spec FROM diff_specs WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["spec"]) if row else None
+
+
+def blob_stats():
+    row = connect().execute("SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS bytes FROM blobs").fetchone()
+    refs = connect().execute(
+        "SELECT (SELECT COUNT(*) FROM captures WHERE blob IS NOT NULL) AS captures"
+    ).fetchone()
+    return {"blobs": row["blobs"], "bytes": row["bytes"], "captures": refs["captures"]}
+
+
+# --------------------
+# Learned third-party hosts (see blocking.py)
+# --------------------
+def learned_hosts(site_name):
+    rows = connect().execute("SELECT host FROM learned_hosts WHERE site_name = ?", (site_name,)).fetchall()
+    return {r["host"] for r in rows}
+
+
+def add_learned_hosts(site_name, hosts):
+    """Returns the hosts that weren't known yet."""
+    new = []
+    with transaction() as conn:
+        for host in sorted(hosts):
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO learned_hosts(site_name, host, first_seen) VALUES (?, ?, strftime('%s','now'))",
+                (site_name, host),
+            )
+            if cur.rowcount:
+                new.append(host)
+    return new
+
+
+def forget_learned_hosts(site_name):
+    connect().execute("DELETE FROM learned_hosts WHERE site_name = ?", (site_name,))
+
+
+# --------------------
+# Dashboard summary
+# --------------------
+### One row per site with what "/" and "/status" need: newest screenshots, newest change.
+### Every write above refreshes it in the same transaction with LIMIT'd index lookups (one per
+### viewport, one for the newest change), so reading it costs the same however much history a
+### site has. images holds the newest SUMMARY_IMAGES of each viewport.
+def refresh_summary(site_name):
+    conn = connect()
+    caps = []
+    for (label,) in conn.execute("SELECT DISTINCT viewport FROM captures WHERE site_name = ?", (site_name,)).fetchall():
+        caps += conn.execute(
+            "SELECT id, path, timestamp, is_significant, viewport FROM captures "
+            "WHERE site_name = ? AND viewport = ? ORDER BY timestamp DESC LIMIT ?",
+            (site_name, label, SUMMARY_IMAGES),
+        ).fetchall()
+    # newest first, and within one run the breakpoints in the order they were captured
+    caps.sort(key=lambda r: (r["timestamp"], -r["id"]), reverse=True)
+    change = conn.execute(
+        "SELECT * FROM changes WHERE site_name = ? ORDER BY timestamp DESC, id LIMIT 1", (site_name,)
+    ).fetchone()
+    images = [{"src": r["path"].replace("screenshots/", "/static/screenshots/", 1), "timestamp": r["timestamp"],
+               "viewport": r["viewport"]} for r in caps]
+    latest = _change_record(change) if change else None
+    conn.execute(
+        "INSERT OR REPLACE INTO site_summary(site_name, images, latest_change_ts, latest_change, latest_significant, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, datetime('now'))",
+        (site_name, json.dumps(images), latest["timestamp"] if latest else None,
+         json.dumps(latest) if latest else None, int(bool(caps and caps[0]["is_significant"]))),
+    )
+
+
+def _summary_record(row):
+    images = json.loads(row["images"])
+    # rows written before images carried their timestamp
+    images = [i if isinstance(i, dict) else {"src": i, "timestamp": i.split("/")[-1].split(".")[0]} for i in images]
+    return {
+        "images": images,
+        "latest_change_ts": row["latest_change_ts"],
+        "latest_change": json.loads(row["latest_change"]) if row["latest_change"] else None,
+        "latest_significant": bool(row["latest_significant"]),
+    }
+
+
+def load_summaries():
+    rows = connect().execute("SELECT * FROM site_summary").fetchall()
+    return {row["site_name"]: _summary_record(row) for row in rows}
+
+
+def get_summary(site_name):
+    row = connect().execute("SELECT * FROM site_summary WHERE site_name = ?", (site_name,)).fetchone()
+    if row is None:
+        with transaction():
+            refresh_summary(site_name)
+        row = connect().execute("SELECT * FROM site_summary WHERE site_name = ?", (site_name,)).fetchone()
+    return _summary_record(row)
+
+
+def ensure_summaries():
+    """Databases created before the summary table existed get it filled in once."""
+    conn = connect()
+    if conn.execute("SELECT 1 FROM site_summary LIMIT 1").fetchone():
+        return
+    if conn.execute("SELECT 1 FROM sites LIMIT 1").fetchone():
+        rebuild_summaries()
+
+
+def rebuild_summaries():
+    with transaction() as conn:
+        names = {r[0] for r in conn.execute("SELECT site_name FROM captures UNION SELECT site_name FROM changes")}
+        names |= {r[0] for r in conn.execute("SELECT site_name FROM sites")}
+        for site_name in names:
+            refresh_summary(site_name)
+
+
+# --------------------
+# One-shot JSON importer
+# --------------------
+def _read_json(path, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[!] Skipping {path}: {e}")
+        return default
+
+
+def import_json(sites_json=SITES_JSON, screenshot_base=SCREENSHOT_BASE):
+    """Pull sites.json and every metadata.json / change_log.json into the database.
+    Safe to run more than once, rows are keyed on (site, timestamp)."""
+    counts = {"sites": 0, "captures": 0, "changes": 0}
+    with transaction():
+        if os.path.exists(sites_json):
+            for job_id, site in (_read_json(sites_json, {}) or {}).items():
+                save_site(job_id, site)
+                counts["sites"] += 1
+
+        if os.path.isdir(screenshot_base):
+            for site_name in os.listdir(screenshot_base):
+                folder = os.path.join(screenshot_base, site_name)
+                meta_path = os.path.join(folder, "metadata.json")
+                if os.path.exists(meta_path):
+                    for item in _read_json(meta_path, []) or []:
+                        if "timestamp" in item and "path" in item:
+                            item.setdefault("site", site_name)
+                            add_capture(item)
+                            counts["captures"] += 1
+
+                changes_dir = os.path.join(folder, "changes")
+                log_path = os.path.join(changes_dir, "change_log.json")
+                if os.path.exists(log_path):
+                    data = _read_json(log_path, [])
+                    for change in data if isinstance(data, list) else [data]:
+                        if "timestamp" not in change:
+                            continue
+                        # the per-change {ts}.json is where dismissals used to be recorded
+                        single = os.path.join(changes_dir, f"{change['timestamp']}.json")
+                        if os.path.exists(single):
+                            one = _read_json(single, {})
+                            if isinstance(one, list):
+                                one = one[0] if one else {}
+                            if one.get("dismissed"):
+                                change["dismissed"] = True
+                        add_change(site_name, change)
+                        counts["changes"] += 1
+    rebuild_summaries()
+    print(f"[✓] Imported {counts['sites']} sites, {counts['captures']} captures, {counts['changes']} changes")
+    return counts
+
+
+def import_if_empty():
+    """First start on the database: bring the old JSON history across automatically."""
+    conn = connect()
+    if conn.execute("SELECT 1 FROM sites LIMIT 1").fetchone():
+        return
+    if conn.execute("SELECT 1 FROM captures LIMIT 1").fetchone():
+        return
+    if os.path.exists(SITES_JSON) or os.path.isdir(SCREENSHOT_BASE):
+        import_json()
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "import":
+        import_json()
+    else:
+        print("usage: python storage.py import")
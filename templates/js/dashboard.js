@@ -1,11 +1,25 @@
 console.log("dashboard.js loaded");
+// /static/screenshots/diffs/xx/<prev>-<curr>.<mode>.png, rendered on request in whichever mode is asked for
+const DIFF_MODE_RE = /(\/diffs\/.+\.)(highlight|heatmap|side_by_side|boxes)(\.png)$/;
+
 function showLightbox(src) {
   const lightbox = document.getElementById("lightbox");
   const img = document.getElementById("lightbox-img");
   img.src = src;
+  const modes = document.getElementById("lightbox-modes");
+  const match = src.match(DIFF_MODE_RE);
+  if (modes) {
+    modes.classList.toggle("hidden", !match);
+    modes.querySelectorAll("button").forEach((b) => b.classList.toggle("active", !!match && b.dataset.mode === match[2]));
+  }
   lightbox.classList.add("show");
 }
 
+function setDiffMode(mode) {
+  const img = document.getElementById("lightbox-img");
+  showLightbox(img.src.replace(DIFF_MODE_RE, `$1${mode}$3`));
+}
+
 function closeLightbox(event) {
   // only close if you click outside the image
   if (event.target.id === "lightbox") {
@@ -69,23 +83,167 @@ function toggleHistory(siteName) {
     const section = document.getElementById(`history-${siteName}`);
     if (section.style.display === "none") {
         section.style.display = "block";
+        startHistory(siteName);
     } else {
         section.style.display = "none";
     }
 }
+
+// history is fetched a page at a time from /site/<name>/history, the next page when the
+// sentinel under the list scrolls into view
+const HISTORY_PAGE_SIZE = 20;
+const historyState = {};
+
+function startHistory(siteName) {
+  const section = document.getElementById(`history-${siteName}`);
+  if (historyState[siteName]) return;
+  const state = historyState[siteName] = { cursor: null, done: false, loading: false, generation: 0 };
+  state.observer = new IntersectionObserver((entries) => {
+    if (entries.some((e) => e.isIntersecting)) loadHistoryPage(siteName);
+  });
+  state.observer.observe(section.querySelector(".history-sentinel"));
+}
+
+function resetHistory(siteName) {
+  const state = historyState[siteName];
+  if (!state) return;
+  const section = document.getElementById(`history-${siteName}`);
+  section.querySelector(".history-list").innerHTML = "";
+  Object.assign(state, { cursor: null, done: false, loading: false, generation: state.generation + 1 });
+  loadHistoryPage(siteName);
+}
+
+async function loadHistoryPage(siteName) {
+  const state = historyState[siteName];
+  if (!state || state.loading || state.done) return;
+  const section = document.getElementById(`history-${siteName}`);
+  const status = section.querySelector(".history-status");
+  const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE });
+  if (state.cursor) params.set("cursor", state.cursor);
+  const dismissed = section.querySelector(".history-dismissed").value;
+  const minScore = section.querySelector(".history-min-score").value;
+  const maxScore = section.querySelector(".history-max-score").value;
+  if (dismissed) params.set("dismissed", dismissed);
+  if (minScore) params.set("min_score", minScore);
+  if (maxScore) params.set("max_score", maxScore);
+
+  state.loading = true;
+  const generation = state.generation;
+  status.textContent = "Loading…";
+  try {
+    const res = await fetch(`/site/${encodeURIComponent(siteName)}/history?${params}`);
+    const data = await res.json();
+    if (generation !== state.generation) return; // filters changed while this was in flight
+    if (!res.ok) {
+      status.textContent = data.error || "Failed to load history";
+      state.done = true;
+      return;
+    }
+    const list = section.querySelector(".history-list");
+    const multiViewport = section.dataset.multiViewport === "true";
+    data.changes.forEach((change) => list.appendChild(historyItem(change, multiViewport)));
+    state.cursor = data.next_cursor;
+    state.done = !data.next_cursor;
+    status.textContent = state.done ? (list.children.length ? "" : "No changes match.") : "";
+  } catch (e) {
+    status.textContent = "Failed to load history";
+  } finally {
+    if (generation === state.generation) state.loading = false;
+  }
+  // a short page may leave the sentinel on screen, the observer won't fire again for it
+  const sentinel = section.querySelector(".history-sentinel").getBoundingClientRect();
+  if (!state.done && sentinel.top < window.innerHeight) loadHistoryPage(siteName);
+}
+
+function historyItem(change, multiViewport) {
+  const li = document.createElement("li");
+  const span = (text, changed) => {
+    const el = document.createElement("span");
+    el.className = changed ? "region-score changed" : "region-score";
+    el.textContent = text;
+    return el;
+  };
+  const strong = document.createElement("strong");
+  strong.textContent = change.timestamp;
+  li.appendChild(strong);
+  if (change.viewport && multiViewport) {
+    const vp = document.createElement("span");
+    vp.className = "viewport-label";
+    vp.textContent = change.viewport;
+    li.append(" ", vp);
+  }
+  const compare = change.compare || {};
+  if (compare.mse !== undefined) li.append(" ", span(`MSE ${compare.mse}`));
+  if (change.dismissed) li.append(span("dismissed"));
+  if (compare.shift) li.append(span(`moved ${compare.shift.by}px at row ${compare.shift.row}`));
+  if (change.tiles) {
+    const first = change.tiles[0] && change.tiles[0].y ? `, first at ${change.tiles[0].y}px` : "";
+    li.append(span(`${change.tiles.length}${compare.early_stop ? "+" : ""} tile(s) changed${first}`, true));
+  }
+  li.appendChild(document.createElement("br"));
+  const regions = Object.entries(change.regions || {});
+  if (regions.length) {
+    regions.forEach(([name, score]) => li.append(span(`${name}: ${score.mse} / ${score.threshold}`, score.changed)));
+    li.appendChild(document.createElement("br"));
+  }
+  ["prev", "curr", "diff"].forEach((key) => {
+    if (!change[key]) return;
+    const img = document.createElement("img");
+    img.loading = "lazy";
+    img.className = "compare-img";
+    img.src = (change.thumbs && change.thumbs[key]) || change[key];
+    img.onclick = () => showLightbox(change[key]);
+    li.appendChild(img);
+  });
+  return li;
+}
 function submitEdit(siteName) {
   const url = document.getElementById("edit-url")?.value;
   const interval = parseInt(document.getElementById("edit-interval")?.value);
   const viewportInput = document.getElementById("edit-viewport")?.value;
   const cookieSelector = document.getElementById("edit-cookie-selector")?.value;
   const waitTime = parseInt(document.getElementById("edit-wait-time")?.value);
+  const regionsInput = document.getElementById("edit-regions")?.value.trim();
+  const captureMode = document.getElementById("edit-capture-mode")?.value || "viewport";
+  const captureSelector = document.getElementById("edit-capture-selector")?.value.trim();
+  const comparator = document.getElementById("edit-comparator")?.value || "mse";
+  const alignShifts = document.getElementById("edit-align-shifts")?.checked ?? false;
+  // request blocking, see blocking.py
+  const list = (id, sep) => (document.getElementById(id)?.value || "").split(sep).map((v) => v.trim()).filter(Boolean);
+  const blocking = {
+    patterns: list("edit-block-patterns", "\n"),
+    types: list("edit-block-types", ","),
+    third_party: document.getElementById("edit-block-third-party")?.checked || false,
+    allow_hosts: list("edit-block-allow", ","),
+    stub_trackers: document.getElementById("edit-block-stubs")?.checked || false,
+    global: document.getElementById("edit-block-global")?.checked ?? true
+  };
+  const tags = list("edit-tags", ",");
+  const assetCache = document.getElementById("edit-asset-cache")?.checked ?? true;
+  const snapshots = document.getElementById("edit-snapshots")?.checked || false;
 
   if (!url || !viewportInput || isNaN(interval) || isNaN(waitTime)) {
     alert("Please fill out all fields correctly.");
     return;
   }
 
-  const viewport = viewportInput.split(",").map(Number);
+  let regions = null;
+  if (regionsInput) {
+    try {
+      regions = JSON.parse(regionsInput);
+    } catch (e) {
+      alert("Regions must be valid JSON.");
+      return;
+    }
+  }
+
+  // "w,h" for one viewport, "w,h; w,h; ..." to capture several breakpoints from one page load
+  const breakpoints = viewportInput.split(";").map((v) => v.split(",").map(Number));
+  if (breakpoints.some((v) => v.length !== 2 || v.some(isNaN))) {
+    alert("Viewports must look like 1366,768 or 1366,768; 390,844");
+    return;
+  }
+  const viewport = breakpoints.length === 1 ? breakpoints[0] : breakpoints;
 
   fetch(`/edit-site/${siteName}`, {
     method: "POST",
@@ -95,16 +253,69 @@ function submitEdit(siteName) {
       interval_minutes: interval,
       viewport,
       cookie_accept_selector: cookieSelector,
-      wait_time: waitTime
+      wait_time: waitTime,
+      regions,
+      capture_mode: captureMode,
+      capture_selector: captureSelector,
+      comparator,
+      align_shifts: alignShifts,
+      blocking,
+      asset_cache: assetCache,
+      snapshots,
+      tags
     })
   })
     .then((res) => res.json())
     .then((data) => {
-      alert(data.status || "Update complete");
+      alert(data.status || data.error || "Update complete");
       location.reload();
     });
 }
 
+// capture right away through POST /capture, the button follows the NDJSON progress stream
+async function captureNow(siteName, button) {
+  const label = button.textContent;
+  button.disabled = true;
+  button.textContent = "Queued…";
+  try {
+    const res = await fetch("/capture?stream=ndjson", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ sites: [siteName] })
+    });
+    if (!res.ok) {
+      const data = await res.json();
+      alert(data.error || "Capture failed to start");
+      return;
+    }
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = "";
+    let last = null;
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffered += decoder.decode(value, { stream: true });
+      const lines = buffered.split("\n");
+      buffered = lines.pop();
+      for (const line of lines.filter(Boolean)) {
+        const event = JSON.parse(line);
+        if (event.type === "running") button.textContent = "Capturing…";
+        if (["done", "skipped", "error"].includes(event.type)) last = event;
+      }
+    }
+    if (last && last.type === "done") {
+      alert(last.significant ? "Visual change detected." : "No visual change.");
+      location.reload();
+    } else if (last) {
+      alert(`Capture ${last.type}: ${last.error || last.reason || ""}`);
+    }
+  } finally {
+    button.disabled = false;
+    button.textContent = label;
+  }
+}
+
 //pause and resume
 function togglePause(siteName, pause) {
   const endpoint = pause ? `/pause-site/${siteName}` : `/resume-site/${siteName}`;
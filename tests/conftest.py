@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database, with screenshots/ and friends written under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "DB_FILE", str(tmp_path / "test.db"))
+    yield storage
+    conn = storage._local.__dict__.get("conns", {}).pop(str(tmp_path / "test.db"), None)
+    if conn is not None:
+        conn.close()
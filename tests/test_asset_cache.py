@@ -0,0 +1,65 @@
+import os
+import urllib.request
+
+import pytest
+
+import asset_cache
+import browser_pool
+from benchmarks import pipeline_bench
+
+
+@pytest.fixture
+def server():
+    server, base_url = pipeline_bench.serve_fixtures()
+    yield server, base_url
+    server.shutdown()
+
+
+def test_stand_in_server_counts_origin_fetches(server):
+    server, base_url = server
+    for _ in range(2):
+        with urllib.request.urlopen(f"{base_url}/assets/site.css") as response:
+            assert "max-age" in response.headers["Cache-Control"]
+    urllib.request.urlopen(f"{base_url}/assets.html").close()
+    assert server.asset_hits == {"/assets/site.css": 2}
+
+
+def test_a_released_slot_is_handed_to_the_next_session(db):
+    index, path = asset_cache.acquire_slot()
+    other, other_path = asset_cache.acquire_slot()
+    assert other_path != path
+    with open(os.path.join(path, "entry"), "w") as f:
+        f.write("cached")
+    asset_cache.release_slot(index)
+    asset_cache.release_slot(other)
+    again, again_path = asset_cache.acquire_slot()
+    assert again_path == path and os.path.exists(os.path.join(path, "entry"))
+    asset_cache.release_slot(again)
+
+
+def test_an_expired_slot_starts_empty(db):
+    index, path = asset_cache.acquire_slot()
+    with open(os.path.join(path, "entry"), "w") as f:
+        f.write("cached")
+    asset_cache.release_slot(index)
+    index, path = asset_cache.acquire_slot(ttl_hours=-1)
+    assert not os.path.exists(os.path.join(path, "entry"))
+    asset_cache.release_slot(index)
+
+
+@pytest.fixture
+def chrome(db):
+    try:
+        browser_pool.make_driver((800, 600)).quit()
+    except Exception as e:
+        pytest.skip(f"no Chrome/chromedriver here: {e}")
+    yield
+    browser_pool.pool.close()
+
+
+def test_only_the_first_capture_fetches_assets_from_origin(chrome, server):
+    server, base_url = server
+    result = pipeline_bench.bench_asset_cache(server, base_url, runs=4)
+    # the browser is replaced half way, the new session has to find the same cache
+    assert result["fetched_from_origin"] == result["assets"]
+    assert set(result["per_asset"].values()) == {1}
@@ -0,0 +1,16 @@
+import numpy as np
+
+from baseline_cache import Baseline, BaselineCache, cache_key
+
+
+def test_drop_site_drops_every_viewport_and_mode():
+    cache = BaselineCache()
+    frame = np.zeros((10, 10, 3), np.uint8)
+    keys = [cache_key("shop"), cache_key("shop", "1366x768"), cache_key("shop", "390x844", "full_page"),
+            cache_key("shop", "1366x768", "element"), cache_key("shopfront", "1366x768")]
+    for key in keys:
+        cache.put(key, Baseline("x.png", frame))
+    cache.drop_site("shop")
+    assert [k for k in keys if cache.get(k)] == [cache_key("shopfront", "1366x768")]
+    assert cache.stats()["bytes"] == Baseline("x.png", frame).nbytes
+
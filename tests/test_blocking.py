@@ -0,0 +1,87 @@
+import json
+
+import blocking
+
+
+class FakeNetwork:
+    def __init__(self):
+        self.handlers = {}
+
+    def add_request_handler(self, handler):
+        self.handlers["h1"] = handler
+        return "h1"
+
+    def remove_request_handler(self, handler_id):
+        del self.handlers[handler_id]
+
+
+class FakeRequest:
+    def __init__(self, url):
+        self.url = url
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class FakeDriver:
+    def __init__(self):
+        self.network = FakeNetwork()
+        self.cdp = []
+        self.log = []
+
+    def execute_cdp_cmd(self, method, params):
+        self.cdp.append((method, params))
+        return {}
+
+    def get_log(self, kind):
+        log, self.log = self.log, []
+        return log
+
+    def load(self, url, request_id):
+        """What Chrome does for one request: ask the handler, then log the outcome."""
+        request = FakeRequest(url)
+        for handler in list(getattr(self, "network", FakeNetwork()).handlers.values()):
+            handler(request)
+        events = [("Network.requestWillBeSent", {"requestId": request_id, "type": "Script", "request": {"url": url}})]
+        if request.failed:
+            events.append(("Network.loadingFailed", {"requestId": request_id, "errorText": "net::ERR_FAILED"}))
+        else:
+            events.append(("Network.loadingFinished", {"requestId": request_id, "encodedDataLength": 100}))
+        self.log += [{"message": json.dumps({"message": {"method": m, "params": p}})} for m, p in events]
+        return not request.failed
+
+
+def test_third_party_requests_are_refused_as_they_are_made(db):
+    driver = FakeDriver()
+    blocker = blocking.Blocker("shop", "https://www.shop.co.uk/", {"third_party": True,
+                                                                    "allow_hosts": ["cdn.example.net"]}).apply(driver)
+    assert driver.load("https://www.shop.co.uk/", "1")
+    assert driver.load("https://img.shop.co.uk/a.png", "2")
+    assert driver.load("https://eu.cdn.example.net/app.js", "3")
+    assert driver.load("data:image/png;base64,AAAA", "4")
+    assert not driver.load("https://widget.chat.io/w.js", "5")
+    assert not driver.load("https://example.net/x.js", "6")
+
+    stats = blocker.finish(driver)
+    assert driver.network.handlers == {}
+    assert (stats["loaded"], stats["blocked"], stats["failed"]) == (3, 2, 0)
+    assert db.learned_hosts("shop") == {"widget.chat.io", "example.net"}
+
+
+def test_without_bidi_known_hosts_still_go_into_the_patterns(db):
+    db.add_learned_hosts("shop", ["widget.chat.io"])
+    driver = FakeDriver()
+    del driver.network
+    blocker = blocking.Blocker("shop", "https://shop.example/", {"third_party": True}).apply(driver)
+    assert "*://widget.chat.io/*" in blocker.patterns
+    assert ("Network.setBlockedURLs", {"urls": blocker.patterns}) in driver.cdp
+    driver.load("https://new.tracker.example.org/t.js", "1")
+    blocker.finish(driver)
+    assert "new.tracker.example.org" in db.learned_hosts("shop")
+
+
+def test_allow_hosts_cover_subdomains():
+    assert blocking._first_party("a.b.cdn.net", "shop.example", {"cdn.net"})
+    assert not blocking._first_party("evilcdn.net", "shop.example", {"cdn.net"})
+    assert not blocking._first_party("shop.example.evil.com", "shop.example", set())
@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+import pytest
+
+import compare
+import diffs
+from compare import compare_frames
+
+
+def page(height=600, width=400, seed=1):
+    """White page with dark text-like bars every 30px."""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 255, np.uint8)
+    for y in range(20, height, 30):
+        x = int(rng.integers(10, 60))
+        cv2.rectangle(img, (x, y), (x + int(rng.integers(100, 300)), y + 12), (40, 40, 40), -1)
+    return img
+
+
+def insert_band(img, row, band):
+    """img with band pushed in at row, the bottom falling off so the size stays the same."""
+    return np.concatenate([img[:row], band, img[row:-len(band)]])
+
+
+def test_identical_frames_stop_at_exact():
+    prev = page()
+    result = compare_frames(prev, prev.copy())
+    assert result["tier"] == "exact"
+    assert not result["significant"]
+
+
+def test_small_noise_stops_at_lowres():
+    prev = page()
+    curr = prev.copy()
+    curr[100:102, 100:110] = 200
+    result = compare_frames(prev, curr)
+    assert result["tier"] == "lowres"
+    assert not result["significant"]
+
+
+def test_pattern_the_thumbnails_average_out_is_still_scored():
+    prev = np.zeros((400, 512, 3), np.uint8)
+    prev[:, ::2] = 255
+    curr = np.roll(prev, 1, axis=1)   # same grey thumbnail, every pixel changed
+    result = compare_frames(prev, curr)
+    assert result["lowres_mse"] < compare.PRECHECK_SKIP_MSE
+    assert result["tier"] == "full"
+    assert result["significant"]
+
+
+def test_full_resolution_mse_is_computed_once(monkeypatch):
+    prev = np.zeros((400, 512, 3), np.uint8)
+    prev[:, ::2] = 255
+    curr = np.roll(prev, 1, axis=1)
+    calls = []
+    real = compare.mse
+    monkeypatch.setattr(compare, "mse", lambda *a, **k: calls.append(1) or real(*a, **k))
+    result = compare_frames(prev, curr)
+    assert result["significant"]
+    assert result["mse"] == result["score"]
+    assert len(calls) == 1
+
+
+def test_changed_block_is_significant_with_either_comparator():
+    prev = page()
+    curr = prev.copy()
+    cv2.rectangle(curr, (50, 200), (250, 300), (0, 0, 255), -1)
+    for name in ("mse", "ssim"):
+        result = compare_frames(prev, curr, comparator=name)
+        assert result["tier"] == "full"
+        assert result["comparator"] == name
+        assert result["significant"]
+
+
+def test_ignore_mask_hides_a_change():
+    prev = page()
+    curr = prev.copy()
+    cv2.rectangle(curr, (50, 200), (250, 300), (0, 0, 255), -1)
+    mask = compare.build_mask(prev.shape, [[40, 190, 220, 120]])
+    assert not compare_frames(prev, curr, mask=mask)["significant"]
+
+
+def test_alignment_is_off_by_default():
+    assert compare.ALIGN_SHIFTS is False
+    prev = page()
+    curr = insert_band(prev, 36, np.full((10, 400, 3), 255, np.uint8))
+    result = compare_frames(prev, curr)
+    assert result["significant"]
+    assert "shift" not in result
+
+
+def test_blank_gap_lines_up_when_alignment_is_on():
+    prev = page()
+    curr = insert_band(prev, 36, np.full((10, 400, 3), 255, np.uint8))
+    result = compare_frames(prev, curr, align=True)
+    assert result["shift"]["by"] == 10
+    assert not result["significant"]
+
+
+@pytest.mark.parametrize("removed", [False, True])
+def test_inserted_banner_still_counts_after_alignment(removed):
+    prev = page()
+    curr = insert_band(prev, 80, np.full((60, 400, 3), (0, 0, 255), np.uint8))
+    if removed:
+        prev, curr = curr, prev
+    result = compare_frames(prev, curr, align=True)
+    assert result["shift"]["by"] == (-60 if removed else 60)
+    assert result["significant"]
+    assert result["mse"] > compare.MSE_THRESHOLD
+
+
+def test_diff_of_an_aligned_banner_highlights_the_banner():
+    prev = page()
+    curr = insert_band(prev, 80, np.full((60, 400, 3), (0, 0, 255), np.uint8))
+    result = compare_frames(prev, curr, align=True)
+    shift = [result["shift"]["row"], result["shift"]["by"]]
+    changed = diffs.changed_mask(*compare.align_vertical(prev, curr, *shift))
+    rows = np.flatnonzero(changed.any(axis=1))
+    assert rows.size and rows.min() >= 20 and rows.max() < 140
+    assert diffs.render(prev, curr, "highlight", shift=shift).shape == curr.shape
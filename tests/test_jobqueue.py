@@ -0,0 +1,88 @@
+import pytest
+
+import jobqueue
+import jobs
+import worker
+
+
+class Clock:
+    def __init__(self, now=1_800_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(db, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobqueue.time, "time", clock.time)
+    return clock
+
+
+def test_a_site_has_one_open_task(clock):
+    first = jobqueue.enqueue("site_a", "https://a.example/")
+    assert first is not None
+    assert jobqueue.enqueue("site_a", "https://a.example/") is None
+    assert jobqueue.open_task("site_a") == first
+
+
+def test_one_lease_per_host(clock):
+    jobqueue.enqueue("site_a", "https://shared.example/a")
+    jobqueue.enqueue("site_b", "https://shared.example/b")
+    jobqueue.enqueue("site_c", "https://other.example/")
+    leased = [jobqueue.claim("w1"), jobqueue.claim("w2"), jobqueue.claim("w3")]
+    assert [t["job_id"] for t in leased if t] == ["site_a", "site_c"]
+
+
+def test_expired_lease_moves_to_another_worker(clock):
+    task_id = jobqueue.enqueue("site_a", "https://a.example/")
+    assert jobqueue.claim("w1")["id"] == task_id
+    clock.now += jobqueue.LEASE_SECONDS - 1
+    assert jobqueue.heartbeat(task_id, "w1")
+    clock.now += jobqueue.LEASE_SECONDS + 1
+    retry = jobqueue.claim("w2")
+    assert (retry["id"], retry["attempts"]) == (task_id, 2)
+    assert not jobqueue.heartbeat(task_id, "w1")
+    assert not jobqueue.complete(task_id, "w1", {"late": True})
+    assert jobqueue.complete(task_id, "w2", {"ok": True})
+    assert jobqueue.get_tasks([task_id])[task_id]["state"] == "done"
+
+
+def test_failures_back_off_then_give_up(clock):
+    task_id = jobqueue.enqueue("site_a")
+    for attempt in range(1, jobqueue.MAX_ATTEMPTS):
+        assert jobqueue.claim("w1")["attempts"] == attempt
+        assert jobqueue.fail(task_id, "w1", "boom") == "retry"
+        assert jobqueue.claim("w1") is None   # still backing off
+        clock.now += jobqueue.RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+    jobqueue.claim("w1")
+    assert jobqueue.fail(task_id, "w1", "boom") == "failed"
+    assert jobqueue.open_task("site_a") is None
+
+
+def test_a_retry_replaces_what_the_lost_attempt_wrote(clock, db, monkeypatch):
+    db.register_blob("aa11", "screenshots/blobs/aa/aa11.png")
+    seen = []
+
+    def run_site(job_id, timestamp=None):
+        seen.append(timestamp)
+        db.add_capture({"site": "example", "timestamp": timestamp, "path": f"x/{timestamp}.png", "blob": "aa11"})
+        return False, None, None
+    monkeypatch.setattr(jobs, "run_site", run_site)
+    monkeypatch.setattr(worker.image_writer, "flush", lambda: None)
+    monkeypatch.setattr(worker.site_state, "flush", lambda: None)
+
+    jobqueue.enqueue("site_a", "https://a.example/")
+    lost = jobqueue.claim("w1")
+    clock.now += jobqueue.LEASE_SECONDS + 1
+    retry = jobqueue.claim("w2")
+    w = worker.Worker("test")
+    w.run_task(lost, "w1")      # finishes late, its complete() is refused
+    w.run_task(retry, "w2")
+
+    assert seen[0] == seen[1]
+    assert len(db.recent_captures("example")) == 1
+    row = db.connect().execute("SELECT refs FROM blobs WHERE hash = 'aa11'").fetchone()
+    assert row["refs"] == 1
+    assert jobqueue.get_tasks([retry["id"]])[retry["id"]]["state"] == "done"
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+import scheduler
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    yield
+    with scheduler._lock:
+        scheduler._pending.clear()
+        scheduler._active.clear()
+        scheduler._followers.clear()
+        scheduler._host_waiting.clear()
+        scheduler._host_running.clear()
+
+
+def _blocked_run():
+    gate, started = threading.Event(), threading.Event()
+
+    def func():
+        started.set()
+        gate.wait(5)
+        return "ok"
+    return func, gate, started
+
+
+def _wait_for(check, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if check():
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+def _idle(*job_ids):
+    def check():
+        with scheduler._lock:
+            return not (set(job_ids) & (scheduler._running | set(scheduler._pending)))
+    return _wait_for(check)
+
+
+def test_same_host_runs_wait_and_record_their_lag():
+    first, gate, started = _blocked_run()
+    assert scheduler._dispatch("t_a", first, "https://same.example/a") == ("queued", False)
+    assert started.wait(5)
+    second, gate2, started2 = _blocked_run()
+    gate2.set()
+    assert scheduler._dispatch("t_b", second, "https://same.example/b") == ("queued", False)
+    assert scheduler.scheduler_stats()["waiting_for_host"] == 1
+    assert "t_b" in scheduler._pending
+    threading.Event().wait(0.05)
+    gate.set()
+    assert started2.wait(5)
+    assert _idle("t_a", "t_b")
+    stats = scheduler.scheduler_stats()
+    assert stats["queue_depth"] == 0
+    assert stats["lag_by_job"]["t_b"] >= 0.05
+
+
+def test_a_site_already_running_is_followed_not_run_twice():
+    func, gate, started = _blocked_run()
+    scheduler._dispatch("t_c", func, "https://c.example/")
+    assert started.wait(5)
+    done = []
+    state = scheduler.run_now("t_c", func, "https://c.example/",
+                              follower=(lambda: None, lambda outcome, error, seconds: done.append(outcome)))
+    assert state == ("running", True)
+    assert "t_c:now" not in scheduler._pending
+    gate.set()
+    assert _idle("t_c")
+    assert _wait_for(lambda: done)
+    assert done == ["ok"]
+
@@ -0,0 +1,137 @@
+import pytest
+
+import storage
+
+
+def _blob(db, digest):
+    db.register_blob(digest, f"screenshots/blobs/{digest[:2]}/{digest}.png")
+
+
+def _refs(digest):
+    row = storage.connect().execute("SELECT refs FROM blobs WHERE hash = ?", (digest,)).fetchone()
+    return row["refs"]
+
+
+def _capture(blob, ts="20260101_120000", tiles=None):
+    record = {"site": "example", "timestamp": ts, "path": f"screenshots/example/{ts}.png", "blob": blob}
+    if tiles:
+        record["tiles"] = [{"blob": t} for t in tiles]
+    return record
+
+
+def test_capture_refs_follow_insert_and_delete(db):
+    _blob(db, "aa11")
+    db.add_capture(_capture("aa11"))
+    db.add_capture(_capture("aa11", ts="20260101_120100"))
+    assert _refs("aa11") == 2
+    db.delete_captures(c["id"] for c in db.recent_captures("example"))
+    assert _refs("aa11") == 0
+
+
+def test_replacing_a_capture_releases_the_old_blobs(db):
+    for digest in ("aa11", "bb22", "cc33"):
+        _blob(db, digest)
+    db.add_capture(_capture("aa11", tiles=["cc33"]))
+    db.add_capture(_capture("aa11", tiles=["cc33"]))
+    assert (_refs("aa11"), _refs("cc33")) == (1, 1)
+
+    db.add_capture(_capture("bb22"))
+    assert (_refs("aa11"), _refs("bb22"), _refs("cc33")) == (0, 1, 0)
+    assert len(db.recent_captures("example")) == 1
+
+    db.delete_captures(c["id"] for c in db.recent_captures("example"))
+    assert _refs("bb22") == 0
+
+
+def test_replacing_a_change_releases_the_old_blobs(db):
+    for digest in ("aa11", "bb22", "cc33"):
+        _blob(db, digest)
+    change = {"timestamp": "20260101_120000", "prev_blob": "aa11", "curr_blob": "bb22", "compare": {"mse": 12.0}}
+    db.add_change("example", change)
+    db.add_change("example", change)
+    assert (_refs("aa11"), _refs("bb22")) == (1, 1)
+
+    db.add_change("example", dict(change, curr_blob="cc33"))
+    assert (_refs("aa11"), _refs("bb22"), _refs("cc33")) == (1, 0, 1)
+
+    changes, _ = db.changes_page("example")
+    db.delete_changes(c["id"] for c in changes)
+    assert (_refs("aa11"), _refs("cc33")) == (0, 0)
+
+
+def test_unreferenced_blobs_are_only_taken_once_idle(db):
+    _blob(db, "aa11")
+    db.add_capture(_capture("aa11"))
+    db.delete_captures(c["id"] for c in db.recent_captures("example"))
+    assert db.take_unreferenced_blobs(min_age_seconds=600) == []
+    assert [b["hash"] for b in db.take_unreferenced_blobs(min_age_seconds=-1)] == ["aa11"]
+
+
+def _changes(db, count, viewport=""):
+    for i in range(count):
+        db.add_change("example", {"timestamp": f"20260101_12{i // 60:02d}{i % 60:02d}", "viewport": viewport,
+                                  "compare": {"mse": float(i)}, "dismissed": i % 3 == 0})
+
+
+def _walk(db, **filters):
+    pages, cursor = [], None
+    while True:
+        items, cursor = db.changes_page("example", cursor=cursor, **filters)
+        pages.append([c["timestamp"] for c in items])
+        if cursor is None:
+            return pages
+
+
+def test_cursor_pages_cover_the_history_once_newest_first(db):
+    _changes(db, 45)
+    pages = _walk(db, limit=20)
+    assert [len(p) for p in pages] == [20, 20, 5]
+    flat = [ts for page in pages for ts in page]
+    assert flat == sorted(flat, reverse=True) and len(set(flat)) == 45
+
+
+def test_cursor_keeps_same_timestamp_rows_apart(db):
+    for viewport in ("1366x768", "390x844", "768x1024"):
+        db.add_change("example", {"timestamp": "20260101_120000", "viewport": viewport})
+    pages = []
+    items, cursor = db.changes_page("example", limit=2)
+    pages.append(items)
+    items, cursor = db.changes_page("example", limit=2, cursor=cursor)
+    pages.append(items)
+    assert cursor is None
+    assert sorted(c["viewport"] for page in pages for c in page) == ["1366x768", "390x844", "768x1024"]
+
+
+def test_filtered_pages_stop_at_the_scan_cap(db, monkeypatch):
+    monkeypatch.setattr(storage, "HISTORY_SCAN_MAX", 10)
+    _changes(db, 45)
+    items, cursor = db.changes_page("example", limit=20, max_score=5)
+    assert items == [] and cursor is not None   # the newest 10 rows scored 35-44
+    pages = _walk(db, limit=20, min_score=10, max_score=19)
+    assert sorted(ts for page in pages for ts in page) == [f"20260101_1200{i:02d}" for i in range(10, 20)]
+
+
+def test_dismissed_filter_and_bad_cursor(db):
+    _changes(db, 9)
+    items, _ = db.changes_page("example", dismissed=True)
+    assert len(items) == 3 and all(c["dismissed"] for c in items)
+    with pytest.raises(ValueError):
+        db.changes_page("example", cursor="nonsense")
+
+
+def test_deleting_a_site_takes_its_history_and_blob_refs(db):
+    for digest in ("aa11", "bb22"):
+        _blob(db, digest)
+    db.save_site("site_example", {"site_name": "example"})
+    db.save_site("site_other", {"site_name": "other"})
+    db.add_capture(_capture("aa11", tiles=["bb22"]))
+    db.add_capture(dict(_capture("aa11"), site="other"))
+    db.add_change("example", {"timestamp": "20260101_120000", "prev_blob": "aa11", "curr_blob": "bb22"})
+    db.get_summary("example")
+
+    db.delete_site("site_example")
+
+    assert db.recent_captures("example") == [] and db.changes_page("example")[0] == []
+    assert (_refs("aa11"), _refs("bb22")) == (1, 0)   # "other" still uses aa11
+    assert db.connect().execute("SELECT 1 FROM site_summary WHERE site_name = 'example'").fetchone() is None
+    assert len(db.recent_captures("other")) == 1
@@ -0,0 +1,84 @@
+import os
+import threading
+
+import cv2
+
+import image_writer
+
+### Compact previews for the dashboard cards, filmstrip and change history. Full-size PNGs are
+### only fetched by the lightbox. Thumbnails live in a thumbs/ folder next to the original:
+###   screenshots/site/20250101_000000.png -> screenshots/site/thumbs/20250101_000000_sm.webp
+THUMB_SIZES = {"sm": 360, "md": 640}   # name -> max width in px
+THUMB_FORMAT = "webp"                  # or "jpg" if your browsers are old
+THUMB_QUALITY = 80
+
+
+def _encode_params():
+    if THUMB_FORMAT == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, THUMB_QUALITY]
+    return [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY]
+
+
+def thumb_path(path, size):
+    folder, name = os.path.split(path)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(folder, "thumbs", f"{stem}_{size}.{THUMB_FORMAT}")
+
+
+def _resize(frame, width):
+    h, w = frame.shape[:2]
+    if w <= width:
+        return frame
+    return cv2.resize(frame, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+
+def write_thumbnail(path, frame, size):
+    out = thumb_path(path, size)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    ok, buf = cv2.imencode(f".{THUMB_FORMAT}", _resize(frame, THUMB_SIZES[size]), _encode_params())
+    if not ok:
+        raise IOError(f"Thumbnail encode failed for {out}")
+    tmp = f"{out}.{os.getpid()}.{threading.get_ident()}.tmp"   # worker.py processes can write the same file
+    with open(tmp, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(tmp, out)
+    return len(buf)
+
+
+def _write_all(path, frame):
+    return sum(write_thumbnail(path, frame, size) for size in THUMB_SIZES)
+
+
+def queue_thumbnails(path, frame):
+    """Generate every thumbnail size for path from the in-memory frame, off the capture thread."""
+    image_writer.submit(_write_all, path, frame, label=f"thumbnails for {path}")
+
+
+def ensure_thumbnail(path, size):
+    """Path to the thumbnail, built from the full-size file first if it's missing. None if it can't be."""
+    if size not in THUMB_SIZES:
+        return None
+    out = thumb_path(path, size)
+    if os.path.exists(out):
+        return out
+    frame = cv2.imread(path)
+    if frame is None:
+        return None
+    write_thumbnail(path, frame, size)
+    return out
+
+
+def remove_thumbnails(path):
+    for size in THUMB_SIZES:
+        try:
+            os.remove(thumb_path(path, size))
+        except FileNotFoundError:
+            pass
+
+
+def thumb_url(url, size="sm"):
+    """/static/screenshots/site/x.png -> /thumbs/sm/site/x.png (template filter)."""
+    prefix = "/static/screenshots/"
+    if not url or not url.startswith(prefix):
+        return url
+    return f"/thumbs/{size}/{url[len(prefix):]}"
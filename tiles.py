@@ -0,0 +1,195 @@
+import base64
+import time
+
+import cv2
+import numpy as np
+
+import blobstore
+import stages
+from compare import compare_frames, build_mask, downscale, MSE_THRESHOLD, ALIGN_SHIFTS
+
+### Full-page and element-scoped capture. Instead of one screenshot of the viewport, the page (or
+### one element's bounding box) is grabbed in horizontal tiles with CDP Page.captureScreenshot,
+### and each tile is compared against the baseline tile at the same offset as soon as it arrives:
+###   - only one tile pair is decoded at a time, a 1366x20000 page never exists as one array
+###   - tiles are content-addressed blobs, so the unchanged parts of a long page are stored once
+###   - an identical tile is settled by its digest, the baseline tile isn't even read from disk
+###   - once TILE_EARLY_STOP tiles have changed we stop comparing (the rest is still stored,
+###     it's the next baseline)
+### A tile is judged on its own, against the usual MSE threshold, so a change at the bottom of a
+### long page isn't averaged away by everything that stayed the same.
+CAPTURE_MODES = ("viewport", "full_page", "element")
+TILE_HEIGHT = 2048          # device px per tile
+MAX_PAGE_HEIGHT = 30000     # device px, anything below this is not captured
+TILE_EARLY_STOP = 3         # changed tiles before the rest are only stored, not compared
+PRESCROLL_STEP_MS = 100     # full-page: scroll through once so lazy images/sections load
+
+_RECT_JS = """
+const sel = arguments[0];
+const dpr = window.devicePixelRatio || 1;
+if (sel) {
+  const el = document.querySelector(sel);
+  if (!el) return null;
+  const r = el.getBoundingClientRect();
+  return {x: r.left + window.scrollX, y: r.top + window.scrollY, width: r.width, height: r.height, dpr: dpr};
+}
+const d = document.documentElement, b = document.body || d;
+return {x: 0, y: 0, width: d.clientWidth, height: Math.max(d.scrollHeight, b.scrollHeight, d.clientHeight), dpr: dpr};
+"""
+
+_PRESCROLL_JS = """
+const maxY = arguments[0], stepMs = arguments[1];
+const done = arguments[arguments.length - 1];
+function step() {
+  const bottom = Math.min(document.documentElement.scrollHeight, maxY) - window.innerHeight;
+  if (window.scrollY >= bottom) { window.scrollTo(0, 0); done(true); return; }
+  window.scrollBy(0, window.innerHeight);
+  setTimeout(step, stepMs);
+}
+step();
+"""
+
+
+class TiledBaseline:
+    """The previous full-page/element capture: per tile its offset, height, digest and blob path.
+    Only the downscaled copies are kept in memory, full tiles are read back when one differs."""
+    def __init__(self, tiles):
+        self.tiles = tiles   # [{"y", "h", "digest", "path", "small"}]
+        self.path = tiles[0]["path"] if tiles else None
+        self.digest = tiles[0]["digest"] if tiles else None
+        self.nbytes = sum(t["small"].nbytes for t in tiles if t.get("small") is not None) + 256 * len(tiles)
+
+    @classmethod
+    def from_record(cls, record):
+        return cls([{"y": t["y"], "h": t["h"], "digest": t["blob"], "path": t["path"], "small": None}
+                    for t in record.get("tiles") or []])
+
+
+def prescroll(driver):
+    """Scroll through the page once and back to the top, so lazy-loaded content below the fold is there."""
+    try:
+        driver.set_script_timeout(60)
+        driver.execute_async_script(_PRESCROLL_JS, MAX_PAGE_HEIGHT, PRESCROLL_STEP_MS)
+    except Exception as e:
+        print(f"[!] Pre-scroll failed, lazy content below the fold may be missing: {e}")
+
+
+def capture_rect(driver, mode, selector=None):
+    """Area to capture in CSS px (page coordinates), or None if the element isn't on the page."""
+    rect = driver.execute_script(_RECT_JS, selector if mode == "element" else None)
+    if not rect or rect["width"] <= 0 or rect["height"] <= 0:
+        return None
+    return rect
+
+
+def iter_tiles(driver, rect):
+    """Yield (y, frame) for each tile of rect, y in device px from the top of the rect."""
+    dpr = rect.get("dpr") or 1
+    height = min(rect["height"], MAX_PAGE_HEIGHT / dpr)
+    step = TILE_HEIGHT / dpr
+    y = 0.0
+    while y < height:
+        h = min(step, height - y)
+        with stages.stage("screenshot"):
+            shot = driver.execute_cdp_cmd("Page.captureScreenshot", {
+                "format": "png",
+                "captureBeyondViewport": True,
+                "clip": {"x": rect["x"], "y": rect["y"] + y, "width": rect["width"], "height": h, "scale": 1},
+            })
+        with stages.stage("decode"):
+            frame = cv2.imdecode(np.frombuffer(base64.b64decode(shot["data"]), np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise IOError(f"Could not decode tile at y={y}")
+        yield round(y * dpr), frame
+        y += step
+
+
+def _shift(rects, dx, dy):
+    return [[x - dx, y - dy, w, h] for x, y, w, h in rects]
+
+
+def _merge_regions(into, scores):
+    # a watch region that spans tiles reports its worst tile
+    for name, score in scores.items():
+        if name not in into or score["mse"] > into[name]["mse"]:
+            into[name] = score
+
+
+def compare_stream(tile_iter, baseline, threshold=MSE_THRESHOLD, ignore=None, watch=None,
+                   origin=(0, 0), early_stop=TILE_EARLY_STOP, comparator=None, align=ALIGN_SHIFTS):
+    """Store and compare tiles as tile_iter produces them.
+
+    ignore/watch are resolved regions in device px relative to the page (origin is where the
+    captured rect starts, for element mode). Returns the new tiles, the changed ones (with the
+    tile's ignore rects and alignment shift, what diffs.py needs to draw them) and a summary in the same shape compare.summarize() gives for a single frame.
+    """
+    start = time.perf_counter()
+    prev_tiles = {t["y"]: t for t in baseline.tiles} if baseline else {}
+    tiles, changed, regions = [], [], {}
+    compared, worst, working = 0, 0.0, 0
+
+    for y, frame in tile_iter:
+        with stages.stage("store"):
+            digest, path = blobstore.put(frame)
+        small = downscale(frame)
+        tile = {"y": y, "h": frame.shape[0], "digest": digest, "path": path, "small": small}
+        tiles.append(tile)
+        if baseline is None or len(changed) >= early_stop:
+            continue
+
+        compared += 1
+        prev = prev_tiles.get(y)
+        if prev is None or prev["h"] != tile["h"]:
+            # page got longer or shorter
+            changed.append({"y": y, "prev": prev, "curr": tile, "mse": None})
+            continue
+        if prev["digest"] == digest:
+            continue
+
+        with stages.stage("baseline"):
+            prev_frame = cv2.imread(prev["path"])
+        if prev_frame is None or prev_frame.shape != frame.shape:
+            changed.append({"y": y, "prev": None, "curr": tile, "mse": None})
+            continue
+        dx, dy = origin[0], origin[1] + y
+        # only the rects that reach into this tile, the rest don't change its mask
+        tile_ignore = [r for r in _shift(ignore or [], dx, dy)
+                       if r[0] < frame.shape[1] and r[0] + r[2] > 0 and r[1] < frame.shape[0] and r[1] + r[3] > 0]
+        tile_watch = [{**w, "rects": _shift(w["rects"], dx, dy)} for w in watch or []]
+        with stages.stage("diff"):
+            result = compare_frames(prev_frame, frame, threshold=threshold,
+                                    prev_digest=prev["digest"], curr_digest=digest,
+                                    prev_small=prev.get("small"), curr_small=small,
+                                    mask=build_mask(frame.shape, tile_ignore), watch=tile_watch,
+                                    comparator=comparator, align=align)
+        _merge_regions(regions, result["regions"])
+        worst = max(worst, result["mse"])
+        working = max(working, result["working_bytes"] + prev_frame.nbytes + frame.nbytes)
+        if result["significant"]:
+            changed.append({"y": y, "prev": prev, "curr": tile, "mse": result["mse"],
+                            "ignore": tile_ignore, "shift": result.get("shift")})
+
+    # tiles the page no longer has
+    if baseline is not None and len(changed) < early_stop:
+        for y in sorted(set(prev_tiles) - {t["y"] for t in tiles}):
+            changed.append({"y": y, "prev": prev_tiles[y], "curr": None, "mse": None})
+
+    seconds = time.perf_counter() - start
+    return {
+        "tiles": tiles,
+        "changed": changed,
+        "significant": bool(changed),
+        "summary": {
+            "tier": "tiled",
+            "comparator": comparator or "mse",
+            "mse": round(float(worst), 3),
+            "lowres_mse": None,
+            "seconds": round(seconds, 4),
+            "working_bytes": int(working),
+            "regions": regions,
+            "tiles": len(tiles),
+            "tiles_compared": compared,
+            "tiles_changed": len(changed),
+            "early_stop": len(changed) >= early_stop and compared < len(tiles),
+        },
+    }
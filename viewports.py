@@ -0,0 +1,58 @@
+### Breakpoints a site is captured at. The site record's "viewport" is either a single [w, h] or a
+### list of them, e.g. [[1366, 768], [768, 1024], [390, 844]]. The first one is the primary view
+### (the dashboard card); capture_job loads and settles the page once, then screenshots each one.
+### Captures and changes carry a "viewport" label ("390x844"); rows from before this have "".
+DEFAULT_VIEWPORT = (1366, 768)
+MAX_VIEWPORTS = 6
+
+
+def normalize(value):
+    """[w, h] or [[w, h], ...] -> list of (w, h) tuples. Raises ValueError on bad input."""
+    if not value:
+        return [DEFAULT_VIEWPORT]
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("viewport must be [w, h] or a list of [w, h]")
+    items = value if isinstance(value[0], (list, tuple)) else [value]
+    result = []
+    for item in items:
+        if not (isinstance(item, (list, tuple)) and len(item) == 2):
+            raise ValueError(f"bad viewport {item!r}, expected [w, h]")
+        try:
+            w, h = int(item[0]), int(item[1])
+        except (TypeError, ValueError):
+            raise ValueError(f"bad viewport {item!r}, expected [w, h]")
+        if w <= 0 or h <= 0:
+            raise ValueError(f"bad viewport {item!r}, width and height must be positive")
+        if (w, h) not in result:
+            result.append((w, h))
+    if len(result) > MAX_VIEWPORTS:
+        raise ValueError(f"at most {MAX_VIEWPORTS} viewports per site")
+    return result
+
+
+def to_record(viewports):
+    """What gets stored on the site record: a bare [w, h] for one viewport, a list for several."""
+    if len(viewports) == 1:
+        return list(viewports[0])
+    return [list(v) for v in viewports]
+
+
+def for_site(site):
+    try:
+        return normalize(site.get("viewport"))
+    except ValueError:
+        return [DEFAULT_VIEWPORT]
+
+
+def label(viewport):
+    return f"{viewport[0]}x{viewport[1]}"
+
+
+def group(items, site_viewports):
+    """[(label, [items])] in the site's breakpoint order. Pre-viewport rows ("") go with the primary."""
+    labels = [label(v) for v in site_viewports]
+    groups = {l: [] for l in labels}
+    for item in items:
+        key = item.get("viewport") or labels[0]
+        groups.setdefault(key, []).append(item)
+    return [(l, g) for l, g in groups.items() if g or l == labels[0]]
@@ -1,226 +1,332 @@
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
-from datetime import datetime, timedelta
-from PIL import Image
-import os, json, shutil
 import cv2
 import numpy as np
+from compare import compare_frames, summarize, build_mask, MSE_THRESHOLD
+import regions as regions_mod
 
-def crop_image_to_exact_size(path, expected_width, expected_height):
-    """Crop the bottom of the image if it's taller than expected."""
-    try:
-        with Image.open(path) as img:
-            width, height = img.size
-            if height > expected_height or width > expected_width:
-                cropped = img.crop((0, 0, expected_width, expected_height))
-                cropped.save(path)
-                print(f"[✓] Cropped screenshot to {expected_width}x{expected_height}")
-    except Exception as e:
-        print(f"[!] Failed to crop image {path}: {e}")
-### fix issue where sometimes firefox process would not quit correctly.  Now uses try>finally logic.
-from PIL import Image
+### fix issue where sometimes firefox process would not quit correctly.  Browser lifetime now lives in browser_pool.py.
 import time
+import browser_pool
+from page_settle import wait_for_settle
+import baseline_cache
+import storage
+import blobstore
+import diffs
+import retention
+import viewports
+import tiles
+import stages
+import metrics
+import site_state
+import blocking as blocking_mod
+import asset_cache
+import replay
+from functools import partial
 
-def capture_job(url, site_name, viewport=(1366, 768), cookie_selector=None, wait_time=2):
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
+### seconds a page gets to re-layout after switching breakpoint (media queries, responsive images)
+RESIZE_SETTLE_SECONDS = 1.5
+
+@metrics.track_capture
+def capture_job(url, site_name, viewport=(1366, 768), cookie_selector=None, wait_time=2, regions=None,
+                capture_mode="viewport", capture_selector=None, comparator=None, align_shifts=None, blocking=None,
+                use_asset_cache=True, snapshot=False, timestamp=None):
     from selenium.webdriver.common.by import By
 
-    options = Options()
-    ###20250907 - comment out the below line if you have frequent issues with font rendering being slightly different.  
-    ###headless can apparently do this sometimes. Technically more resource intensive, but 
-    ###not by much. If you are extremely performance constrained, set a higher threshold for 
-    ###MSE error rate on line 102 below
-    #options.add_argument("--headless=new")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--window-size={},{}".format(viewport[0], viewport[1] + 120))  # pad for header
-
-    driver = webdriver.Chrome(options=options)
-    driver.set_window_rect(0, 0, viewport[0], viewport[1] + 120)  # extra for chrome border
-
-    try:
-        driver.get(url)
-        time.sleep(wait_time)
+    ###viewport can be a list of breakpoints (see viewports.py): the page is loaded, settled and the
+    ###cookie banner clicked once, then each breakpoint is emulated and screenshotted in turn
+    breakpoints = viewports.normalize(viewport)
+    ###capture_mode "full_page" / "element" (capture_selector's box) are tiled, see tiles.py
+    if capture_mode not in tiles.CAPTURE_MODES:
+        print(f"[!] Unknown capture mode {capture_mode!r} for {site_name}, using viewport")
+        capture_mode = "viewport"
+    ###comparator "mse" (default) or "ssim", align_shifts lines up content that moved vertically (compare.py)
+    compare_options = {"comparator": comparator}
+    if align_shifts is not None:
+        compare_options["align"] = align_shifts
+    pending = []
+    ###request counts are filled in once the browser is done, every breakpoint's record shares them
+    network = {}
+
+    ###browser comes from the warm pool now (see browser_pool.py), it gets reset and handed back on exit
+    with browser_pool.pool.checkout(breakpoints[0]) as driver:
+        ###trackers, ads and whatever the site's "blocking" lists are never fetched (blocking.py)
+        blocker = blocking_mod.Blocker(site_name, url, blocking).apply(driver)
+        ###static assets come from the session's persistent cache (asset_cache.py) unless the site opts out
+        if not use_asset_cache:
+            asset_cache.set_disabled(driver, True)
+        with stages.stage("navigate"):
+            driver.get(url)
+        ###wait_time is now the upper bound, we stop as soon as the page has actually settled
+        settle_seconds = wait_for_settle(driver, wait_time)
         ###20250910 assign a system font to override site-supplied fonts, as they may change slightly. 
         driver.execute_script("""const style = document.createElement('style');style.innerHTML = '* { font-family: Arial, sans-serif !important; }';document.head.appendChild(style);""")
         # Accept cookies if selector exists
         if cookie_selector:
             try:
-                accept_btn = driver.find_element(By.CSS_SELECTOR, cookie_selector)
-                accept_btn.click()
-                time.sleep(1)  # allow banner to disappear
+                with stages.stage("cookies"):
+                    accept_btn = driver.find_element(By.CSS_SELECTOR, cookie_selector)
+                    accept_btn.click()
+                settle_seconds += wait_for_settle(driver, 1)  # allow banner to disappear
             except Exception:
                 print("[!] Cookie accept selector not found or failed")
 
         # Scroll to top and stabilize
         driver.execute_script("window.scrollTo(0, 0);")
-        time.sleep(0.5)
+        settle_seconds += wait_for_settle(driver, 0.5)
+        print(f"[✓] {site_name} settled in {settle_seconds:.2f}s (budget {wait_time}s)")
 
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        ###a queued task passes its own timestamp (worker.py), so a retry rewrites the same rows instead of adding more
+        timestamp = timestamp or time.strftime("%Y%m%d_%H%M%S")
         ts = timestamp # this exists bc at some point I used the var 'ts' instead of timestamp and now I still am not 100% sure where all it is registered.
         out_dir = f"screenshots/{site_name}"
-        os.makedirs(out_dir, exist_ok=True)
-        screenshot_path = f"{out_dir}/{timestamp}.png"
-        driver.save_screenshot(screenshot_path)
+        ###page archive for replaying this capture offline (replay.py), only for sites that keep them
+        snapshot_path = None
+        if snapshot:
+            with stages.stage("snapshot"):
+                snapshot_path = replay.save(driver, site_name, timestamp)
 
-        # Crop to exact viewport size (failsafe)
-        img = Image.open(screenshot_path)
-        cropped = img.crop((0, 0, viewport[0], viewport[1]))
-        cropped.save(screenshot_path)
+        for i, vp in enumerate(breakpoints):
+            shot_settle = settle_seconds
+            if i:
+                browser_pool.emulate_viewport(driver, vp)
+                driver.execute_script("window.scrollTo(0, 0);")
+                shot_settle = wait_for_settle(driver, RESIZE_SETTLE_SECONDS)
+            if capture_mode == "full_page":
+                with stages.stage("settle"):
+                    tiles.prescroll(driver)
+                shot_settle += wait_for_settle(driver, 0.5)
+            ###ignore/watch regions, selectors resolved to boxes now that the page is where we'll screenshot it
+            resolved_regions = regions_mod.resolve(driver, regions) if regions else None
 
-        print(f"[✓] Saved screenshot: {screenshot_path}")
+            if capture_mode != "viewport":
+                rect = tiles.capture_rect(driver, capture_mode, capture_selector)
+                if rect is None:
+                    print(f"[!] {capture_selector!r} not found on {site_name} @ {viewports.label(vp)}, nothing captured")
+                    continue
+                ###tiles are compared and stored as they come off the browser, never held as one page
+                with stages.stage("baseline"):
+                    baseline = baseline_cache.get_baseline(site_name, out_dir, viewport=vp, mode=capture_mode)
+                dpr = rect.get("dpr") or 1
+                streamed = tiles.compare_stream(
+                    tiles.iter_tiles(driver, rect), baseline,
+                    ignore=resolved_regions["ignore"] if resolved_regions else None,
+                    watch=resolved_regions["watch"] if resolved_regions else None,
+                    origin=(round(rect["x"] * dpr), round(rect["y"] * dpr)), **compare_options)
+                pending.append(partial(_record_tiled, site_name, vp, capture_mode, baseline is not None,
+                                       streamed, timestamp, shot_settle, network, snapshot_path))
+                continue
+            ###grab the PNG in memory, we decode it once below and write it to the blob store at most once
+            with stages.stage("screenshot"):
+                png_bytes = driver.get_screenshot_as_png()
+            pending.append(partial(_process_shot, site_name, vp, png_bytes, resolved_regions, timestamp, out_dir, shot_settle, compare_options, network, snapshot_path))
 
-    finally:
-        if driver:
-            try:
-                driver.quit()
-                print("[✓] WebDriver quit successfully.")
-            except Exception as quit_err:
-                print(f"[!] Error quitting WebDriver: {quit_err}")
-    folder = out_dir # make sure this is defined like I have above so it knows where to save
-    existing_images = sorted([f for f in os.listdir(folder) if f.endswith('.png')])
-    prev_img_path = os.path.join(folder, existing_images[-2]) if len(existing_images) >= 2 else None
-    if not prev_img_path:
-        return False, None, screenshot_path
+        network.update(blocker.finish(driver) or {})
+        if not use_asset_cache:
+            asset_cache.set_disabled(driver, False)
+    if network:
+        print(f"[✓] {site_name}: {network['loaded']} requests loaded ({network['from_cache']} from cache, {network['bytes'] / 1e3:.0f} kB), "
+              f"{network['blocked']} blocked (~{network['est_bytes_saved'] / 1e3:.0f} kB saved)")
+        for outcome in ("loaded", "blocked", "failed"):
+            metrics.REQUESTS.inc(network[outcome], site=site_name, outcome=outcome)
+        metrics.BYTES.inc(network["bytes"], site=site_name, kind="loaded")
+        metrics.BYTES.inc(network["est_bytes_saved"], site=site_name, kind="saved_estimate")
 
-    def mse(imageA, imageB):
-        return np.mean((imageA.astype("float") - imageB.astype("float")) ** 2)
+    results = [record() for record in pending]
 
-    def load_cv_image(path):
-        return cv2.imread(path)
+    with stages.stage("cleanup"):
+        cleanup_old_screenshots(site_name)
 
-    img1 = load_cv_image(prev_img_path)
-    img2 = load_cv_image(screenshot_path)
-    is_significant = False
+    ###callers get the first breakpoint that changed, or the primary one
+    return next((r for r in results if r[0]), results[0] if results else (False, None, None))
 
-    if img1 is None or img2 is None:
-        print("[ERROR] One of the images could not be loaded.")
-    else:
-        if img1.shape != img2.shape:
-            img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
-        error = mse(img1, img2)
-        print(f"[DEBUG] MSE for {site_name}: {error}")
-        if error > 50:
-            is_significant = True
-            print(f"[VISUAL CHANGE] Detected for {site_name} at {timestamp}")
-            changes_dir = f"{folder}/changes"
-            os.makedirs(changes_dir, exist_ok=True)
-
-            # --- Generate and save a visual diff image ---
-            diff_image = cv2.absdiff(img1, img2)
-            gray_diff = cv2.cvtColor(diff_image, cv2.COLOR_BGR2GRAY)
-            _, thresh = cv2.threshold(gray_diff, 30, 255, cv2.THRESH_BINARY)
-            highlighted = img2.copy()
-            highlighted[thresh > 0] = [0, 0, 255]  # Highlight changed pixels in red
-
-            diff_path = os.path.join(changes_dir, f"{timestamp}_diff.png")
-            cv2.imwrite(diff_path, highlighted)
-            print(f"[✓] Saved visual diff at: {diff_path}")
-        if is_significant:
-            changes_dir = f"{folder}/changes"
-            os.makedirs(changes_dir, exist_ok=True)
-
-            prev_copy = os.path.join(changes_dir, f"{timestamp}_prev.png")
-            curr_copy = os.path.join(changes_dir, f"{timestamp}_curr.png")
-            shutil.copyfile(prev_img_path, prev_copy)
-            shutil.copyfile(screenshot_path, curr_copy)
-
-            change_record = {
-                "timestamp": timestamp,
-                "prev": f"/static/screenshots/{site_name}/changes/{timestamp}_prev.png",
-                "curr": f"/static/screenshots/{site_name}/changes/{timestamp}_curr.png",
-                "diff": f"/static/screenshots/{site_name}/changes/{timestamp}_diff.png",
-                "is_significant_change": True,
-                "dismissed": False
-            }
-
-            change_log = os.path.join(changes_dir, "change_log.json")
-            changes = []
-            if os.path.exists(change_log):
-                with open(change_log, "r") as f:
-                    try:
-                        changes = json.load(f)
-                    except json.JSONDecodeError:
-                        print(f"[!] Invalid change_log.json")
-            changes.append(change_record)
-            with open(change_log, "w") as f:
-                json.dump(changes, f, indent=2)
-
-            with open(os.path.join(changes_dir, f"{timestamp}.json"), "w") as f:
-                json.dump(change_record, f, indent=2)
-                print(f"[✓] Saved individual change JSON at: {changes_dir}/{timestamp}.json")
+def _record_tiled(site_name, viewport, mode, had_baseline, streamed, timestamp, settle_seconds, network=None, snapshot=None):
+    """Record a full-page/element capture that tiles.compare_stream() already compared."""
+    vp_label = viewports.label(viewport)
+    name = f"{site_name} @ {vp_label} ({mode})"
+    new_tiles = streamed["tiles"]
+    if not new_tiles:
+        print(f"[ERROR] No tiles captured for {name}")
+        return False, None, None
+    baseline_cache.cache.put(baseline_cache.cache_key(site_name, vp_label, mode), tiles.TiledBaseline(new_tiles))
+    screenshot_path = new_tiles[0]["path"]
+    comparison = streamed["summary"] if had_baseline else None
+    print(f"[✓] Captured {len(new_tiles)} tiles for {name}")
+    if comparison:
+        print(f"[DEBUG] {name}: {comparison['tiles_compared']}/{comparison['tiles']} tiles compared, "
+              f"{comparison['tiles_changed']} changed, worst MSE {comparison['mse']} ({comparison['seconds'] * 1000:.1f} ms)")
 
-            try:
-                from app import monitored_sites, save_sites
-                job_id = f"site_{site_name}"
-                site = monitored_sites.get(job_id, {})
-                site["change_detected"] = True
-                monitored_sites[job_id] = site
-                save_sites(monitored_sites)
-                print(f"[✓] Updated monitored_sites for {job_id}")
-            except Exception as e:
-                print(f"[!] Failed to update monitored_sites: {e}")
-
-    meta_path = os.path.join(folder, 'metadata.json')
-    metadata = []
-    if os.path.exists(meta_path):
-        with open(meta_path, 'r') as f:
-            try:
-                metadata = json.load(f)
-            except json.JSONDecodeError:
-                print(f"[!] Invalid metadata file: {f.name}")
-    metadata.append({
+    is_significant = streamed["significant"]
+    prev_img_path = None
+    if is_significant:
+        print(f"[VISUAL CHANGE] Detected for {name} at {timestamp}")
+        change_tiles = []
+        for changed in streamed["changed"]:
+            prev_blob = changed["prev"]["digest"] if changed["prev"] else None
+            curr_blob = changed["curr"]["digest"] if changed["curr"] else None
+            ###diff images are drawn on first view (diffs.py), a tile that was scored gets a URL for one
+            diff = diffs.diff_url(prev_blob, curr_blob, changed.get("ignore"), changed.get("shift")) \
+                if changed["mse"] is not None else None
+            change_tiles.append({
+                "y": changed["y"],
+                "prev_blob": prev_blob,
+                "curr_blob": curr_blob,
+                "diff": diff,
+                "mse": changed["mse"],
+            })
+        ###the record's prev/curr/diff show the first tile that changed, all of them are in "tiles"
+        lead = next((t for t in change_tiles if t["prev_blob"] and t["curr_blob"]), change_tiles[0])
+        prev_img_path = blobstore.blob_path(lead["prev_blob"]) if lead["prev_blob"] else None
+        url_for = lambda digest: blobstore.blob_url(blobstore.blob_path(digest)) if digest else None
+        storage.add_change(site_name, {
+            "timestamp": timestamp,
+            "viewport": vp_label,
+            "capture_mode": mode,
+            "prev": url_for(lead["prev_blob"]),
+            "curr": url_for(lead["curr_blob"]),
+            "diff": lead["diff"],
+            "prev_blob": lead["prev_blob"],
+            "curr_blob": lead["curr_blob"],
+            "tiles": change_tiles,
+            "is_significant_change": True,
+            "dismissed": False,
+            "compare": comparison,
+            "regions": comparison["regions"]
+        })
+        print(f"[✓] Recorded change for {name} at {timestamp} ({len(change_tiles)} tiles)")
+
+        try:
+            site_state.update(f"site_{site_name}", change_detected=True)
+        except Exception as e:
+            print(f"[!] Failed to update site record: {e}")
+
+    storage.add_capture({
         "timestamp": timestamp,
         "site": site_name,
+        "viewport": vp_label,
+        "capture_mode": mode,
         "path": screenshot_path,
-        "is_significant_change": is_significant
+        "blob": new_tiles[0]["digest"],
+        "tiles": [{"blob": t["digest"], "path": t["path"], "y": t["y"], "h": t["h"]} for t in new_tiles],
+        "is_significant_change": is_significant,
+        "settle_seconds": round(settle_seconds, 3),
+        "compare": comparison,
+        "network": network or None,
+        "snapshot": snapshot
     })
-    with open(meta_path, 'w') as f:
-        json.dump(metadata, f, indent=2)
-
-    cleanup_old_screenshots(site_name)
 
     return is_significant, prev_img_path, screenshot_path
 
-def cleanup_old_screenshots(site_name, keep_minutes=1440):
-    folder = f'screenshots/{site_name}'
-    meta_path = f'{folder}/metadata.json'
-    if not os.path.exists(meta_path):
-        return
+def _process_shot(site_name, viewport, png_bytes, resolved_regions, timestamp, out_dir, settle_seconds, compare_options, network=None, snapshot=None):
+    """Compare one breakpoint's screenshot against its own baseline and record it."""
+    vp_label = viewports.label(viewport)
+    name = f"{site_name} @ {vp_label}"
 
-    with open(meta_path, 'r') as f:
-        try:
-            metadata = json.load(f)
-        except json.JSONDecodeError:
-            print(f"[!] Invalid metadata in {meta_path}")
-            return
+    # Crop to exact viewport size (failsafe), slicing the decoded frame instead of a PIL round trip
+    with stages.stage("decode"):
+        decoded = cv2.imdecode(np.frombuffer(png_bytes, np.uint8), cv2.IMREAD_COLOR)
+    with stages.stage("crop"):
+        img2 = decoded[:viewport[1], :viewport[0]] if decoded is not None else None
+    if img2 is None:
+        print(f"[ERROR] Could not decode screenshot for {name}")
+        return False, None, None
+    ###frames are stored by pixel digest (blobstore.py), an unchanged page doesn't get written again
+    current = baseline_cache.Baseline(None, img2)
+    current.path = screenshot_path = blobstore.blob_path(current.digest)
+    print(f"[✓] Captured screenshot for {name}: {current.digest}")
+
+    folder = out_dir # make sure this is defined like I have above so it knows where to save
+    ###previous frame comes from the in-memory baseline cache, disk is only touched after a restart/eviction
+    with stages.stage("baseline"):
+        baseline = baseline_cache.get_baseline(site_name, folder, viewport=viewport)
+    baseline_cache.cache.put(baseline_cache.cache_key(site_name, vp_label), current)
+    with stages.stage("store"):
+        blobstore.put(img2, current.digest)
+    if baseline is None:
+        storage.add_capture({
+            "timestamp": timestamp,
+            "site": site_name,
+            "viewport": vp_label,
+            "path": screenshot_path,
+            "blob": current.digest,
+            "is_significant_change": False,
+            "settle_seconds": round(settle_seconds, 3),
+            "network": network or None,
+            "snapshot": snapshot
+        })
+        return False, None, screenshot_path
+
+    prev_img_path = baseline.path
+    img1 = baseline.frame
+    is_significant = False
+    comparison = None
 
-    now = datetime.now()
-    updated = []
-    for item in metadata:
-        path = item.get('path', '')
+    ###tiered compare, see compare.py. Identical frames stop at a digest check, near-identical at a cheap MSE precheck
+    mask = build_mask(img1.shape, resolved_regions["ignore"]) if resolved_regions else None
+    watch = resolved_regions["watch"] if resolved_regions else None
+    ###different sizes are compared on their common area, shifted content is lined up first (compare.py)
+    with stages.stage("diff"):
+        result = compare_frames(img1, img2, threshold=MSE_THRESHOLD,
+                                prev_digest=baseline.digest, curr_digest=current.digest,
+                                prev_small=baseline.small, curr_small=current.small,
+                                mask=mask, watch=watch, **compare_options)
+    comparison = summarize(result)
+    print(f"[DEBUG] MSE for {name}: {result['mse']} ({result['tier']} tier, {result['seconds'] * 1000:.1f} ms, ~{result['working_bytes'] / 1e6:.1f} MB est.)")
+    if result.get("comparator") not in (None, "mse"):
+        print(f"[DEBUG]   {result['comparator']} score {result['score']}")
+    if result.get("shift"):
+        print(f"[DEBUG]   content from row {result['shift']['row']} moved {result['shift']['by']}px, scored after aligning")
+    for region_name, score in result["regions"].items():
+        print(f"[DEBUG]   region {region_name}: {score['mse']} (threshold {score['threshold']}){' CHANGED' if score['changed'] else ''}")
+    if result["significant"]:
+        is_significant = True
+        print(f"[VISUAL CHANGE] Detected for {name} at {timestamp}")
 
-        # Protect anything inside the /changes/ directory
-        if "/changes/" in path:
-            updated.append(item)
-            continue
+        with stages.stage("store"):
+            # the baseline may be a pre-blob file from before the upgrade, this makes sure it's a blob too
+            _, prev_img_path = blobstore.put(img1, baseline.digest)
+
+        ###change record references the blobs, nothing gets copied into changes/ any more.
+        ###The diff image isn't drawn here, diffs.py renders it from the two blobs the first time it's viewed
+        change_record = {
+            "timestamp": timestamp,
+            "viewport": vp_label,
+            "prev": blobstore.blob_url(prev_img_path),
+            "curr": blobstore.blob_url(screenshot_path),
+            "diff": diffs.diff_url(baseline.digest, current.digest,
+                                   resolved_regions["ignore"] if resolved_regions else None, result.get("shift")),
+            "prev_blob": baseline.digest,
+            "curr_blob": current.digest,
+            "is_significant_change": True,
+            "dismissed": False,
+            "compare": comparison,
+            "regions": comparison["regions"]
+        }
+
+        ###one indexed insert instead of rewriting change_log.json and a per-change json file
+        storage.add_change(site_name, change_record)
+        print(f"[✓] Recorded change for {name} at {timestamp}")
 
         try:
-            ts = datetime.strptime(item['timestamp'], '%Y%m%d_%H%M%S')
-        except ValueError:
-            print(f"[!] Skipping malformed timestamp: {item.get('timestamp')}")
-            continue
-
-        age = now - ts
-        keep = item.get('is_significant_change', False) or age < timedelta(minutes=keep_minutes)
-        if keep:
-            updated.append(item)
-        else:
-            try:
-                os.remove(path)
-                print(f"[🗑] Deleted old screenshot: {path}")
-            except FileNotFoundError:
-                pass
+            site_state.update(f"site_{site_name}", change_detected=True)
+        except Exception as e:
+            print(f"[!] Failed to update site record: {e}")
+
+    storage.add_capture({
+        "timestamp": timestamp,
+        "site": site_name,
+        "viewport": vp_label,
+        "path": screenshot_path,
+        "blob": current.digest,
+        "is_significant_change": is_significant,
+        "settle_seconds": round(settle_seconds, 3),
+        "compare": comparison,
+        "network": network or None,
+        "snapshot": snapshot
+    })
+
+    return is_significant, prev_img_path, screenshot_path
 
-    with open(meta_path, 'w') as f:
-        json.dump(updated, f, indent=2)
+def cleanup_old_screenshots(site_name):
+    """Trim this site right after a capture, with the same policy the hourly sweep uses.
+    Freed blobs are left for the hourly retention.run() to collect, not scanned for per capture."""
+    _, site = site_state.find(site_name)
+    return retention.apply_site(site_name, site, collect=False)
@@ -0,0 +1,109 @@
+import argparse
+import os
+import signal
+import socket
+import threading
+
+import browser_pool
+import image_writer
+import jobqueue
+import jobs
+import metrics
+import site_state
+
+### Capture worker: pulls tasks from the queue (jobqueue.py) and runs them, so the browsers don't
+### have to live in the Flask process. Start as many as the hardware allows, on the host that has
+### the database and the screenshots/ folder (SQLite WAL can't be shared over a network filesystem):
+###     python worker.py --concurrency 2
+### The site record is read when the task starts (jobs.run_site), so edits and pauses since it
+### was queued apply.
+### A task is only marked done once its frames are on disk and its rows committed; a worker that
+### crashes half way loses its lease and the task runs again in another slot. Every attempt writes
+### under the task's timestamp, so a retry replaces whatever the lost attempt committed.
+POLL_SECONDS = 2      # idle wait between claims when the queue is empty
+
+
+class Worker:
+    def __init__(self, name=None, concurrency=1):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.stopping = threading.Event()
+
+    def _heartbeat(self, task, worker_id, done):
+        while not done.wait(jobqueue.HEARTBEAT_SECONDS):
+            if not jobqueue.heartbeat(task["id"], worker_id):
+                print(f"[!] {worker_id} lost the lease on task {task['id']} ({task['job_id']}), its result will be dropped")
+                return
+
+    def run_task(self, task, worker_id):
+        job_id = task["job_id"]
+        lag = max(0.0, task["started_at"] - task["planned_at"])
+        metrics.SCHEDULER_LAG.observe(lag)
+        print(f"[→] {worker_id} running {job_id} (task {task['id']}, attempt {task['attempts']}, {lag:.0f}s late)")
+        done = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(task, worker_id, done), daemon=True)
+        beat.start()
+        try:
+            outcome = jobs.run_site(job_id, timestamp=jobqueue.task_timestamp(task))
+            if outcome is None:
+                result = {"skipped": True}
+            else:
+                changed, before, after = outcome
+                result = {"significant": bool(changed), "prev": before, "curr": after}
+            # blob and site record writes are async, the task only counts as done once they're on disk
+            image_writer.flush()
+            site_state.flush()
+        except Exception as e:
+            done.set()
+            outcome = jobqueue.fail(task["id"], worker_id, repr(e))
+            print(f"[!] {job_id} failed on attempt {task['attempts']} ({outcome or 'lease lost'}): {e}")
+            return
+        done.set()
+        if not jobqueue.complete(task["id"], worker_id, result):
+            print(f"[!] {job_id} finished after its lease was taken over, result not recorded")
+
+    def _loop(self, index):
+        worker_id = f"{self.name}/{index}"
+        while not self.stopping.is_set():
+            try:
+                task = jobqueue.claim(worker_id)
+            except Exception as e:
+                print(f"[!] {worker_id} could not claim a task: {e}")
+                task = None
+            if task is None:
+                self.stopping.wait(POLL_SECONDS)
+                continue
+            self.run_task(task, worker_id)
+
+    def run(self):
+        print(f"[✓] Worker {self.name} started with {self.concurrency} slot(s)")
+        browser_pool.pool.max_sessions = self.concurrency
+        threads = [threading.Thread(target=self._loop, args=(i,), name=f"worker-{i}") for i in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for t in threads:
+                t.join()
+        browser_pool.pool.close()
+        print(f"[✓] Worker {self.name} stopped")
+
+    def stop(self, *_):
+        if not self.stopping.is_set():
+            print(f"[⏸] Worker {self.name} finishing current captures, no new ones")
+        self.stopping.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued captures (see jobqueue.py)")
+    parser.add_argument("--concurrency", type=int, default=browser_pool.POOL_MAX_SESSIONS,
+                        help="captures this worker runs at once")
+    parser.add_argument("--name", help="worker name in leases and logs (default host:pid)")
+    args = parser.parse_args()
+    worker = Worker(args.name, args.concurrency)
+    signal.signal(signal.SIGTERM, worker.stop)
+    worker.run()